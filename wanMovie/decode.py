@@ -0,0 +1,188 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Decodes the latents written by `generate.py --latent_only`, so that sampling
+and VAE decoding run as separately scheduled processes:
+
+    python generate.py --task t2v-14B --ckpt_dir ./Wan2.1-T2V-14B --latent_only --save_file out/cat.mp4 ...
+    python decode.py --ckpt_dir ./Wan2.1-T2V-14B --input out --watch
+
+Every worker claims a latent file with a `.lock` file next to it, so several
+workers can poll the same directory. The latent file and its lock are removed
+once the video is written. Kept latents (--keep_latents) and latents that failed
+to decode keep their lock, which marks them as done.
+"""
+import argparse
+import glob
+import logging
+import os
+import sys
+import time
+import warnings
+
+warnings.filterwarnings('ignore')
+
+import torch
+
+from wan.configs import WAN_CONFIGS
+from wan.modules.vae import WanVAE
+from wan.utils.latents import load_latents
+from wan.utils.planner import VAE_TILE_OVERLAP
+from wan.utils.utils import cache_image, cache_video_stream
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Decode latents written by generate.py --latent_only")
+    parser.add_argument(
+        "--ckpt_dir",
+        type=str,
+        required=True,
+        help="The path to the checkpoint directory holding the VAE.")
+    parser.add_argument(
+        "--input",
+        type=str,
+        nargs="+",
+        required=True,
+        help="Latent files, or directories searched for .safetensors files.")
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default=None,
+        help="The directory of the decoded files. Defaults to the output path recorded by generate.py."
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        default=False,
+        help="Keep polling the input directories for new latents.")
+    parser.add_argument(
+        "--poll_interval",
+        type=float,
+        default=5.0,
+        help="Seconds between two scans of the input directories with --watch."
+    )
+    parser.add_argument(
+        "--keep_latents",
+        action="store_true",
+        default=False,
+        help="Keep the latent files after decoding.")
+    parser.add_argument(
+        "--vae_tile_size",
+        type=int,
+        default=None,
+        help="Decode in spatial tiles of this many pixels to bound VAE memory, a multiple of 8."
+    )
+    parser.add_argument(
+        "--vae_chunk_size",
+        type=int,
+        default=1,
+        help="The number of latent frames decoded at once. Trades memory for throughput."
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda",
+        help="The device to run the VAE on.")
+    parser.add_argument(
+        "--vae_cpu_mode",
+        action="store_true",
+        default=False,
+        help="Decode on the CPU in bf16 with channels-last layouts and fused norms, see tests/vae_cpu_parity.py for its accuracy."
+    )
+    args = parser.parse_args()
+    assert args.vae_tile_size is None or args.vae_tile_size % 8 == 0, \
+        f"vae_tile_size must be a multiple of 8."
+    assert args.vae_chunk_size >= 1, f"vae_chunk_size must be positive."
+    assert not args.vae_cpu_mode or torch.device(args.device).type == 'cpu', \
+        f"vae_cpu_mode requires --device cpu."
+    return args
+
+
+def _find_latents(inputs):
+    paths = []
+    for u in inputs:
+        if os.path.isdir(u):
+            paths.extend(sorted(glob.glob(os.path.join(u, '*.safetensors'))))
+        else:
+            paths.append(u)
+    return paths
+
+
+def _claim(path):
+    # the first worker creating the lock file owns the latents, a lock left by
+    # a crashed worker has to be removed by hand
+    try:
+        os.close(os.open(f'{path}.lock', os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        return False
+
+
+def _decode(path, vaes, args, device):
+    latent, metadata = load_latents(path, device)
+    cfg = WAN_CONFIGS[metadata['task']]
+    vae_pth = os.path.join(args.ckpt_dir, cfg.vae_checkpoint)
+    if vae_pth not in vaes:
+        vaes[vae_pth] = WanVAE(
+            vae_pth=vae_pth,
+            device=device,
+            tile_size=args.vae_tile_size,
+            tile_overlap=VAE_TILE_OVERLAP,
+            chunk_size=args.vae_chunk_size,
+            cpu_mode=args.vae_cpu_mode)
+    vae = vaes[vae_pth]
+
+    save_file = metadata['output']
+    if args.output_dir is not None:
+        save_file = os.path.join(args.output_dir, os.path.basename(save_file))
+    os.makedirs(os.path.dirname(os.path.abspath(save_file)), exist_ok=True)
+
+    start = time.perf_counter()
+    if "t2i" in metadata['task']:
+        with torch.no_grad():
+            image = vae.decode([latent])[0]
+        cache_image(
+            tensor=image.squeeze(1)[None],
+            save_file=save_file,
+            nrow=1,
+            normalize=True,
+            value_range=(-1, 1))
+    else:
+        cache_video_stream(
+            vae.decode_stream(latent),
+            save_file=save_file,
+            fps=metadata.get('fps', cfg.sample_fps),
+            value_range=(-1, 1))
+    logging.info(f"Decoded {path} to {save_file} in "
+                 f"{time.perf_counter() - start:.2f}s.")
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+    args = _parse_args()
+    device = torch.device(args.device)
+
+    vaes = {}
+    while True:
+        for path in _find_latents(args.input):
+            if not os.path.exists(path) or not _claim(path):
+                continue
+            try:
+                _decode(path, vaes, args, device)
+            except Exception:
+                # the lock stays, the file is not picked up again
+                logging.exception(f"Could not decode {path}.")
+                continue
+            if not args.keep_latents:
+                os.remove(path)
+                os.remove(f'{path}.lock')
+        if not args.watch:
+            break
+        time.sleep(args.poll_interval)
+
+
+if __name__ == "__main__":
+    main()
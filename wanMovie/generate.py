@@ -4,7 +4,9 @@ from datetime import datetime
 import logging
 import os
 import sys
+import threading
 import warnings
+from functools import partial
 
 warnings.filterwarnings('ignore')
 
@@ -14,8 +16,15 @@ from PIL import Image
 
 import wan
 from wan.configs import WAN_CONFIGS, SIZE_CONFIGS, MAX_AREA_CONFIGS, SUPPORTED_SIZES
+from wan.utils.daemon import GenerationDaemon
+from wan.utils.latents import LATENT_DTYPES, save_latents
+from wan.utils.planner import (VAE_TILE_OVERLAP, estimate_plan, format_plan,
+                                plan_execution)
+from wan.utils.preview import (LatentPreviewer, PreviewWriter,
+                               preview_projection_path)
+from wan.utils.stages import TextEncodingStage
 from wan.utils.prompt_extend import DashScopePromptExpander, QwenPromptExpander
-from wan.utils.utils import cache_video, cache_image, str2bool
+from wan.utils.utils import cache_video_stream, cache_image, str2bool
 
 EXAMPLE_PROMPT = {
     "t2v-1.3B": {
@@ -67,7 +76,7 @@ def _validate_args(args):
         task], f"Unsupport size {args.size} for task {args.task}, supported sizes are: {', '.join(SUPPORTED_SIZES[args.task])}"
 
 
-def _parse_args():
+def _build_parser():
     parser = argparse.ArgumentParser(
         description="Generate a image or video from a text prompt or image using Wan"
     )
@@ -101,6 +110,87 @@ def _parse_args():
         default=None,
         help="Whether to offload the model to CPU after each model forward, reducing GPU memory usage."
     )
+    parser.add_argument(
+        "--offload_blocks",
+        type=int,
+        default=None,
+        help="Stream the DiT blocks from CPU, keeping only this many blocks resident on the GPU while the next ones are prefetched."
+    )
+    parser.add_argument(
+        "--attn_chunk_size",
+        type=int,
+        default=None,
+        help="The number of query tokens processed at once by the DiT attention layers.")
+    parser.add_argument(
+        "--ffn_chunk_size",
+        type=int,
+        default=None,
+        help="The number of tokens processed at once by the DiT feed-forward layers.")
+    parser.add_argument(
+        "--vae_tile_size",
+        type=int,
+        default=None,
+        help="The spatial tile size in pixels of the VAE encode and decode, a multiple of 8. Bounds the VAE memory at any resolution."
+    )
+    parser.add_argument(
+        "--vae_chunk_size",
+        type=int,
+        default=1,
+        help="The number of latent frames processed at once by the VAE decoder, and of 4-frame chunks by the encoder. Trades memory for throughput."
+    )
+    parser.add_argument(
+        "--i2v_cond_chunks",
+        type=int,
+        default=20,
+        help="The number of 4-frame chunks after the input image that are VAE encoded exactly for image-to-video conditioning, the others reuse latents precomputed per resolution. The default 20 encodes all frames, fewer chunks are faster but approximate the conditioning."
+    )
+    parser.add_argument(
+        "--latent_only",
+        action="store_true",
+        default=False,
+        help="Write the sampled latents to a .safetensors file instead of decoding them, for decode.py workers to pick up."
+    )
+    parser.add_argument(
+        "--latent_dtype",
+        type=str,
+        default="fp16",
+        choices=list(LATENT_DTYPES.keys()),
+        help="The storage dtype of the latents written with --latent_only.")
+    parser.add_argument(
+        "--preview_every",
+        type=int,
+        default=None,
+        help="Write a low resolution preview of the denoised latents next to the output every N sampling steps, a GIF for videos. Uses a linear projection of the latents fitted once per VAE checkpoint."
+    )
+    parser.add_argument(
+        "--lora_path",
+        type=str,
+        default=None,
+        help="The path of a LoRA adapter (.safetensors or .pth) applied to the DiT.")
+    parser.add_argument(
+        "--lora_scale",
+        type=float,
+        default=1.0,
+        help="The strength of the LoRA adapter.")
+    parser.add_argument(
+        "--lora_merge",
+        type=str2bool,
+        default=True,
+        help="Whether to merge the LoRA adapter into the DiT weights instead of running its low-rank layers separately."
+    )
+    parser.add_argument(
+        "--memory_budget",
+        type=float,
+        default=None,
+        help="The GPU memory budget in GB. If given, offloading, T5 placement and chunk sizes are chosen by the memory planner."
+    )
+    parser.add_argument(
+        "--plan_only",
+        "--plan-only",
+        action="store_true",
+        default=False,
+        help="Print the estimated memory and time of the execution plan and exit without loading any model."
+    )
     parser.add_argument(
         "--ulysses_size",
         type=int,
@@ -121,6 +211,35 @@ def _parse_args():
         action="store_true",
         default=False,
         help="Whether to place T5 model on CPU.")
+    parser.add_argument(
+        "--t5_cache_dir",
+        type=str,
+        default=None,
+        help="The directory persisting prompt embeddings, so that repeated prompts skip T5.")
+    parser.add_argument(
+        "--i2v_cache_dir",
+        type=str,
+        default=None,
+        help="The directory persisting the CLIP features and VAE conditioning latents of input images, so that repeated images skip both encoders."
+    )
+    parser.add_argument(
+        "--i2v_cache_size",
+        type=int,
+        default=16,
+        help="The number of input images whose conditioning is kept in memory.")
+    parser.add_argument(
+        "--t5_quant",
+        type=str,
+        default=None,
+        choices=["int8"],
+        help="Run the T5 model quantized on CPU, requires --t5_cpu. The quantized checkpoint is created next to the T5 checkpoint on first use, see wan/utils/quantize.py for the parity report."
+    )
+    parser.add_argument(
+        "--t5_socket",
+        type=str,
+        default=None,
+        help="The Unix socket of a text encoder server (python -m wan.utils.text_server) used instead of loading T5."
+    )
     parser.add_argument(
         "--dit_fsdp",
         action="store_true",
@@ -186,14 +305,69 @@ def _parse_args():
         type=float,
         default=5.0,
         help="Classifier free guidance scale.")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        default=False,
+        help="Keep the models resident and serve generation jobs over a local HTTP or Unix-socket API instead of generating once."
+    )
+    parser.add_argument(
+        "--daemon_host",
+        type=str,
+        default="127.0.0.1",
+        help="The host the daemon listens on.")
+    parser.add_argument(
+        "--daemon_port",
+        type=int,
+        default=8088,
+        help="The port the daemon listens on.")
+    parser.add_argument(
+        "--daemon_socket",
+        type=str,
+        default=None,
+        help="The Unix socket the daemon listens on instead of host and port.")
+    parser.add_argument(
+        "--daemon_queue_size",
+        type=int,
+        default=8,
+        help="The maximum number of jobs waiting in the daemon queue.")
+    parser.add_argument(
+        "--daemon_batch_size",
+        type=int,
+        default=4,
+        help="The maximum number of queued t2i jobs with the same settings sampled together in one batch. Jobs with --preview_every run alone."
+    )
+    return parser
+
 
-    args = parser.parse_args()
+def _parse_args(argv=None):
+    parser = _build_parser()
+    args = parser.parse_args(argv)
 
     _validate_args(args)
 
     return args
 
 
+def _job_argv(job):
+    # jobs use the argument schema of the command line, either as a list of
+    # arguments or as a dict mapping argument names to values
+    if isinstance(job, list):
+        return [str(arg) for arg in job]
+    assert isinstance(job, dict), f"Unsupport job: {job}"
+    actions = _build_parser()._option_string_actions
+    argv = []
+    for name, value in job.items():
+        option = f"--{name}"
+        assert option in actions, f"Unsupport job argument: {name}"
+        if isinstance(actions[option], argparse._StoreTrueAction):
+            if value:
+                argv.append(option)
+        elif value is not None:
+            argv += [option, str(value)]
+    return argv
+
+
 def _init_logging(rank):
     # logging
     if rank == 0:
@@ -206,17 +380,53 @@ def _init_logging(rank):
         logging.basicConfig(level=logging.ERROR)
 
 
-def generate(args):
-    rank = int(os.getenv("RANK", 0))
-    world_size = int(os.getenv("WORLD_SIZE", 1))
-    local_rank = int(os.getenv("LOCAL_RANK", 0))
-    device = local_rank
-    _init_logging(rank)
+def _plan(args, cfg, world_size=1):
+    # the plan is per rank, sharded models split their weights across ranks
+    parallel = dict(
+        dit_shards=world_size if args.dit_fsdp else 1,
+        t5_shards=world_size if args.t5_fsdp else 1,
+        sp_size=args.ulysses_size * args.ring_size)
+    if args.memory_budget is not None:
+        # a quantized or remote T5 runs on the CPU
+        t5_cpu = True if args.t5_quant or args.t5_socket else None
+        plan = plan_execution(
+            cfg,
+            SIZE_CONFIGS[args.size],
+            args.frame_num,
+            args.memory_budget,
+            t5_cpu=t5_cpu,
+            vae_chunk_size=args.vae_chunk_size,
+            sampling_steps=args.sample_steps,
+            **parallel)
+        args.offload_model = plan.offload_model
+        args.offload_blocks = plan.offload_blocks
+        args.t5_cpu = plan.t5_cpu
+        args.attn_chunk_size = plan.attn_chunk_size
+        args.ffn_chunk_size = plan.ffn_chunk_size
+        args.vae_tile_size = plan.vae_tile_size
+        if not plan.fits:
+            logging.warning(
+                f"No execution plan fits in {args.memory_budget} GB, using the one with the lowest peak memory."
+            )
+    else:
+        plan = estimate_plan(
+            cfg,
+            SIZE_CONFIGS[args.size],
+            args.frame_num,
+            offload_model=args.offload_model,
+            offload_blocks=args.offload_blocks,
+            t5_cpu=args.t5_cpu or args.t5_socket is not None,
+            attn_chunk_size=args.attn_chunk_size,
+            ffn_chunk_size=args.ffn_chunk_size,
+            vae_tile_size=args.vae_tile_size,
+            vae_chunk_size=args.vae_chunk_size,
+            sampling_steps=args.sample_steps,
+            **parallel)
+    logging.info(f"Execution plan:\n{format_plan(plan)}")
+    return plan
 
-    if args.offload_model is None:
-        args.offload_model = False if world_size > 1 else True
-        logging.info(
-            f"offload_model is not specified, set to {args.offload_model}.")
+
+def _init_distributed(args, rank, world_size, local_rank):
     if world_size > 1:
         torch.cuda.set_device(local_rank)
         dist.init_process_group(
@@ -245,59 +455,71 @@ def generate(args):
             ulysses_degree=args.ulysses_size,
         )
 
-    if args.use_prompt_extend:
-        if args.prompt_extend_method == "dashscope":
-            prompt_expander = DashScopePromptExpander(
-                model_name=args.prompt_extend_model, is_vl="i2v" in args.task)
-        elif args.prompt_extend_method == "local_qwen":
-            prompt_expander = QwenPromptExpander(
-                model_name=args.prompt_extend_model,
-                is_vl="i2v" in args.task,
-                device=rank)
-        else:
-            raise NotImplementedError(
-                f"Unsupport prompt_extend_method: {args.prompt_extend_method}")
 
-    cfg = WAN_CONFIGS[args.task]
+def _check_args(args, world_size):
+    if args.offload_model is None:
+        args.offload_model = False if world_size > 1 else True
+        logging.info(
+            f"offload_model is not specified, set to {args.offload_model}.")
+    assert not (
+        args.dit_fsdp and args.offload_blocks is not None
+    ), f"offload_blocks is not supported together with dit_fsdp."
+    assert not (
+        args.dit_fsdp and args.lora_path is not None
+    ), f"lora_path is not supported together with dit_fsdp."
+    assert args.t5_quant is None or args.t5_cpu, f"t5_quant requires t5_cpu."
+    assert args.vae_tile_size is None or args.vae_tile_size % 8 == 0, \
+        f"vae_tile_size must be a multiple of 8."
+    assert args.vae_chunk_size >= 1, f"vae_chunk_size must be positive."
+    assert args.preview_every is None or args.preview_every >= 1, \
+        f"preview_every must be positive."
     if args.ulysses_size > 1:
+        cfg = WAN_CONFIGS[args.task]
         assert cfg.num_heads % args.ulysses_size == 0, f"`{cfg.num_heads=}` cannot be divided evenly by `{args.ulysses_size=}`."
 
-    logging.info(f"Generation job args: {args}")
-    logging.info(f"Generation model config: {cfg}")
 
+def _create_prompt_expander(args, rank):
+    if args.prompt_extend_method == "dashscope":
+        return DashScopePromptExpander(
+            model_name=args.prompt_extend_model, is_vl="i2v" in args.task)
+    elif args.prompt_extend_method == "local_qwen":
+        return QwenPromptExpander(
+            model_name=args.prompt_extend_model,
+            is_vl="i2v" in args.task,
+            device=rank)
+    else:
+        raise NotImplementedError(
+            f"Unsupport prompt_extend_method: {args.prompt_extend_method}")
+
+
+def _extend_prompt(args, prompt_expander, rank, img=None):
+    logging.info("Extending prompt ...")
+    if rank == 0:
+        kwargs = {} if img is None else {"image": img}
+        prompt_output = prompt_expander(
+            args.prompt,
+            tar_lang=args.prompt_extend_target_lang,
+            seed=args.base_seed,
+            **kwargs)
+        if prompt_output.status == False:
+            logging.info(f"Extending prompt failed: {prompt_output.message}")
+            logging.info("Falling back to original prompt.")
+            input_prompt = args.prompt
+        else:
+            input_prompt = prompt_output.prompt
+        input_prompt = [input_prompt]
+    else:
+        input_prompt = [None]
     if dist.is_initialized():
-        base_seed = [args.base_seed] if rank == 0 else [None]
-        dist.broadcast_object_list(base_seed, src=0)
-        args.base_seed = base_seed[0]
+        dist.broadcast_object_list(input_prompt, src=0)
+    args.prompt = input_prompt[0]
+    logging.info(f"Extended prompt: {args.prompt}")
 
-    if "t2v" in args.task or "t2i" in args.task:
-        if args.prompt is None:
-            args.prompt = EXAMPLE_PROMPT[args.task]["prompt"]
-        logging.info(f"Input prompt: {args.prompt}")
-        if args.use_prompt_extend:
-            logging.info("Extending prompt ...")
-            if rank == 0:
-                prompt_output = prompt_expander(
-                    args.prompt,
-                    tar_lang=args.prompt_extend_target_lang,
-                    seed=args.base_seed)
-                if prompt_output.status == False:
-                    logging.info(
-                        f"Extending prompt failed: {prompt_output.message}")
-                    logging.info("Falling back to original prompt.")
-                    input_prompt = args.prompt
-                else:
-                    input_prompt = prompt_output.prompt
-                input_prompt = [input_prompt]
-            else:
-                input_prompt = [None]
-            if dist.is_initialized():
-                dist.broadcast_object_list(input_prompt, src=0)
-            args.prompt = input_prompt[0]
-            logging.info(f"Extended prompt: {args.prompt}")
 
+def _create_pipeline(args, cfg, device, rank):
+    if "t2v" in args.task or "t2i" in args.task:
         logging.info("Creating WanT2V pipeline.")
-        wan_t2v = wan.WanT2V(
+        return wan.WanT2V(
             config=cfg,
             checkpoint_dir=args.ckpt_dir,
             device_id=device,
@@ -306,11 +528,117 @@ def generate(args):
             dit_fsdp=args.dit_fsdp,
             use_usp=(args.ulysses_size > 1 or args.ring_size > 1),
             t5_cpu=args.t5_cpu,
+            offload_blocks=args.offload_blocks,
+            t5_cache_dir=args.t5_cache_dir,
+            t5_quant=args.t5_quant,
+            t5_socket=args.t5_socket,
         )
+    else:
+        logging.info("Creating WanI2V pipeline.")
+        return wan.WanI2V(
+            config=cfg,
+            checkpoint_dir=args.ckpt_dir,
+            device_id=device,
+            rank=rank,
+            t5_fsdp=args.t5_fsdp,
+            dit_fsdp=args.dit_fsdp,
+            use_usp=(args.ulysses_size > 1 or args.ring_size > 1),
+            t5_cpu=args.t5_cpu,
+            offload_blocks=args.offload_blocks,
+            t5_cache_dir=args.t5_cache_dir,
+            t5_quant=args.t5_quant,
+            t5_socket=args.t5_socket,
+            cond_cache_size=args.i2v_cache_size,
+            cond_cache_dir=args.i2v_cache_dir,
+        )
+
+
+def _configure_model(args, pipeline):
+    # per-job settings of a resident model
+    pipeline.model.set_chunk_sizes(args.attn_chunk_size, args.ffn_chunk_size)
+    pipeline.vae.set_tiling(args.vae_tile_size, VAE_TILE_OVERLAP)
+    pipeline.vae.set_chunk_size(args.vae_chunk_size)
+    adapters = pipeline.model.adapters
+    if args.lora_path is not None:
+        if args.lora_path not in adapters.adapters:
+            adapters.load(args.lora_path, args.lora_path)
+        adapters.activate(
+            args.lora_path, scale=args.lora_scale, merge=args.lora_merge)
+    else:
+        adapters.deactivate()
+
+
+def _default_save_file(args):
+    formatted_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+    formatted_prompt = args.prompt.replace(" ", "_").replace("/", "_")[:50]
+    suffix = '.png' if "t2i" in args.task else '.mp4'
+    if args.latent_only:
+        suffix = '.safetensors'
+    return f"{args.task}_{args.size.replace('*','x') if sys.platform=='win32' else args.size}_{args.ulysses_size}_{args.ring_size}_{formatted_prompt}_{formatted_time}" + suffix
+
+
+def _save_latents(args, cfg, latent, save_file):
+    # the latents go to <root>.safetensors and name the file decode.py writes,
+    # save_file itself unless it is the latent file
+    root, suffix = os.path.splitext(save_file)
+    output = save_file
+    if suffix == '.safetensors':
+        output = root + ('.png' if "t2i" in args.task else '.mp4')
+    metadata = dict(
+        task=args.task,
+        size=args.size,
+        frame_num=args.frame_num,
+        fps=cfg.sample_fps,
+        prompt=args.prompt,
+        image=args.image,
+        seed=args.base_seed,
+        sample_solver=args.sample_solver,
+        sample_steps=args.sample_steps,
+        sample_shift=args.sample_shift,
+        sample_guide_scale=args.sample_guide_scale,
+        output=os.path.abspath(output))
+    logging.info(f"Saving latents to {root}.safetensors")
+    return save_latents(f"{root}.safetensors", latent, metadata,
+                        LATENT_DTYPES[args.latent_dtype])
+
+
+def _preview_writer(args, cfg, pipeline, rank):
+    if args.preview_every is None or rank != 0:
+        return None
+    if args.save_file is None:
+        args.save_file = _default_save_file(args)
+    vae_pth = os.path.join(args.ckpt_dir, cfg.vae_checkpoint)
+    if vae_pth not in _previewers:
+        _previewers[vae_pth] = LatentPreviewer.from_vae(
+            pipeline.vae, preview_projection_path(vae_pth))
+    root = os.path.splitext(args.save_file)[0]
+    suffix = '.png' if "t2i" in args.task else '.gif'
+    logging.info(f"Writing previews to {root}_preview{suffix}")
+    return PreviewWriter(
+        _previewers[vae_pth], f"{root}_preview{suffix}", every=args.preview_every)
+
+
+# fitted preview projections per VAE checkpoint
+_previewers = {}
+
+
+def _run(args, cfg, pipeline, rank, prompt_expander=None, context=None):
+    if dist.is_initialized():
+        base_seed = [args.base_seed] if rank == 0 else [None]
+        dist.broadcast_object_list(base_seed, src=0)
+        args.base_seed = base_seed[0]
+
+    if args.prompt is None:
+        args.prompt = EXAMPLE_PROMPT[args.task]["prompt"]
+    if "t2v" in args.task or "t2i" in args.task:
+        logging.info(f"Input prompt: {args.prompt}")
+        if args.use_prompt_extend:
+            _extend_prompt(args, prompt_expander, rank)
 
         logging.info(
             f"Generating {'image' if 't2i' in args.task else 'video'} ...")
-        video = wan_t2v.generate(
+        preview = _preview_writer(args, cfg, pipeline, rank)
+        video = pipeline.generate(
             args.prompt,
             size=SIZE_CONFIGS[args.size],
             frame_num=args.frame_num,
@@ -319,11 +647,12 @@ def generate(args):
             sampling_steps=args.sample_steps,
             guide_scale=args.sample_guide_scale,
             seed=args.base_seed,
-            offload_model=args.offload_model)
+            offload_model=args.offload_model,
+            context=context,
+            decode="t2i" in args.task and not args.latent_only,
+            step_callback=preview)
 
     else:
-        if args.prompt is None:
-            args.prompt = EXAMPLE_PROMPT[args.task]["prompt"]
         if args.image is None:
             args.image = EXAMPLE_PROMPT[args.task]["image"]
         logging.info(f"Input prompt: {args.prompt}")
@@ -331,42 +660,11 @@ def generate(args):
 
         img = Image.open(args.image).convert("RGB")
         if args.use_prompt_extend:
-            logging.info("Extending prompt ...")
-            if rank == 0:
-                prompt_output = prompt_expander(
-                    args.prompt,
-                    tar_lang=args.prompt_extend_target_lang,
-                    image=img,
-                    seed=args.base_seed)
-                if prompt_output.status == False:
-                    logging.info(
-                        f"Extending prompt failed: {prompt_output.message}")
-                    logging.info("Falling back to original prompt.")
-                    input_prompt = args.prompt
-                else:
-                    input_prompt = prompt_output.prompt
-                input_prompt = [input_prompt]
-            else:
-                input_prompt = [None]
-            if dist.is_initialized():
-                dist.broadcast_object_list(input_prompt, src=0)
-            args.prompt = input_prompt[0]
-            logging.info(f"Extended prompt: {args.prompt}")
-
-        logging.info("Creating WanI2V pipeline.")
-        wan_i2v = wan.WanI2V(
-            config=cfg,
-            checkpoint_dir=args.ckpt_dir,
-            device_id=device,
-            rank=rank,
-            t5_fsdp=args.t5_fsdp,
-            dit_fsdp=args.dit_fsdp,
-            use_usp=(args.ulysses_size > 1 or args.ring_size > 1),
-            t5_cpu=args.t5_cpu,
-        )
+            _extend_prompt(args, prompt_expander, rank, img=img)
 
         logging.info("Generating video ...")
-        video = wan_i2v.generate(
+        preview = _preview_writer(args, cfg, pipeline, rank)
+        video = pipeline.generate(
             args.prompt,
             img,
             max_area=MAX_AREA_CONFIGS[args.size],
@@ -376,17 +674,21 @@ def generate(args):
             sampling_steps=args.sample_steps,
             guide_scale=args.sample_guide_scale,
             seed=args.base_seed,
-            offload_model=args.offload_model)
+            offload_model=args.offload_model,
+            context=context,
+            decode=False,
+            cond_chunks=args.i2v_cond_chunks,
+            step_callback=preview)
+    if preview is not None:
+        preview.close()
 
     if rank == 0:
         if args.save_file is None:
-            formatted_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-            formatted_prompt = args.prompt.replace(" ", "_").replace("/",
-                                                                     "_")[:50]
-            suffix = '.png' if "t2i" in args.task else '.mp4'
-            args.save_file = f"{args.task}_{args.size.replace('*','x') if sys.platform=='win32' else args.size}_{args.ulysses_size}_{args.ring_size}_{formatted_prompt}_{formatted_time}" + suffix
+            args.save_file = _default_save_file(args)
 
-        if "t2i" in args.task:
+        if args.latent_only:
+            args.save_file = _save_latents(args, cfg, video, args.save_file)
+        elif "t2i" in args.task:
             logging.info(f"Saving generated image to {args.save_file}")
             cache_image(
                 tensor=video.squeeze(1)[None],
@@ -395,17 +697,225 @@ def generate(args):
                 normalize=True,
                 value_range=(-1, 1))
         else:
+            # decode straight into the writer, chunk by chunk
             logging.info(f"Saving generated video to {args.save_file}")
-            cache_video(
-                tensor=video[None],
+            cache_video_stream(
+                pipeline.vae.decode_stream(video),
                 save_file=args.save_file,
                 fps=cfg.sample_fps,
-                nrow=1,
-                normalize=True,
                 value_range=(-1, 1))
+    return args.save_file
+
+
+def _run_images(jobs_args, cfg, pipeline):
+    # t2i jobs that only differ in prompt, seed and output file, sampled in
+    # one batch
+    args = jobs_args[0]
+    for u in jobs_args:
+        u.prompt = u.prompt or EXAMPLE_PROMPT[u.task]["prompt"]
+    logging.info(f"Generating {len(jobs_args)} images ...")
+    images = pipeline.generate_images(
+        [u.prompt for u in jobs_args],
+        size=SIZE_CONFIGS[args.size],
+        shift=args.sample_shift,
+        sample_solver=args.sample_solver,
+        sampling_steps=args.sample_steps,
+        guide_scale=args.sample_guide_scale,
+        seed=[u.base_seed for u in jobs_args],
+        offload_model=args.offload_model,
+        decode=not args.latent_only)
+
+    save_files = []
+    for u, image in zip(jobs_args, images):
+        save_file = u.save_file or _default_save_file(u)
+        if save_file in save_files:
+            root, suffix = os.path.splitext(save_file)
+            save_file = f"{root}_{len(save_files)}{suffix}"
+        if args.latent_only:
+            save_files.append(_save_latents(u, cfg, image, save_file))
+            continue
+        logging.info(f"Saving generated image to {save_file}")
+        cache_image(
+            tensor=image[None],
+            save_file=save_file,
+            nrow=1,
+            normalize=True,
+            value_range=(-1, 1))
+        save_files.append(save_file)
+    return save_files
+
+
+def generate(args):
+    rank = int(os.getenv("RANK", 0))
+    world_size = int(os.getenv("WORLD_SIZE", 1))
+    local_rank = int(os.getenv("LOCAL_RANK", 0))
+    device = local_rank
+    _init_logging(rank)
+
+    _check_args(args, world_size)
+    if args.plan_only or args.memory_budget is not None:
+        _plan(args, WAN_CONFIGS[args.task], world_size)
+        # the plan overrides flags checked above
+        _check_args(args, world_size)
+        if args.plan_only:
+            return
+    _init_distributed(args, rank, world_size, local_rank)
+
+    prompt_expander = None
+    if args.use_prompt_extend:
+        prompt_expander = _create_prompt_expander(args, rank)
+
+    cfg = WAN_CONFIGS[args.task]
+    logging.info(f"Generation job args: {args}")
+    logging.info(f"Generation model config: {cfg}")
+
+    pipeline = _create_pipeline(args, cfg, device, rank)
+    _configure_model(args, pipeline)
+    _run(args, cfg, pipeline, rank, prompt_expander)
     logging.info("Finished.")
 
 
+def serve(argv=None):
+    r"""
+    Runs generate.py as a daemon. Every job is parsed as the daemon command line
+    followed by the job arguments, so jobs override the daemon defaults. Pipelines
+    are created on first use for each task and loading configuration and stay
+    resident, sharing their components through the component registry.
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    world_size = int(os.getenv("WORLD_SIZE", 1))
+    assert world_size == 1, "daemon mode runs in a single process."
+    _init_logging(0)
+
+    pipelines, prompt_expanders, stages = {}, {}, {}
+    stages_lock = threading.Lock()
+
+    def pipeline_key(args):
+        # every option passed to the pipeline constructor is part of the key
+        cache_dirs = [
+            None if u is None else os.path.abspath(u)
+            for u in (args.t5_cache_dir, args.i2v_cache_dir)
+        ]
+        return (args.task, os.path.abspath(args.ckpt_dir), args.t5_cpu,
+                args.t5_quant, args.t5_socket, args.offload_blocks,
+                args.i2v_cache_size, *cache_dirs)
+
+    def parse_job(job):
+        # argparse exits on invalid arguments, which would stop the worker
+        try:
+            return _parse_args(argv + _job_argv(job))
+        except SystemExit as e:
+            raise ValueError(f"Invalid job arguments: {job}") from e
+
+    def prepare(job):
+        # with T5 on the CPU, queued prompts are encoded on a separate stage
+        # while the current job is sampling
+        try:
+            args = parse_job(job)
+        except (ValueError, AssertionError):
+            return None
+        key = pipeline_key(args)
+        if not (args.t5_cpu or args.t5_socket) or args.use_prompt_extend or \
+                args.plan_only or key not in pipelines:
+            return None
+        with stages_lock:
+            if key not in stages:
+                stages[key] = TextEncodingStage(
+                    partial(pipelines[key].encode_prompts, offload_model=False))
+        prompt = args.prompt or EXAMPLE_PROMPT[args.task]["prompt"]
+        return stages[key].submit(prompt)
+
+    def load(args, emit):
+        assert not (
+            args.t5_fsdp or args.dit_fsdp
+        ), f"t5_fsdp and dit_fsdp are not supported in non-distributed environments."
+        assert not (
+            args.ulysses_size > 1 or args.ring_size > 1
+        ), f"context parallel are not supported in non-distributed environments."
+        logging.info(f"Generation job args: {args}")
+
+        cfg = WAN_CONFIGS[args.task]
+        key = pipeline_key(args)
+        if key not in pipelines:
+            pipelines[key] = _create_pipeline(args, cfg, 0, 0)
+            emit("loaded", load_timings=pipelines[key].load_timings)
+        pipeline = pipelines[key]
+        _configure_model(args, pipeline)
+        return pipeline
+
+    def run(job, emit, context):
+        args = parse_job(job)
+        _check_args(args, world_size)
+        if args.plan_only or args.memory_budget is not None:
+            plan = _plan(args, WAN_CONFIGS[args.task], world_size)
+            _check_args(args, world_size)
+            if args.plan_only:
+                return {"plan": format_plan(plan)}
+        pipeline = load(args, emit)
+
+        prompt_expander = None
+        if args.use_prompt_extend:
+            key = (args.prompt_extend_method, args.prompt_extend_model,
+                   "i2v" in args.task)
+            if key not in prompt_expanders:
+                prompt_expanders[key] = _create_prompt_expander(args, 0)
+            prompt_expander = prompt_expanders[key]
+
+        if context is not None:
+            context = context.result()
+        save_file = _run(args, WAN_CONFIGS[args.task], pipeline, 0,
+                         prompt_expander, context)
+        return {"save_file": os.path.abspath(save_file), "prompt": args.prompt}
+
+    def batch_key(job):
+        # t2i jobs run together when they only differ in prompt, seed and
+        # output file, jobs writing previews run alone
+        try:
+            args = parse_job(job)
+        except (ValueError, AssertionError):
+            return None
+        if "t2i" not in args.task or args.use_prompt_extend or \
+                args.plan_only or args.memory_budget is not None or \
+                args.preview_every is not None:
+            return None
+        settings = vars(args).copy()
+        for name in ("prompt", "base_seed", "save_file"):
+            settings.pop(name)
+        return tuple(sorted(settings.items()))
+
+    def run_batch(jobs, emits, contexts):
+        # the batch encodes its prompts itself
+        for context in contexts:
+            if context is not None:
+                context.cancel()
+        jobs_args = [parse_job(job) for job in jobs]
+        for args in jobs_args:
+            _check_args(args, world_size)
+        pipeline = load(jobs_args[0], emits[0])
+        save_files = _run_images(jobs_args, WAN_CONFIGS[jobs_args[0].task],
+                                 pipeline)
+        return [{
+            "save_file": os.path.abspath(save_file),
+            "prompt": args.prompt
+        } for args, save_file in zip(jobs_args, save_files)]
+
+    args = _parse_args(argv)
+    daemon = GenerationDaemon(
+        run,
+        queue_size=args.daemon_queue_size,
+        prepare_fn=prepare,
+        batch_fn=run_batch,
+        batch_key_fn=batch_key,
+        max_batch=args.daemon_batch_size)
+    if args.daemon_socket is not None:
+        daemon.serve_unix(args.daemon_socket)
+    else:
+        daemon.serve_http(args.daemon_host, args.daemon_port)
+
+
 if __name__ == "__main__":
     args = _parse_args()
-    generate(args)
+    if args.daemon:
+        serve()
+    else:
+        generate(args)
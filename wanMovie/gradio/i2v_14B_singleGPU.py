@@ -15,12 +15,15 @@ sys.path.insert(0, os.path.sep.join(osp.realpath(__file__).split(os.path.sep)[:-
 import wan
 from wan.configs import MAX_AREA_CONFIGS, WAN_CONFIGS
 from wan.utils.prompt_extend import DashScopePromptExpander, QwenPromptExpander
+from wan.utils.preview import (LatentPreviewer, preview_projection_path,
+                               stream_previews)
 from wan.utils.utils import cache_video
 
 # Global Var
 prompt_expander = None
 wan_i2v_480P = None
 wan_i2v_720P = None
+previewer = None
 
 
 # Button Func
@@ -105,33 +108,38 @@ def i2v_generation(img2vid_prompt, img2vid_image, resolution, sd_steps,
         print(
             'Please specify at least one resolution ckpt dir or specify the resolution'
         )
-        return None
+        yield gr.update(), None
 
     else:
+        global wan_i2v_720P, wan_i2v_480P, previewer
         if resolution == '720P':
-            global wan_i2v_720P
-            video = wan_i2v_720P.generate(
-                img2vid_prompt,
-                img2vid_image,
-                max_area=MAX_AREA_CONFIGS['720*1280'],
-                shift=shift_scale,
-                sampling_steps=sd_steps,
-                guide_scale=guide_scale,
-                n_prompt=n_prompt,
-                seed=seed,
-                offload_model=True)
+            pipeline, max_area = wan_i2v_720P, MAX_AREA_CONFIGS['720*1280']
         else:
-            global wan_i2v_480P
-            video = wan_i2v_480P.generate(
-                img2vid_prompt,
-                img2vid_image,
-                max_area=MAX_AREA_CONFIGS['480*832'],
-                shift=shift_scale,
-                sampling_steps=sd_steps,
-                guide_scale=guide_scale,
-                n_prompt=n_prompt,
-                seed=seed,
-                offload_model=True)
+            pipeline, max_area = wan_i2v_480P, MAX_AREA_CONFIGS['480*832']
+        if previewer is None:
+            ckpt_dir = args.ckpt_dir_720p if resolution == '720P' \
+                else args.ckpt_dir_480p
+            previewer = LatentPreviewer.from_vae(
+                pipeline.vae,
+                preview_projection_path(
+                    os.path.join(ckpt_dir,
+                                 WAN_CONFIGS['i2v-14B'].vae_checkpoint)))
+
+        # previews of the denoised latents while sampling
+        for preview, video in stream_previews(
+                lambda step_callback: pipeline.generate(
+                    img2vid_prompt,
+                    img2vid_image,
+                    max_area=max_area,
+                    shift=shift_scale,
+                    sampling_steps=sd_steps,
+                    guide_scale=guide_scale,
+                    n_prompt=n_prompt,
+                    seed=seed,
+                    offload_model=True,
+                    step_callback=step_callback), previewer):
+            if preview is not None:
+                yield preview, gr.update()
 
         cache_video(
             tensor=video[None],
@@ -141,7 +149,7 @@ def i2v_generation(img2vid_prompt, img2vid_image, resolution, sd_steps,
             normalize=True,
             value_range=(-1, 1))
 
-        return "example.mp4"
+        yield gr.update(), "example.mp4"
 
 
 # Interface
@@ -213,6 +221,8 @@ def gradio_interface():
                 run_i2v_button = gr.Button("Generate Video")
 
             with gr.Column():
+                preview_image = gr.Image(
+                    label='Preview', interactive=False, height=200)
                 result_gallery = gr.Video(
                     label='Generated Video', interactive=False, height=600)
 
@@ -230,7 +240,7 @@ def gradio_interface():
                 img2vid_prompt, img2vid_image, resolution, sd_steps,
                 guide_scale, shift_scale, seed, n_prompt
             ],
-            outputs=[result_gallery],
+            outputs=[preview_image, result_gallery],
         )
 
     return demo
@@ -14,11 +14,14 @@ sys.path.insert(0, os.path.sep.join(osp.realpath(__file__).split(os.path.sep)[:-
 import wan
 from wan.configs import WAN_CONFIGS
 from wan.utils.prompt_extend import DashScopePromptExpander, QwenPromptExpander
+from wan.utils.preview import (LatentPreviewer, preview_projection_path,
+                               stream_previews)
 from wan.utils.utils import cache_image
 
 # Global Var
 prompt_expander = None
 wan_t2i = None
+previewer = None
 
 
 # Button Func
@@ -33,21 +36,27 @@ def prompt_enc(prompt, tar_lang):
 
 def t2i_generation(txt2img_prompt, resolution, sd_steps, guide_scale,
                    shift_scale, seed, n_prompt):
-    global wan_t2i
+    global wan_t2i, previewer
     # print(f"{txt2img_prompt},{resolution},{sd_steps},{guide_scale},{shift_scale},{seed},{n_prompt}")
 
     W = int(resolution.split("*")[0])
     H = int(resolution.split("*")[1])
-    video = wan_t2i.generate(
-        txt2img_prompt,
-        size=(W, H),
-        frame_num=1,
-        shift=shift_scale,
-        sampling_steps=sd_steps,
-        guide_scale=guide_scale,
-        n_prompt=n_prompt,
-        seed=seed,
-        offload_model=True)
+    # previews of the denoised latent take the place of the image while
+    # sampling
+    for preview, video in stream_previews(
+            lambda step_callback: wan_t2i.generate(
+                txt2img_prompt,
+                size=(W, H),
+                frame_num=1,
+                shift=shift_scale,
+                sampling_steps=sd_steps,
+                guide_scale=guide_scale,
+                n_prompt=n_prompt,
+                seed=seed,
+                offload_model=True,
+                step_callback=step_callback), previewer):
+        if preview is not None:
+            yield preview
 
     cache_image(
         tensor=video.squeeze(1)[None],
@@ -56,7 +65,7 @@ def t2i_generation(txt2img_prompt, resolution, sd_steps, guide_scale,
         normalize=True,
         value_range=(-1, 1))
 
-    return "example.png"
+    yield "example.png"
 
 
 # Interface
@@ -199,6 +208,10 @@ if __name__ == '__main__':
         dit_fsdp=False,
         use_usp=False,
     )
+    previewer = LatentPreviewer.from_vae(
+        wan_t2i.vae,
+        preview_projection_path(os.path.join(args.ckpt_dir,
+                                             cfg.vae_checkpoint)))
     print("done", flush=True)
 
     demo = gradio_interface()
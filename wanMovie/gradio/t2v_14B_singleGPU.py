@@ -14,11 +14,14 @@ sys.path.insert(0, os.path.sep.join(osp.realpath(__file__).split(os.path.sep)[:-
 import wan
 from wan.configs import WAN_CONFIGS
 from wan.utils.prompt_extend import DashScopePromptExpander, QwenPromptExpander
+from wan.utils.preview import (LatentPreviewer, preview_projection_path,
+                               stream_previews)
 from wan.utils.utils import cache_video
 
 # Global Var
 prompt_expander = None
 wan_t2v = None
+previewer = None
 
 
 # Button Func
@@ -33,20 +36,25 @@ def prompt_enc(prompt, tar_lang):
 
 def t2v_generation(txt2vid_prompt, resolution, sd_steps, guide_scale,
                    shift_scale, seed, n_prompt):
-    global wan_t2v
+    global wan_t2v, previewer
     # print(f"{txt2vid_prompt},{resolution},{sd_steps},{guide_scale},{shift_scale},{seed},{n_prompt}")
 
     W = int(resolution.split("*")[0])
     H = int(resolution.split("*")[1])
-    video = wan_t2v.generate(
-        txt2vid_prompt,
-        size=(W, H),
-        shift=shift_scale,
-        sampling_steps=sd_steps,
-        guide_scale=guide_scale,
-        n_prompt=n_prompt,
-        seed=seed,
-        offload_model=True)
+    # previews of the denoised latents while sampling
+    for preview, video in stream_previews(
+            lambda step_callback: wan_t2v.generate(
+                txt2vid_prompt,
+                size=(W, H),
+                shift=shift_scale,
+                sampling_steps=sd_steps,
+                guide_scale=guide_scale,
+                n_prompt=n_prompt,
+                seed=seed,
+                offload_model=True,
+                step_callback=step_callback), previewer):
+        if preview is not None:
+            yield preview, gr.update()
 
     cache_video(
         tensor=video[None],
@@ -56,7 +64,7 @@ def t2v_generation(txt2vid_prompt, resolution, sd_steps, guide_scale,
         normalize=True,
         value_range=(-1, 1))
 
-    return "example.mp4"
+    yield gr.update(), "example.mp4"
 
 
 # Interface
@@ -127,6 +135,8 @@ def gradio_interface():
                 run_t2v_button = gr.Button("Generate Video")
 
             with gr.Column():
+                preview_image = gr.Image(
+                    label='Preview', interactive=False, height=200)
                 result_gallery = gr.Video(
                     label='Generated Video', interactive=False, height=600)
 
@@ -141,7 +151,7 @@ def gradio_interface():
                 txt2vid_prompt, resolution, sd_steps, guide_scale, shift_scale,
                 seed, n_prompt
             ],
-            outputs=[result_gallery],
+            outputs=[preview_image, result_gallery],
         )
 
     return demo
@@ -199,6 +209,10 @@ if __name__ == '__main__':
         dit_fsdp=False,
         use_usp=False,
     )
+    previewer = LatentPreviewer.from_vae(
+        wan_t2v.vae,
+        preview_projection_path(os.path.join(args.ckpt_dir,
+                                             cfg.vae_checkpoint)))
     print("done", flush=True)
 
     demo = gradio_interface()
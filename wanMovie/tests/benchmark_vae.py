@@ -0,0 +1,135 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Measures the VAE throughput and peak memory for several temporal chunk sizes:
+
+    python tests/benchmark_vae.py --ckpt_dir ./Wan2.1-T2V-1.3B --size 832*480 --chunk_sizes 1,2,4,7
+
+Every chunk size is checked against the one-latent-frame-at-a-time result.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wan.configs import SIZE_CONFIGS, WAN_CONFIGS
+from wan.modules.vae import WanVAE
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Wan VAE per temporal chunk size")
+    parser.add_argument(
+        "--ckpt_dir",
+        type=str,
+        required=True,
+        help="The path to the checkpoint directory.")
+    parser.add_argument(
+        "--task",
+        type=str,
+        default="t2v-1.3B",
+        choices=list(WAN_CONFIGS.keys()),
+        help="The task whose config names the VAE checkpoint.")
+    parser.add_argument(
+        "--size",
+        type=str,
+        default="832*480",
+        choices=list(SIZE_CONFIGS.keys()),
+        help="The resolution of the video, width*height.")
+    parser.add_argument(
+        "--frame_num",
+        type=int,
+        default=81,
+        help="The number of frames, 4n+1.")
+    parser.add_argument(
+        "--chunk_sizes",
+        type=str,
+        default="1,2,4,7",
+        help="Comma separated chunk sizes to compare.")
+    parser.add_argument(
+        "--tile_size",
+        type=int,
+        default=None,
+        help="The spatial tile size in pixels, no tiling by default.")
+    parser.add_argument(
+        "--encode",
+        action="store_true",
+        default=False,
+        help="Whether to benchmark the encoder as well.")
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="The number of timed runs per chunk size after one warmup run.")
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda",
+        help="The device to run the VAE on.")
+    return parser.parse_args()
+
+
+def _measure(fn, device, repeats):
+    # the first run warms up the kernels
+    out = fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        out = fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        peak = torch.cuda.max_memory_allocated(device) / 1024**3
+    else:
+        peak = float('nan')
+    return out, (time.perf_counter() - start) / repeats, peak
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+    args = _parse_args()
+    cfg = WAN_CONFIGS[args.task]
+    device = torch.device(args.device)
+    vae = WanVAE(
+        vae_pth=os.path.join(args.ckpt_dir, cfg.vae_checkpoint),
+        device=device,
+        tile_size=args.tile_size)
+
+    w, h = SIZE_CONFIGS[args.size]
+    gen = torch.Generator(device='cpu').manual_seed(0)
+    video = torch.rand(3, args.frame_num, h, w, generator=gen).to(device)
+    video = video.mul_(2).sub_(1)
+    with torch.no_grad():
+        z = vae.encode([video])[0]
+
+    stages = [('decode', lambda: vae.decode([z])[0], args.frame_num)]
+    if args.encode:
+        stages.append(('encode', lambda: vae.encode([video])[0],
+                       args.frame_num))
+    chunk_sizes = [int(u) for u in args.chunk_sizes.split(',')]
+    for name, fn, frames in stages:
+        vae.set_chunk_size(1)
+        with torch.no_grad():
+            reference = fn()
+        for chunk_size in chunk_sizes:
+            vae.set_chunk_size(chunk_size)
+            with torch.no_grad():
+                out, elapsed, peak = _measure(fn, device, args.repeats)
+            error = (out - reference).abs().max().item()
+            logging.info(
+                f"{name} chunk_size={chunk_size}: {elapsed:.2f}s, "
+                f"{frames / elapsed:.1f} frames/s, peak memory {peak:.2f} GB, "
+                f"max abs diff {error:.2e}")
+            del out
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Checks the CPU mode of the Wan VAE (channels-last layouts, bf16 autocast and
+fused norm + SiLU) against the float32 VAE and reports the speedup:
+
+    python tests/vae_cpu_parity.py --ckpt_dir ./Wan2.1-T2V-1.3B --size 832*480 --frame_num 17
+
+Exits with status 1 when the relative L2 error or the PSNR of the decoded
+frames is out of tolerance.
+"""
+import argparse
+import logging
+import math
+import os
+import sys
+import time
+
+import imageio
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wan.configs import SIZE_CONFIGS, WAN_CONFIGS
+from wan.modules.vae import WanVAE
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the CPU mode of the Wan VAE with float32")
+    parser.add_argument(
+        "--ckpt_dir",
+        type=str,
+        required=True,
+        help="The path to the checkpoint directory.")
+    parser.add_argument(
+        "--task",
+        type=str,
+        default="t2v-1.3B",
+        choices=list(WAN_CONFIGS.keys()),
+        help="The task whose config names the VAE checkpoint.")
+    parser.add_argument(
+        "--size",
+        type=str,
+        default="832*480",
+        choices=list(SIZE_CONFIGS.keys()),
+        help="The resolution of the video, width*height.")
+    parser.add_argument(
+        "--frame_num",
+        type=int,
+        default=17,
+        help="The number of frames, 4n+1.")
+    parser.add_argument(
+        "--video",
+        type=str,
+        default=None,
+        help="A video whose first frames are encoded and decoded, smooth random frames by default."
+    )
+    parser.add_argument(
+        "--max_rel_l2",
+        type=float,
+        default=0.05,
+        help="The tolerated relative L2 error of latents and frames.")
+    parser.add_argument(
+        "--min_psnr",
+        type=float,
+        default=35.0,
+        help="The tolerated PSNR in dB of the decoded frames against float32.")
+    return parser.parse_args()
+
+
+def _load_video(path, frame_num, w, h):
+    reader = imageio.get_reader(path)
+    frames = [torch.from_numpy(u) for _, u in zip(range(frame_num), reader)]
+    reader.close()
+    video = torch.stack(frames).permute(3, 0, 1, 2).float().div_(127.5).sub_(1)
+    return F.interpolate(
+        video, size=(h, w), mode='bilinear', align_corners=False)
+
+
+def _random_video(frame_num, w, h):
+    gen = torch.Generator(device='cpu').manual_seed(0)
+    video = torch.randn(1, 3, frame_num, h // 32, w // 32, generator=gen)
+    video = F.interpolate(video, size=(frame_num, h, w), mode='trilinear')
+    return torch.tanh(video[0])
+
+
+def _compare(name, reference, candidate):
+    rel_l2 = ((candidate - reference).norm() / reference.norm()).item()
+    logging.info(f"{name}: relative L2 error {rel_l2:.5f}, "
+                 f"max abs diff {(candidate - reference).abs().max():.4f}")
+    return rel_l2
+
+
+def _psnr(reference, candidate):
+    # frames span [-1, 1]
+    mse = (candidate - reference).pow(2).mean().item()
+    return 10 * math.log10(4 / max(mse, 1e-20))
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    with torch.no_grad():
+        out = fn()
+    return out, time.perf_counter() - start
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+    args = _parse_args()
+    cfg = WAN_CONFIGS[args.task]
+    w, h = SIZE_CONFIGS[args.size]
+    vae_pth = os.path.join(args.ckpt_dir, cfg.vae_checkpoint)
+
+    reference = WanVAE(vae_pth=vae_pth, device='cpu')
+    candidate = WanVAE(vae_pth=vae_pth, device='cpu', cpu_mode=True)
+
+    if args.video is not None:
+        video = _load_video(args.video, args.frame_num, w, h)
+    else:
+        video = _random_video(args.frame_num, w, h)
+
+    z_ref, encode_ref = _timed(lambda: reference.encode([video])[0])
+    z_cpu, encode_cpu = _timed(lambda: candidate.encode([video])[0])
+    # both decoders see the float32 latents
+    x_ref, decode_ref = _timed(lambda: reference.decode([z_ref])[0])
+    x_cpu, decode_cpu = _timed(lambda: candidate.decode([z_ref])[0])
+
+    z_rel_l2 = _compare("latents", z_ref, z_cpu)
+    x_rel_l2 = _compare("frames", x_ref, x_cpu)
+    psnr = _psnr(x_ref, x_cpu)
+    logging.info(f"frames: PSNR {psnr:.2f} dB")
+    logging.info(f"encode: float32 {encode_ref:.2f}s, cpu mode "
+                 f"{encode_cpu:.2f}s ({encode_ref / encode_cpu:.2f}x)")
+    logging.info(f"decode: float32 {decode_ref:.2f}s, cpu mode "
+                 f"{decode_cpu:.2f}s ({decode_ref / decode_cpu:.2f}x)")
+
+    if max(z_rel_l2, x_rel_l2) > args.max_rel_l2 or psnr < args.min_psnr:
+        logging.error("CPU mode is out of tolerance.")
+        sys.exit(1)
+    logging.info("CPU mode is within tolerance.")
+
+
+if __name__ == "__main__":
+    main()
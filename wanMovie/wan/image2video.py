@@ -1,5 +1,6 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
 import gc
+import hashlib
 import logging
 import math
 import os
@@ -21,9 +22,14 @@ from .modules.clip import CLIPModel
 from .modules.model import WanModel
 from .modules.t5 import T5EncoderModel
 from .modules.vae import WanVAE
+from .utils.cache import TensorCache, cache_key
 from .utils.fm_solvers import (FlowDPMSolverMultistepScheduler,
                                get_sampling_sigmas, retrieve_timesteps)
 from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .utils.offload import BlockOffloader
+from .utils.registry import default_registry
+from .utils.text_server import TextEncoderClient
+from .utils.utils import load_in_parallel
 
 
 class WanI2V:
@@ -39,6 +45,13 @@ class WanI2V:
         use_usp=False,
         t5_cpu=False,
         init_on_cpu=True,
+        offload_blocks=None,
+        registry=None,
+        t5_cache_dir=None,
+        t5_quant=None,
+        t5_socket=None,
+        cond_cache_size=16,
+        cond_cache_dir=None,
     ):
         r"""
         Initializes the image-to-video generation model components.
@@ -62,42 +75,40 @@ class WanI2V:
                 Whether to place T5 model on CPU. Only works without t5_fsdp.
             init_on_cpu (`bool`, *optional*, defaults to True):
                 Enable initializing Transformer Model on CPU. Only works without FSDP or USP.
+            offload_blocks (`int`, *optional*, defaults to None):
+                Stream the DiT blocks from CPU, keeping only this many blocks resident on
+                the GPU while the next ones are prefetched. Only works without dit_fsdp.
+            registry (`ComponentRegistry`, *optional*, defaults to None):
+                Registry the components are acquired from. Defaults to the process-wide
+                registry, so pipelines built from the same checkpoints share them.
+            t5_cache_dir (`str`, *optional*, defaults to None):
+                Directory persisting the prompt embeddings across processes. Ignored
+                with t5_fsdp, whose ranks must encode in lockstep.
+            t5_quant (`str`, *optional*, defaults to None):
+                Quantize the T5 model, only 'int8' is supported. Only works with t5_cpu.
+            t5_socket (`str`, *optional*, defaults to None):
+                Unix socket of a text encoder server (wan/utils/text_server.py). If
+                given, prompts are encoded by the server instead of a local T5 model.
+            cond_cache_size (`int`, *optional*, defaults to 16):
+                Number of input images whose CLIP features and VAE conditioning latents
+                are kept in memory, keyed by image content and resolution. 0 disables
+                the in-memory cache
+            cond_cache_dir (`str`, *optional*, defaults to None):
+                Directory persisting the image conditioning across processes
         """
         self.device = torch.device(f"cuda:{device_id}")
         self.config = config
         self.rank = rank
         self.use_usp = use_usp
-        self.t5_cpu = t5_cpu
+        # embeddings of a text encoder server arrive on the CPU
+        self.t5_cpu = t5_cpu or t5_socket is not None
 
         self.num_train_timesteps = config.num_train_timesteps
         self.param_dtype = config.param_dtype
 
         shard_fn = partial(shard_model, device_id=device_id)
-        self.text_encoder = T5EncoderModel(
-            text_len=config.text_len,
-            dtype=config.t5_dtype,
-            device=torch.device('cpu'),
-            checkpoint_path=os.path.join(checkpoint_dir, config.t5_checkpoint),
-            tokenizer_path=os.path.join(checkpoint_dir, config.t5_tokenizer),
-            shard_fn=shard_fn if t5_fsdp else None,
-        )
-
         self.vae_stride = config.vae_stride
         self.patch_size = config.patch_size
-        self.vae = WanVAE(
-            vae_pth=os.path.join(checkpoint_dir, config.vae_checkpoint),
-            device=self.device)
-
-        self.clip = CLIPModel(
-            dtype=config.clip_dtype,
-            device=self.device,
-            checkpoint_path=os.path.join(checkpoint_dir,
-                                         config.clip_checkpoint),
-            tokenizer_path=os.path.join(checkpoint_dir, config.clip_tokenizer))
-
-        logging.info(f"Creating WanModel from {checkpoint_dir}")
-        self.model = WanModel.from_pretrained(checkpoint_dir)
-        self.model.eval().requires_grad_(False)
 
         if t5_fsdp or dit_fsdp or use_usp:
             init_on_cpu = False
@@ -105,26 +116,224 @@ class WanI2V:
         if use_usp:
             from xfuser.core.distributed import \
                 get_sequence_parallel_world_size
-
-            from .distributed.xdit_context_parallel import (usp_attn_forward,
-                                                            usp_dit_forward)
-            for block in self.model.blocks:
-                block.self_attn.forward = types.MethodType(
-                    usp_attn_forward, block.self_attn)
-            self.model.forward = types.MethodType(usp_dit_forward, self.model)
             self.sp_size = get_sequence_parallel_world_size()
         else:
             self.sp_size = 1
-
-        if dist.is_initialized():
-            dist.barrier()
         if dit_fsdp:
-            self.model = shard_fn(self.model)
-        else:
-            if not init_on_cpu:
-                self.model.to(self.device)
+            assert offload_blocks is None, "offload_blocks does not work with dit_fsdp."
+        assert t5_quant is None or t5_cpu, "t5_quant only works with t5_cpu."
+
+        # components are shared with every pipeline built from the same
+        # checkpoints, dtypes and placements
+        self.registry = default_registry if registry is None else registry
+        self.t5_key = ('t5',
+                       os.path.abspath(
+                           os.path.join(checkpoint_dir, config.t5_checkpoint)),
+                       os.path.abspath(
+                           os.path.join(checkpoint_dir, config.t5_tokenizer)),
+                       config.text_len, config.t5_dtype, t5_fsdp, t5_quant,
+                       torch.device('cpu') if t5_cpu else self.device,
+                       None if t5_cache_dir is None else
+                       os.path.abspath(t5_cache_dir))
+        self.vae_key = ('vae',
+                        os.path.abspath(
+                            os.path.join(checkpoint_dir,
+                                         config.vae_checkpoint)), self.device)
+        self.clip_key = ('clip',
+                         os.path.abspath(
+                             os.path.join(checkpoint_dir,
+                                          config.clip_checkpoint)),
+                         config.clip_dtype, self.device, True)
+        self.model_key = ('dit', os.path.abspath(checkpoint_dir),
+                          config.param_dtype, dit_fsdp, use_usp,
+                          offload_blocks, 'cpu' if init_on_cpu else self.device)
+
+        acquired = []
+
+        def acquire(key, factory):
+            component = self.registry.acquire(key, factory)
+            acquired.append(key)
+            return component
+
+        # independent components are loaded concurrently
+        logging.info(f"Creating WanModel from {checkpoint_dir}")
+        loaders = {
+            'text_encoder':
+                partial(
+                    acquire, self.t5_key,
+                    partial(
+                        T5EncoderModel,
+                        text_len=config.text_len,
+                        dtype=config.t5_dtype,
+                        device=torch.device('cpu'),
+                        checkpoint_path=os.path.join(checkpoint_dir,
+                                                     config.t5_checkpoint),
+                        tokenizer_path=os.path.join(checkpoint_dir,
+                                                    config.t5_tokenizer),
+                        cache_dir=None if t5_fsdp else t5_cache_dir,
+                        quantization=t5_quant)),
+            'vae':
+                partial(
+                    acquire, self.vae_key,
+                    partial(
+                        WanVAE,
+                        vae_pth=os.path.join(checkpoint_dir,
+                                             config.vae_checkpoint),
+                        device=self.device)),
+            'clip':
+                partial(
+                    acquire, self.clip_key,
+                    partial(
+                        CLIPModel,
+                        dtype=config.clip_dtype,
+                        device=self.device,
+                        checkpoint_path=os.path.join(checkpoint_dir,
+                                                     config.clip_checkpoint),
+                        visual_only=True)),
+            'model':
+                partial(acquire, self.model_key,
+                        partial(WanModel.from_pretrained, checkpoint_dir)),
+        }
+        if t5_socket is not None:
+            loaders['text_encoder'] = partial(TextEncoderClient, t5_socket)
+        # repeated input images skip CLIP and the VAE encoder
+        self.cond_cache = TensorCache(
+            max_items=cond_cache_size, cache_dir=cond_cache_dir)
+
+        # sharding and placement run once per shared component, and
+        # collectives stay on the main thread
+        def prepare_text_encoder(text_encoder):
+            if t5_fsdp:
+                text_encoder.model = shard_fn(
+                    text_encoder.model, sync_module_states=False)
+            return text_encoder
+
+        def prepare_model(model):
+            model.eval().requires_grad_(False)
+            if use_usp:
+                from .distributed.xdit_context_parallel import (
+                    usp_attn_forward, usp_dit_forward)
+                for block in model.blocks:
+                    block.self_attn.forward = types.MethodType(
+                        usp_attn_forward, block.self_attn)
+                model.forward = types.MethodType(usp_dit_forward, model)
+
+            if dist.is_initialized():
+                dist.barrier()
+            if dit_fsdp:
+                model = shard_fn(model)
+            elif offload_blocks is not None:
+                model.block_offloader = BlockOffloader(
+                    model, self.device, window=offload_blocks)
+            elif not init_on_cpu:
+                model.to(self.device)
+            return model
+
+        try:
+            components, self.load_timings = load_in_parallel(loaders)
+            if t5_socket is not None:
+                self.text_encoder = components['text_encoder']
+                self.t5_key = None
+            else:
+                self.text_encoder = self.registry.prepare(self.t5_key,
+                                                          prepare_text_encoder)
+            self.vae = components['vae']
+            self.clip = components['clip']
+            self.model = self.registry.prepare(self.model_key, prepare_model)
+            self.block_offloader = getattr(self.model, 'block_offloader', None)
+
+            self.sample_neg_prompt = config.sample_neg_prompt
+
+            # the default negative prompt is served from the embedding cache, T5
+            # only visits the GPU when it is missing
+            if self.t5_cpu:
+                self.text_encoder([self.sample_neg_prompt], torch.device('cpu'))
+            elif not self.text_encoder.cached([self.sample_neg_prompt]):
+                self.text_encoder.model.to(self.device)
+                self.text_encoder([self.sample_neg_prompt], self.device)
+                self.text_encoder.model.cpu()
+        except BaseException:
+            # return the shared components acquired so far, a daemon
+            # would keep them loaded otherwise
+            for key in acquired:
+                self.registry.release(key)
+            raise
+
+    def release(self, evict=False):
+        r"""
+        Releases the shared components acquired by this pipeline, which must not be
+        used afterwards.
+
+        Args:
+            evict (`bool`, *optional*, defaults to False):
+                Free components that no other pipeline references. Otherwise they stay
+                cached in the registry for the next pipeline.
+        """
+        for key in (self.t5_key, self.vae_key, self.clip_key,
+                    self.model_key):
+            if key is not None:
+                self.registry.release(key, evict=evict)
+        if self.t5_key is None:
+            self.text_encoder.close()
+        for name in ('text_encoder', 'vae', 'clip', 'model'):
+            setattr(self, name, None)
+        self.block_offloader = None
+
+    def encode_prompts(self, input_prompt, n_prompt="", offload_model=True):
+        r"""
+        Encodes a prompt and its negative prompt in one T5 call. Safe to run on
+        another thread than `generate` with t5_cpu.
+
+        Args:
+            input_prompt (`str`):
+                Text prompt for content generation
+            n_prompt (`str`, *optional*, defaults to ""):
+                Negative prompt for content exclusion. If not given, use `config.sample_neg_prompt`
+            offload_model (`bool`, *optional*, defaults to True):
+                If True, moves T5 back to CPU afterwards
+
+        Returns:
+            tuple[list[torch.Tensor], list[torch.Tensor]]:
+                Contexts of the prompt and the negative prompt. They stay on the CPU
+                with t5_cpu, `generate` moves them to the GPU.
+        """
+        if n_prompt == "":
+            n_prompt = self.sample_neg_prompt
+        with torch.no_grad():
+            if not self.t5_cpu:
+                self.text_encoder.model.to(self.device)
+                context, context_null = self.text_encoder(
+                    [input_prompt, n_prompt], self.device)
+                if offload_model:
+                    self.text_encoder.model.cpu()
+            else:
+                context, context_null = self.text_encoder(
+                    [input_prompt, n_prompt], torch.device('cpu'))
+        return [context], [context_null]
+
+    def encode_images(self, imgs, batch_size=16, offload_model=True):
+        r"""
+        Encodes the CLIP features of many input images at once, e.g. for a batch
+        of jobs. Preprocessing runs on CPU workers and the images share forward
+        passes.
 
-        self.sample_neg_prompt = config.sample_neg_prompt
+        Args:
+            imgs (`list`):
+                PIL images, image paths or tensors of shape [3, H, W] in [-1, 1]
+            batch_size (`int`, *optional*, defaults to 16):
+                Number of images per CLIP forward pass
+            offload_model (`bool`, *optional*, defaults to True):
+                If True, moves CLIP back to CPU afterwards
+
+        Returns:
+            list[torch.Tensor]: The `clip_context` of each image for `generate`.
+        """
+        self.clip.model.to(self.device)
+        with torch.no_grad():
+            clip_contexts = self.clip.visual_batch(imgs, batch_size=batch_size)
+        if offload_model:
+            self.clip.model.cpu()
+        return clip_contexts
 
     def generate(self,
                  input_prompt,
@@ -137,7 +346,12 @@ class WanI2V:
                  guide_scale=5.0,
                  n_prompt="",
                  seed=-1,
-                 offload_model=True):
+                 offload_model=True,
+                 context=None,
+                 clip_context=None,
+                 decode=True,
+                 cond_chunks=20,
+                 step_callback=None):
         r"""
         Generates video frames from input image and text prompt using diffusion process.
 
@@ -164,7 +378,25 @@ class WanI2V:
             seed (`int`, *optional*, defaults to -1):
                 Random seed for noise generation. If -1, use random seed
             offload_model (`bool`, *optional*, defaults to True):
-                If True, offloads models to CPU during generation to save VRAM
+                If True, offloads models to CPU during generation to save VRAM. The DiT is
+                left in place when block offloading is enabled
+            context (`tuple`, *optional*, defaults to None):
+                Output of `encode_prompts` for `input_prompt` and `n_prompt`, e.g. from a
+                separate text-encoding stage. Skips text encoding if given
+            clip_context (`torch.Tensor`, *optional*, defaults to None):
+                CLIP features of `img` from `encode_images`. Skips CLIP if given
+            decode (`bool`, *optional*, defaults to True):
+                If False, returns the latents (C, T, H / 8, W / 8) instead of the
+                decoded frames, e.g. to decode them with `WanVAE.decode_stream`
+            cond_chunks (`int`, *optional*, defaults to 20):
+                Number of chunks of 4 black frames following the image that are VAE
+                encoded exactly, the others reuse latents precomputed per resolution.
+                20 encodes all conditioning frames exactly, fewer chunks are faster
+                but approximate, see `WanVAE.encode_first_frames`
+            step_callback (`callable`, *optional*, defaults to None):
+                Called on rank 0 as `step_callback(step, num_steps, x0)` before every
+                scheduler step, with `x0` the list of denoised latents predicted at
+                that step, e.g. a `PreviewWriter`
 
         Returns:
             torch.Tensor:
@@ -174,6 +406,8 @@ class WanI2V:
                 - H: Frame height (from max_area)
                 - W: Frame width from max_area)
         """
+        image_hash = hashlib.sha256(img.tobytes()).hexdigest()
+        image_size = (img.mode, img.size)
         img = TF.to_tensor(img).sub_(0.5).div_(0.5).to(self.device)
 
         F = frame_num
@@ -213,37 +447,37 @@ class WanI2V:
         msk = msk.view(1, msk.shape[1] // 4, 4, lat_h, lat_w)
         msk = msk.transpose(1, 2)[0]
 
-        if n_prompt == "":
-            n_prompt = self.sample_neg_prompt
 
         # preprocess
-        if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
-            if offload_model:
-                self.text_encoder.model.cpu()
+        if context is None:
+            context = self.encode_prompts(input_prompt, n_prompt, offload_model)
+        context, context_null = [[t.to(self.device) for t in u]
+                                 for u in context]
+
+        # the conditioning only depends on the image, the resolution and the
+        # encoders
+        key = cache_key(self.clip_key[1], self.vae_key[1], image_hash,
+                        image_size, h, w, cond_chunks, self.vae.tile_size,
+                        self.vae.tile_overlap)
+        cond = self.cond_cache.get(key)
+        if cond is None:
+            if clip_context is None:
+                self.clip.model.to(self.device)
+                clip_context = self.clip.visual([img[:, None, :, :]])
+                if offload_model:
+                    self.clip.model.cpu()
+
+            img = torch.nn.functional.interpolate(
+                img[None].cpu(), size=(h, w), mode='bicubic')[0].to(self.device)
+            y = self.vae.encode_first_frames([img], 81, cond_chunks)[0]
+            cond = self.cond_cache.put(key, {
+                'clip_context': clip_context,
+                'y': y
+            })
         else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
-            context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
-
-        self.clip.model.to(self.device)
-        clip_context = self.clip.visual([img[:, None, :, :]])
-        if offload_model:
-            self.clip.model.cpu()
-
-        y = self.vae.encode([
-            torch.concat([
-                torch.nn.functional.interpolate(
-                    img[None].cpu(), size=(h, w), mode='bicubic').transpose(
-                        0, 1),
-                torch.zeros(3, 80, h, w)
-            ],
-                         dim=1).to(self.device)
-        ])[0]
-        y = torch.concat([msk, y])
+            logging.info("Reusing the cached conditioning of the input image.")
+        clip_context = cond['clip_context'].to(self.device)
+        y = torch.concat([msk, cond['y'].to(self.device)])
 
         @contextmanager
         def noop_no_sync():
@@ -295,8 +529,9 @@ class WanI2V:
             if offload_model:
                 torch.cuda.empty_cache()
 
-            self.model.to(self.device)
-            for _, t in enumerate(tqdm(timesteps)):
+            if self.block_offloader is None:
+                self.model.to(self.device)
+            for i, t in enumerate(tqdm(timesteps)):
                 latent_model_input = [latent.to(self.device)]
                 timestep = [t]
 
@@ -317,6 +552,11 @@ class WanI2V:
 
                 latent = latent.to(
                     torch.device('cpu') if offload_model else self.device)
+                if step_callback is not None and self.rank == 0:
+                    step_callback(i, len(timesteps), [
+                        latent - t.to(latent.device) / self.num_train_timesteps *
+                        noise_pred
+                    ])
 
                 temp_x0 = sample_scheduler.step(
                     noise_pred.unsqueeze(0),
@@ -329,12 +569,12 @@ class WanI2V:
                 x0 = [latent.to(self.device)]
                 del latent_model_input, timestep
 
-            if offload_model:
+            if offload_model and self.block_offloader is None:
                 self.model.cpu()
                 torch.cuda.empty_cache()
 
             if self.rank == 0:
-                videos = self.vae.decode(x0)
+                videos = self.vae.decode(x0) if decode else x0
 
         del noise, latent
         del sample_scheduler
@@ -2,11 +2,15 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
 import logging
 import math
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torchvision.transforms as T
+import torchvision.transforms.functional as TF
+from PIL import Image
 
 from .attention import flash_attention
 from .tokenizers import HuggingfaceTokenizer
@@ -14,6 +18,7 @@ from .xlm_roberta import XLMRoberta
 
 __all__ = [
     'XLMRobertaCLIP',
+    'CLIPVisionTower',
     'clip_xlm_roberta_vit_h_14',
     'CLIPModel',
 ]
@@ -431,6 +436,59 @@ class XLMRobertaCLIP(nn.Module):
         return groups
 
 
+class CLIPVisionTower(nn.Module):
+    """
+    The vision transformer of `XLMRobertaCLIP` without the last block and the head,
+    i.e. the features of `XLMRobertaCLIP.visual(..., use_31_block=True)`.
+    """
+
+    def __init__(self,
+                 embed_dim=1024,
+                 image_size=224,
+                 patch_size=14,
+                 vision_dim=1280,
+                 vision_mlp_ratio=4,
+                 vision_heads=16,
+                 vision_layers=32,
+                 vision_pool='token',
+                 vision_pre_norm=True,
+                 vision_post_norm=False,
+                 activation='gelu',
+                 attn_dropout=0.0,
+                 proj_dropout=0.0,
+                 embedding_dropout=0.0,
+                 norm_eps=1e-5,
+                 **kwargs):
+        super().__init__()
+        self.embed_dim = embed_dim
+        self.image_size = image_size
+        self.patch_size = patch_size
+        self.vision_dim = vision_dim
+        self.vision_layers = vision_layers
+
+        # models
+        self.visual = VisionTransformer(
+            image_size=image_size,
+            patch_size=patch_size,
+            dim=vision_dim,
+            mlp_ratio=vision_mlp_ratio,
+            out_dim=embed_dim,
+            num_heads=vision_heads,
+            num_layers=vision_layers - 1,
+            pool_type=vision_pool,
+            pre_norm=vision_pre_norm,
+            post_norm=vision_post_norm,
+            activation=activation,
+            attn_dropout=attn_dropout,
+            proj_dropout=proj_dropout,
+            embedding_dropout=embedding_dropout,
+            norm_eps=norm_eps)
+
+        # never used by the truncated tower
+        del self.visual.post_norm
+        del self.visual.head
+
+
 def _clip(pretrained=False,
           pretrained_name=None,
           model_cls=XLMRobertaCLIP,
@@ -471,6 +529,7 @@ def _clip(pretrained=False,
 def clip_xlm_roberta_vit_h_14(
         pretrained=False,
         pretrained_name='open-clip-xlm-roberta-large-vit-huge-14',
+        visual_only=False,
         **kwargs):
     cfg = dict(
         embed_dim=1024,
@@ -495,16 +554,44 @@ def clip_xlm_roberta_vit_h_14(
         proj_dropout=0.0,
         embedding_dropout=0.0)
     cfg.update(**kwargs)
-    return _clip(pretrained, pretrained_name, XLMRobertaCLIP, **cfg)
+    model_cls = CLIPVisionTower if visual_only else XLMRobertaCLIP
+    return _clip(pretrained, pretrained_name, model_cls, **cfg)
 
 
 class CLIPModel:
 
-    def __init__(self, dtype, device, checkpoint_path, tokenizer_path):
+    def __init__(self,
+                 dtype,
+                 device,
+                 checkpoint_path,
+                 tokenizer_path=None,
+                 visual_only=False):
         self.dtype = dtype
         self.device = device
         self.checkpoint_path = checkpoint_path
         self.tokenizer_path = tokenizer_path
+        self.visual_only = visual_only
+
+        if visual_only:
+            # only the vision tensors are read from the mapped checkpoint
+            self.model, self.transforms = clip_xlm_roberta_vit_h_14(
+                pretrained=False,
+                return_transforms=True,
+                return_tokenizer=False,
+                visual_only=True,
+                dtype=dtype,
+                device='meta')
+            logging.info(f'loading {checkpoint_path} (vision tower only)')
+            state_dict = torch.load(
+                checkpoint_path, map_location='cpu', mmap=True)
+            keys = set(self.model.state_dict())
+            self.model.load_state_dict(
+                {k: v for k, v in state_dict.items() if k in keys},
+                assign=True)
+            self.model = self.model.to(
+                dtype=dtype, device=device).eval().requires_grad_(False)
+            self.tokenizer = None
+            return
 
         # init model
         self.model, self.transforms = clip_xlm_roberta_vit_h_14(
@@ -538,5 +625,70 @@ class CLIPModel:
 
         # forward
         with torch.cuda.amp.autocast(dtype=self.dtype):
-            out = self.model.visual(videos, use_31_block=True)
+            out = self.model.visual(
+                videos, use_31_block=not self.visual_only)
             return out
+
+    def preprocess(self, image):
+        r"""
+        Resizes and normalizes one image on the CPU like `visual` does.
+
+        Args:
+            image (`PIL.Image.Image`, `str` or `torch.Tensor`):
+                Image, image path or tensor of shape [3, H, W] in [-1, 1]
+
+        Returns:
+            torch.Tensor: Model input of shape [3, image_size, image_size].
+        """
+        if isinstance(image, str):
+            image = Image.open(image)
+        if isinstance(image, Image.Image):
+            image = TF.to_tensor(image.convert('RGB')).sub_(0.5).div_(0.5)
+        size = (self.model.image_size,) * 2
+        image = F.interpolate(
+            image[None].float().cpu(),
+            size=size,
+            mode='bicubic',
+            align_corners=False)[0]
+        return self.transforms.transforms[-1](image.mul_(0.5).add_(0.5))
+
+    def visual_batch(self, images, batch_size=16, num_workers=None):
+        r"""
+        Encodes many images: decoding, resizing and normalization run on a pool of
+        CPU workers, and the preprocessed images share forward passes.
+
+        Args:
+            images (`list`):
+                Images accepted by `preprocess`
+            batch_size (`int`, *optional*, defaults to 16):
+                Number of images per forward pass
+            num_workers (`int`, *optional*, defaults to None):
+                Number of preprocessing workers. Defaults to min(8, CPU count)
+
+        Returns:
+            list[torch.Tensor]: Features of each image, same as `visual` returns for
+            a batch of one.
+        """
+        if num_workers is None:
+            num_workers = min(8, os.cpu_count() or 1)
+        device = next(self.model.parameters()).device
+        features = []
+        with ThreadPoolExecutor(
+                max_workers=num_workers,
+                thread_name_prefix='wan_clip_preprocess') as executor:
+            # preprocessing of later batches overlaps the forward passes
+            inputs = executor.map(self.preprocess, images)
+            batch = []
+            for i, x in enumerate(inputs):
+                batch.append(x)
+                if len(batch) == batch_size or i == len(images) - 1:
+                    x = torch.stack(batch)
+                    if device.type == 'cuda':
+                        x = x.pin_memory()
+                    x = x.to(device, non_blocking=True)
+                    with torch.cuda.amp.autocast(dtype=self.dtype):
+                        out = self.model.visual(
+                            x, use_31_block=not self.visual_only)
+                    features.extend(out.split(1))
+                    batch = []
+        return features
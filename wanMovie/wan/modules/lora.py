@@ -0,0 +1,221 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+import os
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+
+__all__ = ['LoRAManager', 'load_lora_state_dict']
+
+# prefixes added by common trainers in front of the module names
+PREFIXES = ('diffusion_model.', 'base_model.model.', 'transformer.', 'model.',
+            'lora_unet_')
+
+# (down, up) weight suffixes of the supported formats
+SUFFIXES = (('.lora_A.weight', '.lora_B.weight'),
+            ('.lora_down.weight', '.lora_up.weight'))
+
+
+def load_lora_state_dict(path):
+    if path.endswith('.safetensors'):
+        from safetensors.torch import load_file
+        return load_file(path, device='cpu')
+    return torch.load(path, map_location='cpu', weights_only=True)
+
+
+class LoRAManager:
+
+    def __init__(self, model, cache_bytes=2**30):
+        r"""
+        Loads LoRA adapters for the attention and feed-forward linears of a
+        WanModel and switches between them without reloading the base weights.
+
+        An active adapter is applied either unmerged, as low-rank side GEMMs added
+        to the output of the adapted linears, or merged into the base weights. The
+        merged delta `scale * alpha / r * up @ down` is rebuilt in float32 on the
+        device of each weight, one linear at a time, so merging never holds more
+        than one dense delta. The low-rank factors copied to the devices are kept
+        in an LRU cache bounded by `cache_bytes`, switching back to a recently
+        used adapter does not copy them from the host again. With a
+        `BlockOffloader`, the streamed blocks are evicted first and the deltas
+        are merged into their host weights.
+
+        Unmerging subtracts the delta again, which is exact up to the rounding of
+        the weight dtype. The adapters apply to every pipeline sharing the model.
+
+        Args:
+            model (`WanModel`):
+                Model whose blocks are adapted
+            cache_bytes (`int`, *optional*, defaults to 2**30):
+                Memory of the low-rank factors kept on the devices. 0 disables
+                caching
+        """
+        self.model = model
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.targets = {
+            f'blocks.{name}': module
+            for name, module in model.blocks.named_modules()
+            if isinstance(module, nn.Linear)
+        }
+        # kohya style names use underscores instead of dots
+        self.aliases = {k.replace('.', '_'): k for k in self.targets}
+
+        self.adapters = {}
+        self.cache = OrderedDict()
+        self.active = None
+        self.scale = 1.0
+        self.merged = False
+        self.handles = []
+
+    def _resolve(self, name):
+        for prefix in PREFIXES:
+            if name.startswith(prefix):
+                name = name[len(prefix):]
+        if name in self.targets:
+            return name
+        return self.aliases.get(name)
+
+    def load(self, name, lora):
+        r"""
+        Registers an adapter. The weights are kept on the host until used.
+
+        Args:
+            name (`str`):
+                Name the adapter is activated by
+            lora (`str` or `dict`):
+                Path of a .safetensors/.pth file or a state dict in either the
+                `lora_A/lora_B` or the `lora_down/lora_up(/alpha)` format
+        """
+        if isinstance(lora, (str, os.PathLike)):
+            lora = load_lora_state_dict(str(lora))
+        if name in self.adapters:
+            self.unload(name)
+
+        layers, skipped = {}, []
+        for key, down in lora.items():
+            for down_suffix, up_suffix in SUFFIXES:
+                if key.endswith(down_suffix):
+                    break
+            else:
+                continue
+            prefix = key[:-len(down_suffix)]
+            target = self._resolve(prefix)
+            if target is None:
+                skipped.append(prefix)
+                continue
+            up = lora[prefix + up_suffix]
+            rank = down.shape[0]
+            alpha = lora.get(prefix + '.alpha')
+            alpha = rank if alpha is None else float(alpha)
+            layer = self.targets[target]
+            assert down.shape == (rank, layer.in_features) and \
+                up.shape == (layer.out_features, rank), \
+                f'LoRA shapes of {prefix} do not match {target}'
+            layers[target] = (down.float(), up.float(), alpha / rank)
+        assert layers, f'No LoRA weights of adapter {name} match the model'
+        if skipped:
+            logging.warning(
+                f'Ignoring {len(skipped)} LoRA layers of adapter {name} without a matching linear, e.g. {skipped[0]}'
+            )
+        self.adapters[name] = layers
+        logging.info(f'Loaded LoRA adapter {name} for {len(layers)} linears.')
+
+    def unload(self, name):
+        if self.active == name:
+            self.deactivate()
+        del self.adapters[name]
+        for key in [k for k in self.cache if k[0] == name]:
+            self.cached_bytes -= self.cache.pop(key)[-1]
+
+    @torch.no_grad()
+    def activate(self, name, scale=1.0, merge=True):
+        r"""
+        Switches to adapter `name`, deactivating the current one first.
+
+        Args:
+            name (`str`):
+                Name of a loaded adapter
+            scale (`float`, *optional*, defaults to 1.0):
+                Strength of the adapter
+            merge (`bool`, *optional*, defaults to True):
+                Merge the adapter into the base weights. Otherwise its side GEMMs run
+                in every forward pass, which keeps the base weights untouched
+        """
+        assert name in self.adapters, f'Unknown LoRA adapter {name}'
+        if (self.active, self.scale, self.merged) == (name, scale, merge):
+            return
+        self.deactivate()
+        if merge:
+            device = self._evict()
+            for target in self.adapters[name]:
+                weight = self.targets[target].weight
+                compute = weight.device if device is None else device
+                weight.data.copy_(
+                    weight.data.to(compute).float().add_(
+                        self._delta(name, target, scale,
+                                    compute)).to(weight.dtype))
+        else:
+            for target in self.adapters[name]:
+                self.handles.append(self.targets[target].register_forward_hook(
+                    lambda module, args, output, target=target: self._side(
+                        name, target, args[0], output)))
+        self.active, self.scale, self.merged = name, scale, merge
+
+    @torch.no_grad()
+    def deactivate(self):
+        r"""
+        Restores the base model.
+        """
+        if self.active is None:
+            return
+        if self.merged:
+            device = self._evict()
+            for target in self.adapters[self.active]:
+                weight = self.targets[target].weight
+                compute = weight.device if device is None else device
+                weight.data.copy_(
+                    weight.data.to(compute).float().sub_(
+                        self._delta(self.active, target, self.scale,
+                                    compute)).to(weight.dtype))
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        self.active, self.scale, self.merged = None, 1.0, False
+
+    def _evict(self):
+        # streamed blocks may point at device copies of their weights, the
+        # deltas go into the host tensors and are computed on the device of
+        # the offloader, None without offloading
+        offloader = getattr(self.model, 'block_offloader', None)
+        if offloader is None:
+            return None
+        offloader.evict()
+        return offloader.device
+
+    def _factors(self, name, target, device, dtype):
+        key = (name, target, device, dtype)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key][:3]
+
+        down, up, alpha = self.adapters[name][target]
+        down, up = down.to(device, dtype), up.to(device, dtype)
+        size = down.numel() * down.element_size() + \
+            up.numel() * up.element_size()
+        if size <= self.cache_bytes:
+            self.cache[key] = (down, up, alpha, size)
+            self.cached_bytes += size
+            while self.cached_bytes > self.cache_bytes:
+                self.cached_bytes -= self.cache.popitem(last=False)[1][-1]
+        return down, up, alpha
+
+    def _delta(self, name, target, scale, device):
+        down, up, alpha = self._factors(name, target, device, torch.float32)
+        return (up @ down).mul_(alpha * scale)
+
+    def _side(self, name, target, x, output):
+        down, up, alpha = self._factors(name, target, x.device, x.dtype)
+        side = (x @ down.t()) @ up.t()
+        return output + side.mul_(alpha * self.scale).to(output.dtype)
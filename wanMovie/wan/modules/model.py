@@ -8,6 +8,7 @@ from diffusers.configuration_utils import ConfigMixin, register_to_config
 from diffusers.models.modeling_utils import ModelMixin
 
 from .attention import flash_attention
+from .lora import LoRAManager
 
 __all__ = ['WanModel']
 
@@ -37,7 +38,7 @@ def rope_params(max_seq_len, dim, theta=10000):
 
 
 @amp.autocast(enabled=False)
-def rope_apply(x, grid_sizes, freqs):
+def rope_apply(x, grid_sizes, freqs, chunk_size=None):
     n, c = x.size(2), x.size(3) // 2
 
     # split freqs
@@ -49,8 +50,6 @@ def rope_apply(x, grid_sizes, freqs):
         seq_len = f * h * w
 
         # precompute multipliers
-        x_i = torch.view_as_complex(x[i, :seq_len].to(torch.float64).reshape(
-            seq_len, n, -1, 2))
         freqs_i = torch.cat([
             freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
             freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
@@ -58,15 +57,33 @@ def rope_apply(x, grid_sizes, freqs):
         ],
                             dim=-1).reshape(seq_len, 1, -1)
 
-        # apply rotary embedding
-        x_i = torch.view_as_real(x_i * freqs_i).flatten(2)
-        x_i = torch.cat([x_i, x[i, seq_len:]])
+        # apply rotary embedding, chunked to bound the float64 buffers
+        step = seq_len if chunk_size is None else chunk_size
+        x_i = torch.cat([
+            torch.view_as_real(
+                torch.view_as_complex(x[i, s:s + step].to(
+                    torch.float64).reshape(-1, n, c, 2)) *
+                freqs_i[s:s + step]).flatten(2).float()
+            for s in range(0, seq_len, step)
+        ] + [x[i, seq_len:].float()])
 
         # append to collection
         output.append(x_i)
     return torch.stack(output).float()
 
 
+def chunked_attention(q, k, v, chunk_size=None, **kwargs):
+    r"""
+    Runs `flash_attention` over query chunks of at most `chunk_size` tokens.
+    """
+    if chunk_size is None or q.size(1) <= chunk_size:
+        return flash_attention(q, k, v, **kwargs)
+    return torch.cat([
+        flash_attention(u, k, v, **kwargs) for u in q.split(chunk_size, dim=1)
+    ],
+                     dim=1)
+
+
 class WanRMSNorm(nn.Module):
 
     def __init__(self, dim, eps=1e-5):
@@ -115,6 +132,7 @@ class WanSelfAttention(nn.Module):
         self.window_size = window_size
         self.qk_norm = qk_norm
         self.eps = eps
+        self.chunk_size = None
 
         # layers
         self.q = nn.Linear(dim, dim)
@@ -142,11 +160,14 @@ class WanSelfAttention(nn.Module):
             return q, k, v
 
         q, k, v = qkv_fn(x)
-
-        x = flash_attention(
-            q=rope_apply(q, grid_sizes, freqs),
-            k=rope_apply(k, grid_sizes, freqs),
-            v=v,
+        q = rope_apply(q, grid_sizes, freqs, self.chunk_size)
+        k = rope_apply(k, grid_sizes, freqs, self.chunk_size)
+
+        x = chunked_attention(
+            q,
+            k,
+            v,
+            self.chunk_size,
             k_lens=seq_lens,
             window_size=self.window_size)
 
@@ -173,7 +194,7 @@ class WanT2VCrossAttention(WanSelfAttention):
         v = self.v(context).view(b, -1, n, d)
 
         # compute attention
-        x = flash_attention(q, k, v, k_lens=context_lens)
+        x = chunked_attention(q, k, v, self.chunk_size, k_lens=context_lens)
 
         # output
         x = x.flatten(2)
@@ -213,9 +234,9 @@ class WanI2VCrossAttention(WanSelfAttention):
         v = self.v(context).view(b, -1, n, d)
         k_img = self.norm_k_img(self.k_img(context_img)).view(b, -1, n, d)
         v_img = self.v_img(context_img).view(b, -1, n, d)
-        img_x = flash_attention(q, k_img, v_img, k_lens=None)
+        img_x = chunked_attention(q, k_img, v_img, self.chunk_size, k_lens=None)
         # compute attention
-        x = flash_attention(q, k, v, k_lens=context_lens)
+        x = chunked_attention(q, k, v, self.chunk_size, k_lens=context_lens)
 
         # output
         x = x.flatten(2)
@@ -250,6 +271,7 @@ class WanAttentionBlock(nn.Module):
         self.qk_norm = qk_norm
         self.cross_attn_norm = cross_attn_norm
         self.eps = eps
+        self.ffn_chunk_size = None
 
         # layers
         self.norm1 = WanLayerNorm(dim, eps)
@@ -304,7 +326,14 @@ class WanAttentionBlock(nn.Module):
         # cross-attention & ffn function
         def cross_attn_ffn(x, context, context_lens, e):
             x = x + self.cross_attn(self.norm3(x), context, context_lens)
-            y = self.ffn(self.norm2(x).float() * (1 + e[4]) + e[3])
+            y = self.norm2(x).float() * (1 + e[4]) + e[3]
+            if self.ffn_chunk_size is None:
+                y = self.ffn(y)
+            else:
+                y = torch.cat([
+                    self.ffn(u) for u in y.split(self.ffn_chunk_size, dim=1)
+                ],
+                              dim=1)
             with amp.autocast(dtype=torch.float32):
                 x = x + y * e[5]
             return x
@@ -570,6 +599,32 @@ class WanModel(ModelMixin, ConfigMixin):
         x = self.unpatchify(x, grid_sizes)
         return [u.float() for u in x]
 
+    def set_chunk_sizes(self, attn_chunk_size=None, ffn_chunk_size=None):
+        r"""
+        Bounds the activation memory of every block by splitting the sequence.
+
+        Args:
+            attn_chunk_size (`int`, *optional*, defaults to None):
+                Number of query tokens processed at once by the attention layers and
+                rotary embedding. None disables chunking
+            ffn_chunk_size (`int`, *optional*, defaults to None):
+                Number of tokens processed at once by the feed-forward layers. None
+                disables chunking
+        """
+        for block in self.blocks:
+            block.self_attn.chunk_size = attn_chunk_size
+            block.cross_attn.chunk_size = attn_chunk_size
+            block.ffn_chunk_size = ffn_chunk_size
+
+    @property
+    def adapters(self):
+        r"""
+        LoRA adapter manager of the model, created on first access.
+        """
+        if '_adapters' not in self.__dict__:
+            self.__dict__['_adapters'] = LoRAManager(self)
+        return self.__dict__['_adapters']
+
     def unpatchify(self, x, grid_sizes):
         r"""
         Reconstruct video tensors from patch embeddings.
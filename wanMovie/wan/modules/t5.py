@@ -1,12 +1,15 @@
 # Modified from transformers.models.t5.modeling_t5
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import functools
 import logging
 import math
+import os
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from ..utils.cache import TensorCache, cache_key
 from .tokenizers import HuggingfaceTokenizer
 
 __all__ = [
@@ -14,6 +17,7 @@ __all__ = [
     'T5Encoder',
     'T5Decoder',
     'T5EncoderModel',
+    'quantize_t5',
 ]
 
 
@@ -43,6 +47,44 @@ def init_weights(m):
             m.embedding.weight, std=(2 * m.num_buckets * m.num_heads)**-0.5)
 
 
+def additive_mask(mask, dtype):
+    r"""
+    Converts a [B, Lk] or [B, Lq, Lk] padding mask into an additive attention
+    bias broadcastable to [B, N, Lq, Lk].
+    """
+    mask = mask.view(mask.size(0), 1, 1,
+                     -1) if mask.ndim == 2 else mask.unsqueeze(1)
+    return torch.zeros(
+        mask.shape, dtype=dtype, device=mask.device).masked_fill_(
+            mask == 0, torch.finfo(dtype).min)
+
+
+@functools.lru_cache(maxsize=16)
+def relative_position_buckets(lq, lk, bidirectional, num_buckets, max_dist,
+                              device):
+    rel_pos = torch.arange(lk, device=device).unsqueeze(0) - \
+        torch.arange(lq, device=device).unsqueeze(1)
+
+    # preprocess
+    if bidirectional:
+        num_buckets = num_buckets // 2
+        rel_buckets = (rel_pos > 0).long() * num_buckets
+        rel_pos = torch.abs(rel_pos)
+    else:
+        rel_buckets = 0
+        rel_pos = -torch.min(rel_pos, torch.zeros_like(rel_pos))
+
+    # embeddings for small and large positions
+    max_exact = num_buckets // 2
+    rel_pos_large = max_exact + (torch.log(rel_pos.float() / max_exact) /
+                                 math.log(max_dist / max_exact) *
+                                 (num_buckets - max_exact)).long()
+    rel_pos_large = torch.min(rel_pos_large,
+                              torch.full_like(rel_pos_large, num_buckets - 1))
+    rel_buckets += torch.where(rel_pos < max_exact, rel_pos, rel_pos_large)
+    return rel_buckets
+
+
 class GELU(nn.Module):
 
     def forward(self, x):
@@ -87,7 +129,8 @@ class T5Attention(nn.Module):
         """
         x:          [B, L1, C].
         context:    [B, L2, C] or None.
-        mask:       [B, L2] or [B, L1, L2] or None.
+        mask:       [B, L2] or [B, L1, L2] or None. Floating point masks are
+                    additive biases broadcastable to [B, N, L1, L2].
         """
         # check inputs
         context = x if context is None else context
@@ -98,20 +141,23 @@ class T5Attention(nn.Module):
         k = self.k(context).view(b, -1, n, c)
         v = self.v(context).view(b, -1, n, c)
 
-        # attention bias
-        attn_bias = x.new_zeros(b, n, q.size(1), k.size(1))
-        if pos_bias is not None:
-            attn_bias += pos_bias
+        # attention bias, masks may already be additive
+        attn_bias = pos_bias
         if mask is not None:
-            assert mask.ndim in [2, 3]
-            mask = mask.view(b, 1, 1,
-                             -1) if mask.ndim == 2 else mask.unsqueeze(1)
-            attn_bias.masked_fill_(mask == 0, torch.finfo(x.dtype).min)
+            if not mask.is_floating_point():
+                assert mask.ndim in [2, 3]
+                mask = additive_mask(mask, x.dtype)
+            attn_bias = mask if attn_bias is None else attn_bias + mask
+        if attn_bias is not None:
+            attn_bias = attn_bias.to(q.dtype)
 
         # compute attention (T5 does not use scaling)
-        attn = torch.einsum('binc,bjnc->bnij', q, k) + attn_bias
-        attn = F.softmax(attn.float(), dim=-1).type_as(attn)
-        x = torch.einsum('bnij,bjnc->binc', attn, v)
+        x = F.scaled_dot_product_attention(
+            q.transpose(1, 2),
+            k.transpose(1, 2),
+            v.transpose(1, 2),
+            attn_mask=attn_bias,
+            scale=1.0).transpose(1, 2)
 
         # output
         x = x.reshape(b, -1, n * c)
@@ -231,39 +277,14 @@ class T5RelativeEmbedding(nn.Module):
         self.embedding = nn.Embedding(num_buckets, num_heads)
 
     def forward(self, lq, lk):
-        device = self.embedding.weight.device
-        # rel_pos = torch.arange(lk).unsqueeze(0).to(device) - \
-        #     torch.arange(lq).unsqueeze(1).to(device)
-        rel_pos = torch.arange(lk, device=device).unsqueeze(0) - \
-            torch.arange(lq, device=device).unsqueeze(1)
-        rel_pos = self._relative_position_bucket(rel_pos)
+        rel_pos = relative_position_buckets(lq, lk, self.bidirectional,
+                                            self.num_buckets, self.max_dist,
+                                            self.embedding.weight.device)
         rel_pos_embeds = self.embedding(rel_pos)
         rel_pos_embeds = rel_pos_embeds.permute(2, 0, 1).unsqueeze(
             0)  # [1, N, Lq, Lk]
         return rel_pos_embeds.contiguous()
 
-    def _relative_position_bucket(self, rel_pos):
-        # preprocess
-        if self.bidirectional:
-            num_buckets = self.num_buckets // 2
-            rel_buckets = (rel_pos > 0).long() * num_buckets
-            rel_pos = torch.abs(rel_pos)
-        else:
-            num_buckets = self.num_buckets
-            rel_buckets = 0
-            rel_pos = -torch.min(rel_pos, torch.zeros_like(rel_pos))
-
-        # embeddings for small and large positions
-        max_exact = num_buckets // 2
-        rel_pos_large = max_exact + (torch.log(rel_pos.float() / max_exact) /
-                                     math.log(self.max_dist / max_exact) *
-                                     (num_buckets - max_exact)).long()
-        rel_pos_large = torch.min(
-            rel_pos_large, torch.full_like(rel_pos_large, num_buckets - 1))
-        rel_buckets += torch.where(rel_pos < max_exact, rel_pos, rel_pos_large)
-        return rel_buckets
-
-
 class T5Encoder(nn.Module):
 
     def __init__(self,
@@ -303,6 +324,9 @@ class T5Encoder(nn.Module):
     def forward(self, ids, mask=None):
         x = self.token_embedding(ids)
         x = self.dropout(x)
+        # the padding mask is made additive once for all layers
+        if mask is not None and not mask.is_floating_point():
+            mask = additive_mask(mask, x.dtype)
         e = self.pos_embedding(x.size(1),
                                x.size(1)) if self.shared_pos else None
         for block in self.blocks:
@@ -360,6 +384,9 @@ class T5Decoder(nn.Module):
         # layers
         x = self.token_embedding(ids)
         x = self.dropout(x)
+        mask = additive_mask(mask, x.dtype)
+        if encoder_mask is not None and not encoder_mask.is_floating_point():
+            encoder_mask = additive_mask(encoder_mask, x.dtype)
         e = self.pos_embedding(x.size(1),
                                x.size(1)) if self.shared_pos else None
         for block in self.blocks:
@@ -469,6 +496,113 @@ def umt5_xxl(**kwargs):
     return _t5('umt5-xxl', **cfg)
 
 
+class _FloatEmbedding(nn.Module):
+
+    def __init__(self, embedding):
+        super().__init__()
+        self.embedding = embedding
+
+    def forward(self, ids):
+        return self.embedding(ids).float()
+
+
+def quantize_t5(model, empty=False):
+    r"""
+    Converts the linears of a T5 model in place to int8 dynamic quantization,
+    one layer at a time to bound the float32 peak. Norms and position biases
+    run in float32, the token embedding keeps its dtype.
+
+    With `empty`, the model may be built on the meta device. Its linears are
+    replaced by uninitialized quantized ones and the other weights are
+    allocated on the CPU, ready to load a state dict of a quantized model.
+    """
+    from torch.ao.nn.quantized.dynamic import Linear as QuantizedLinear
+    from torch.ao.quantization import default_dynamic_qconfig
+
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, nn.Linear) and empty:
+                setattr(
+                    module, name,
+                    QuantizedLinear(
+                        child.in_features,
+                        child.out_features,
+                        bias_=child.bias is not None))
+            elif isinstance(child, nn.Linear):
+                child = child.float()
+                child.qconfig = default_dynamic_qconfig
+                setattr(module, name, QuantizedLinear.from_float(child))
+            elif isinstance(child, (T5LayerNorm, T5RelativeEmbedding)):
+                child.float()
+    model.token_embedding = _FloatEmbedding(model.token_embedding)
+    if empty:
+        model.to_empty(device='cpu')
+    return model
+
+
+def quantized_t5_path(checkpoint_path, quantization='int8'):
+    # the identity of the source weights is part of the name, a changed
+    # checkpoint is quantized again
+    identity = cache_key(_file_identity(checkpoint_path))[:12]
+    base = os.path.splitext(checkpoint_path)[0]
+    return f'{base}-{quantization}-{identity}.pth'
+
+
+def load_quantized_t5(checkpoint_path, quantized_checkpoint_path,
+                      dtype=torch.bfloat16):
+    r"""
+    Loads the int8 T5 encoder from `quantized_checkpoint_path`, converting and
+    caching it there from the `checkpoint_path` weights on first use. The cache
+    holds the quantized state dict, it is loaded with `weights_only=True` into
+    an empty quantized model.
+    """
+    if os.path.exists(quantized_checkpoint_path):
+        logging.info(f'loading {quantized_checkpoint_path}')
+        model = quantize_t5(
+            umt5_xxl(
+                encoder_only=True,
+                return_tokenizer=False,
+                dtype=dtype,
+                device='meta'),
+            empty=True)
+        model.load_state_dict(
+            torch.load(
+                quantized_checkpoint_path, map_location='cpu',
+                weights_only=True))
+        return model.eval().requires_grad_(False)
+
+    model = umt5_xxl(
+        encoder_only=True, return_tokenizer=False, dtype=dtype,
+        device='cpu').eval().requires_grad_(False)
+    logging.info(f'loading {checkpoint_path}')
+    model.load_state_dict(torch.load(checkpoint_path, map_location='cpu'))
+    logging.info('quantizing T5 to int8')
+    model = quantize_t5(model)
+    try:
+        # write atomically, other processes may load the cache concurrently
+        tmp = f'{quantized_checkpoint_path}.{os.getpid()}.tmp'
+        torch.save(model.state_dict(), tmp)
+        os.replace(tmp, quantized_checkpoint_path)
+        logging.info(f'saved {quantized_checkpoint_path}')
+    except OSError as e:
+        logging.warning(
+            f'Could not cache the quantized T5 at {quantized_checkpoint_path}: {e}'
+        )
+    return model
+
+
+# padded sequence lengths of the encoder
+LENGTH_BUCKETS = (32, 64, 128, 256, 512)
+
+
+def _file_identity(path):
+    # path, size and modification time identify a local file cheaply
+    if path is None or not os.path.exists(path):
+        return path
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
 class T5EncoderModel:
 
     def __init__(
@@ -479,21 +613,37 @@ class T5EncoderModel:
         checkpoint_path=None,
         tokenizer_path=None,
         shard_fn=None,
+        cache_size=256,
+        cache_dir=None,
+        quantization=None,
+        quantized_checkpoint_path=None,
     ):
+        assert quantization in (None, 'int8')
         self.text_len = text_len
         self.dtype = dtype
         self.device = device
         self.checkpoint_path = checkpoint_path
         self.tokenizer_path = tokenizer_path
+        self.quantization = quantization
 
         # init model
-        model = umt5_xxl(
-            encoder_only=True,
-            return_tokenizer=False,
-            dtype=dtype,
-            device=device).eval().requires_grad_(False)
-        logging.info(f'loading {checkpoint_path}')
-        model.load_state_dict(torch.load(checkpoint_path, map_location='cpu'))
+        if quantization is not None:
+            assert torch.device(device).type == 'cpu' and shard_fn is None, \
+                'Quantized T5 only runs on CPU.'
+            if quantized_checkpoint_path is None:
+                quantized_checkpoint_path = quantized_t5_path(
+                    checkpoint_path, quantization)
+            model = load_quantized_t5(checkpoint_path,
+                                      quantized_checkpoint_path, dtype)
+        else:
+            model = umt5_xxl(
+                encoder_only=True,
+                return_tokenizer=False,
+                dtype=dtype,
+                device=device).eval().requires_grad_(False)
+            logging.info(f'loading {checkpoint_path}')
+            model.load_state_dict(
+                torch.load(checkpoint_path, map_location='cpu'))
         self.model = model
         if shard_fn is not None:
             self.model = shard_fn(self.model, sync_module_states=False)
@@ -503,11 +653,62 @@ class T5EncoderModel:
         self.tokenizer = HuggingfaceTokenizer(
             name=tokenizer_path, seq_len=text_len, clean='whitespace')
 
+        # embeddings are cached by normalized text, the identity of the
+        # weights and tokenizer is part of the key
+        self.cache = TensorCache(max_items=cache_size, cache_dir=cache_dir)
+        self.identity = (_file_identity(checkpoint_path),
+                         _file_identity(tokenizer_path), text_len, str(dtype),
+                         quantization)
+
+    def _key(self, text):
+        return cache_key(self.identity, self.tokenizer._clean(text))
+
+    def cached(self, texts):
+        r"""
+        Whether the embeddings of all `texts` are cached, in memory or on disk.
+        """
+        return all(self.cache.get(self._key(u)) is not None for u in texts)
+
     def __call__(self, texts, device):
-        ids, mask = self.tokenizer(
-            texts, return_mask=True, add_special_tokens=True)
-        ids = ids.to(device)
-        mask = mask.to(device)
-        seq_lens = mask.gt(0).sum(dim=1).long()
-        context = self.model(ids, mask)
-        return [u[:v] for u, v in zip(context, seq_lens)]
+        keys = [self._key(u) for u in texts]
+        context = [self.cache.get(k) for k in keys]
+        misses = [i for i, u in enumerate(context) if u is None]
+        if misses:
+            encoded = self._encode([texts[i] for i in misses], device)
+            for i, u in zip(misses, encoded):
+                context[i] = self.cache.put(keys[i], {'context': u})
+        return [u['context'].to(device) for u in context]
+
+    def _encode(self, texts, device):
+        # pad every text to the bound of its LENGTH_BUCKETS bucket instead of
+        # text_len, texts of similar length are encoded together
+        ids = self.tokenizer(
+            texts,
+            padding=False,
+            truncation=True,
+            max_length=self.text_len,
+            return_tensors=None,
+            add_special_tokens=True)
+        seq_lens = [len(u) for u in ids]
+        groups = {}
+        for i, seq_len in enumerate(seq_lens):
+            groups.setdefault(self._bucket(seq_len), []).append(i)
+
+        pad_id = self.tokenizer.tokenizer.pad_token_id or 0
+        context = [None] * len(texts)
+        for length, indices in sorted(groups.items()):
+            batch = torch.full((len(indices), length), pad_id, dtype=torch.long)
+            mask = torch.zeros((len(indices), length), dtype=torch.long)
+            for j, i in enumerate(indices):
+                batch[j, :seq_lens[i]] = torch.tensor(ids[i])
+                mask[j, :seq_lens[i]] = 1
+            out = self.model(batch.to(device), mask.to(device)).to(self.dtype)
+            for j, i in enumerate(indices):
+                context[i] = out[j, :seq_lens[i]]
+        return context
+
+    def _bucket(self, seq_len):
+        for length in LENGTH_BUCKETS:
+            if seq_len <= length:
+                return min(length, self.text_len)
+        return self.text_len
@@ -1,5 +1,6 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
 import logging
+from collections import OrderedDict
 
 import torch
 import torch.cuda.amp as amp
@@ -14,6 +15,44 @@ __all__ = [
 CACHE_T = 2
 
 
+class CausalCache:
+
+    def __init__(self, num_layers):
+        r"""
+        Causal state of a chunked encode or decode: the last input frames of
+        every cached layer, in buffers preallocated at the first chunk and
+        updated in place. Layers find their buffer through their `cache_idx`.
+
+        Args:
+            num_layers (`int`):
+                Number of cached layers, see `index_causal_layers`
+        """
+        self.frames = [None] * num_layers
+        self.chunk = 0
+
+    def extend(self, idx, x, size=CACHE_T):
+        r"""
+        Returns x prefixed with the `size` frames cached for layer `idx`, zeros
+        at the first chunk, and caches the last `size` frames of the result.
+        """
+        buf = self.frames[idx]
+        if buf is None:
+            buf = self.frames[idx] = x.new_zeros(
+                *x.shape[:2], size,
+                *x.shape[3:]).contiguous(memory_format=_memory_format(x))
+        x = torch.cat([buf, x], dim=2)
+        buf.copy_(x[:, :, -size:])
+        return x
+
+
+def _memory_format(x):
+    # torch.cat falls back to the contiguous format on mixed layouts
+    if not x.is_contiguous() and x.is_contiguous(
+            memory_format=torch.channels_last_3d):
+        return torch.channels_last_3d
+    return torch.contiguous_format
+
+
 class CausalConv3d(nn.Conv3d):
     """
     Causal 3d convolusion.
@@ -24,13 +63,22 @@ class CausalConv3d(nn.Conv3d):
         self._padding = (self.padding[2], self.padding[2], self.padding[1],
                          self.padding[1], 2 * self.padding[0], 0)
         self.padding = (0, 0, 0)
-
-    def forward(self, x, cache_x=None):
+        self.cache_idx = None
+
+    def forward(self, x, cache=None):
+        if cache is None and x.shape[2] == 1 and \
+                self._padding[4] == self.kernel_size[0] - 1:
+            # a lone frame only meets the last temporal taps, the others fall
+            # on the causal zero padding
+            return F.conv2d(x[:, :, 0], self.weight[:, :, -1], self.bias,
+                            self.stride[1:], (self._padding[2],
+                                              self._padding[0]),
+                            self.dilation[1:]).unsqueeze(2)
         padding = list(self._padding)
-        if cache_x is not None and self._padding[4] > 0:
-            cache_x = cache_x.to(x.device)
-            x = torch.cat([cache_x, x], dim=2)
-            padding[4] -= cache_x.shape[2]
+        if cache is not None and self._padding[4] > 0:
+            # the cached frames replace the causal zero padding
+            x = cache.extend(self.cache_idx, x, self._padding[4])
+            padding[4] = 0
         x = F.pad(x, padding)
 
         return super().forward(x)
@@ -47,12 +95,29 @@ class RMS_norm(nn.Module):
         self.scale = dim**0.5
         self.gamma = nn.Parameter(torch.ones(shape))
         self.bias = nn.Parameter(torch.zeros(shape)) if bias else 0.
+        # set by fuse_norm_silu
+        self.silu = False
 
     def forward(self, x):
+        if self.silu:
+            return self._forward_silu(x)
         return F.normalize(
             x, dim=(1 if self.channel_first else
                     -1)) * self.scale * self.gamma + self.bias
 
+    def _forward_silu(self, x):
+        # one output tensor scaled, shifted and activated in place, in the
+        # dtype of x; the norm is accumulated in float32
+        norm = torch.linalg.vector_norm(
+            x, dim=(1 if self.channel_first else -1),
+            keepdim=True,
+            dtype=torch.float32)
+        out = x * (self.scale / norm.clamp_min_(1e-12)).to(x.dtype)
+        out.mul_(self.gamma.to(x.dtype))
+        if isinstance(self.bias, torch.Tensor):
+            out.add_(self.bias.to(x.dtype))
+        return F.silu(out, inplace=True)
+
 
 class Upsample(nn.Upsample):
 
@@ -60,6 +125,9 @@ class Upsample(nn.Upsample):
         """
         Fix bfloat16 support for nearest neighbor interpolation.
         """
+        if x.device.type == 'cpu':
+            # supported natively on the CPU
+            return super().forward(x)
         return super().forward(x.float()).type_as(x)
 
 
@@ -98,65 +166,25 @@ class Resample(nn.Module):
         else:
             self.resample = nn.Identity()
 
-    def forward(self, x, feat_cache=None, feat_idx=[0]):
+    def forward(self, x, cache=None):
         b, c, t, h, w = x.size()
-        if self.mode == 'upsample3d':
-            if feat_cache is not None:
-                idx = feat_idx[0]
-                if feat_cache[idx] is None:
-                    feat_cache[idx] = 'Rep'
-                    feat_idx[0] += 1
-                else:
-
-                    cache_x = x[:, :, -CACHE_T:, :, :].clone()
-                    if cache_x.shape[2] < 2 and feat_cache[
-                            idx] is not None and feat_cache[idx] != 'Rep':
-                        # cache last frame of last two chunk
-                        cache_x = torch.cat([
-                            feat_cache[idx][:, :, -1, :, :].unsqueeze(2).to(
-                                cache_x.device), cache_x
-                        ],
-                                            dim=2)
-                    if cache_x.shape[2] < 2 and feat_cache[
-                            idx] is not None and feat_cache[idx] == 'Rep':
-                        cache_x = torch.cat([
-                            torch.zeros_like(cache_x).to(cache_x.device),
-                            cache_x
-                        ],
-                                            dim=2)
-                    if feat_cache[idx] == 'Rep':
-                        x = self.time_conv(x)
-                    else:
-                        x = self.time_conv(x, feat_cache[idx])
-                    feat_cache[idx] = cache_x
-                    feat_idx[0] += 1
-
-                    x = x.reshape(b, 2, c, t, h, w)
-                    x = torch.stack((x[:, 0, :, :, :, :], x[:, 1, :, :, :, :]),
-                                    3)
-                    x = x.reshape(b, c, t * 2, h, w)
+        if self.mode == 'upsample3d' and cache is not None and cache.chunk > 0:
+            # the first chunk is not upsampled in time
+            x = self.time_conv(x, cache)
+            x = x.reshape(b, 2, c, t, h, w)
+            x = torch.stack((x[:, 0, :, :, :, :], x[:, 1, :, :, :, :]), 3)
+            x = x.reshape(b, c, t * 2, h, w)
         t = x.shape[2]
         x = rearrange(x, 'b c t h w -> (b t) c h w')
         x = self.resample(x)
         x = rearrange(x, '(b t) c h w -> b c t h w', t=t)
 
-        if self.mode == 'downsample3d':
-            if feat_cache is not None:
-                idx = feat_idx[0]
-                if feat_cache[idx] is None:
-                    feat_cache[idx] = x.clone()
-                    feat_idx[0] += 1
-                else:
-
-                    cache_x = x[:, :, -1:, :, :].clone()
-                    # if cache_x.shape[2] < 2 and feat_cache[idx] is not None and feat_cache[idx]!='Rep':
-                    #     # cache last frame of last two chunk
-                    #     cache_x = torch.cat([feat_cache[idx][:, :, -1, :, :].unsqueeze(2).to(cache_x.device), cache_x], dim=2)
-
-                    x = self.time_conv(
-                        torch.cat([feat_cache[idx][:, :, -1:, :, :], x], 2))
-                    feat_cache[idx] = cache_x
-                    feat_idx[0] += 1
+        if self.mode == 'downsample3d' and cache is not None:
+            # strided over the last frame of the previous chunk and this one,
+            # the first chunk only fills the cache
+            x_ = cache.extend(self.time_conv.cache_idx, x, 1)
+            if cache.chunk > 0:
+                x = self.time_conv(x_)
         return x
 
     def init_weight(self, conv):
@@ -199,22 +227,11 @@ class ResidualBlock(nn.Module):
         self.shortcut = CausalConv3d(in_dim, out_dim, 1) \
             if in_dim != out_dim else nn.Identity()
 
-    def forward(self, x, feat_cache=None, feat_idx=[0]):
+    def forward(self, x, cache=None):
         h = self.shortcut(x)
         for layer in self.residual:
-            if isinstance(layer, CausalConv3d) and feat_cache is not None:
-                idx = feat_idx[0]
-                cache_x = x[:, :, -CACHE_T:, :, :].clone()
-                if cache_x.shape[2] < 2 and feat_cache[idx] is not None:
-                    # cache last frame of last two chunk
-                    cache_x = torch.cat([
-                        feat_cache[idx][:, :, -1, :, :].unsqueeze(2).to(
-                            cache_x.device), cache_x
-                    ],
-                                        dim=2)
-                x = layer(x, feat_cache[idx])
-                feat_cache[idx] = cache_x
-                feat_idx[0] += 1
+            if isinstance(layer, CausalConv3d):
+                x = layer(x, cache)
             else:
                 x = layer(x)
         return x + h
@@ -315,54 +332,31 @@ class Encoder3d(nn.Module):
             RMS_norm(out_dim, images=False), nn.SiLU(),
             CausalConv3d(out_dim, z_dim, 3, padding=1))
 
-    def forward(self, x, feat_cache=None, feat_idx=[0]):
-        if feat_cache is not None:
-            idx = feat_idx[0]
-            cache_x = x[:, :, -CACHE_T:, :, :].clone()
-            if cache_x.shape[2] < 2 and feat_cache[idx] is not None:
-                # cache last frame of last two chunk
-                cache_x = torch.cat([
-                    feat_cache[idx][:, :, -1, :, :].unsqueeze(2).to(
-                        cache_x.device), cache_x
-                ],
-                                    dim=2)
-            x = self.conv1(x, feat_cache[idx])
-            feat_cache[idx] = cache_x
-            feat_idx[0] += 1
-        else:
-            x = self.conv1(x)
+    def forward(self, x, cache=None):
+        x = self.conv1(x, cache)
 
         ## downsamples
         for layer in self.downsamples:
-            if feat_cache is not None:
-                x = layer(x, feat_cache, feat_idx)
+            if isinstance(layer, (ResidualBlock, Resample)):
+                x = layer(x, cache)
             else:
                 x = layer(x)
 
         ## middle
         for layer in self.middle:
-            if isinstance(layer, ResidualBlock) and feat_cache is not None:
-                x = layer(x, feat_cache, feat_idx)
+            if isinstance(layer, ResidualBlock):
+                x = layer(x, cache)
             else:
                 x = layer(x)
 
         ## head
         for layer in self.head:
-            if isinstance(layer, CausalConv3d) and feat_cache is not None:
-                idx = feat_idx[0]
-                cache_x = x[:, :, -CACHE_T:, :, :].clone()
-                if cache_x.shape[2] < 2 and feat_cache[idx] is not None:
-                    # cache last frame of last two chunk
-                    cache_x = torch.cat([
-                        feat_cache[idx][:, :, -1, :, :].unsqueeze(2).to(
-                            cache_x.device), cache_x
-                    ],
-                                        dim=2)
-                x = layer(x, feat_cache[idx])
-                feat_cache[idx] = cache_x
-                feat_idx[0] += 1
+            if isinstance(layer, CausalConv3d):
+                x = layer(x, cache)
             else:
                 x = layer(x)
+        if cache is not None:
+            cache.chunk += 1
         return x
 
 
@@ -420,66 +414,123 @@ class Decoder3d(nn.Module):
             RMS_norm(out_dim, images=False), nn.SiLU(),
             CausalConv3d(out_dim, 3, 3, padding=1))
 
-    def forward(self, x, feat_cache=None, feat_idx=[0]):
+    def forward(self, x, cache=None):
         ## conv1
-        if feat_cache is not None:
-            idx = feat_idx[0]
-            cache_x = x[:, :, -CACHE_T:, :, :].clone()
-            if cache_x.shape[2] < 2 and feat_cache[idx] is not None:
-                # cache last frame of last two chunk
-                cache_x = torch.cat([
-                    feat_cache[idx][:, :, -1, :, :].unsqueeze(2).to(
-                        cache_x.device), cache_x
-                ],
-                                    dim=2)
-            x = self.conv1(x, feat_cache[idx])
-            feat_cache[idx] = cache_x
-            feat_idx[0] += 1
-        else:
-            x = self.conv1(x)
+        x = self.conv1(x, cache)
 
         ## middle
         for layer in self.middle:
-            if isinstance(layer, ResidualBlock) and feat_cache is not None:
-                x = layer(x, feat_cache, feat_idx)
+            if isinstance(layer, ResidualBlock):
+                x = layer(x, cache)
             else:
                 x = layer(x)
 
         ## upsamples
         for layer in self.upsamples:
-            if feat_cache is not None:
-                x = layer(x, feat_cache, feat_idx)
+            if isinstance(layer, (ResidualBlock, Resample)):
+                x = layer(x, cache)
             else:
                 x = layer(x)
 
         ## head
         for layer in self.head:
-            if isinstance(layer, CausalConv3d) and feat_cache is not None:
-                idx = feat_idx[0]
-                cache_x = x[:, :, -CACHE_T:, :, :].clone()
-                if cache_x.shape[2] < 2 and feat_cache[idx] is not None:
-                    # cache last frame of last two chunk
-                    cache_x = torch.cat([
-                        feat_cache[idx][:, :, -1, :, :].unsqueeze(2).to(
-                            cache_x.device), cache_x
-                    ],
-                                        dim=2)
-                x = layer(x, feat_cache[idx])
-                feat_cache[idx] = cache_x
-                feat_idx[0] += 1
+            if isinstance(layer, CausalConv3d):
+                x = layer(x, cache)
             else:
                 x = layer(x)
+        if cache is not None:
+            cache.chunk += 1
         return x
 
 
-def count_conv3d(model):
+def fuse_norm_silu(model):
+    r"""
+    Folds every SiLU that follows an `RMS_norm` into the norm, which then
+    normalizes, scales and activates one tensor in place. The SiLU modules are
+    replaced by identities, the state dict is unchanged.
+    """
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for i in range(len(module) - 1):
+            if isinstance(module[i], RMS_norm) and isinstance(
+                    module[i + 1], nn.SiLU):
+                module[i].silu = True
+                module[i + 1] = nn.Identity()
+
+
+def to_channels_last(model):
+    r"""
+    Converts the conv weights of model to the channels-last layouts, 3d for
+    `CausalConv3d` and 2d for `nn.Conv2d`, which the oneDNN kernels of the CPU
+    prefer.
+    """
+    for module in model.modules():
+        if isinstance(module, (nn.Conv2d, nn.Conv3d)):
+            memory_format = torch.channels_last_3d if module.weight.dim(
+            ) == 5 else torch.channels_last
+            module.weight.data = module.weight.data.contiguous(
+                memory_format=memory_format)
+
+
+def index_causal_layers(model):
+    r"""
+    Assigns every causal conv of model its buffer index in a `CausalCache`
+    and returns the number of layers.
+    """
     count = 0
     for m in model.modules():
         if isinstance(m, CausalConv3d):
+            m.cache_idx = count
             count += 1
     return count
 
 
+def _tile_starts(size, tile, stride):
+    # the last tile is aligned to the border instead of being cut
+    if size <= tile:
+        return [0]
+    return list(range(0, size - tile, stride)) + [size - tile]
+
+
+def _blend_ramp(size, overlap, lead, trail, device):
+    w = torch.ones(size, device=device)
+    overlap = min(overlap, size // 2)
+    if overlap > 0:
+        ramp = torch.arange(1, overlap + 1, device=device) / (overlap + 1)
+        if lead:
+            w[:overlap] = ramp
+        if trail:
+            w[-overlap:] = torch.minimum(w[-overlap:], ramp.flip(0))
+    return w
+
+
+def _scale_slice(s, scale):
+    return slice(s.start * scale, s.stop * scale)
+
+
+def _tiles(h, w, tile, stride, overlap, device, scale=1):
+    r"""
+    Splits an [h, w] plane into overlapping tiles.
+
+    Returns:
+        List of (row slice, column slice, blend weights of shape
+        [h' * scale, w' * scale]), the weights ramp linearly over the `overlap`
+        elements shared with each neighbour.
+    """
+    rows, cols = _tile_starts(h, tile, stride), _tile_starts(w, tile, stride)
+    tiles = []
+    for r in rows:
+        for c in cols:
+            th, tw = min(tile, h - r), min(tile, w - c)
+            weight = _blend_ramp(th * scale, overlap, r > 0, r + th < h,
+                                 device)[:, None] * _blend_ramp(
+                                     tw * scale, overlap, c > 0, c + tw < w,
+                                     device)[None, :]
+            tiles.append((slice(r, r + th), slice(c, c + tw), weight))
+    return tiles
+
+
 class WanVAE_(nn.Module):
 
     def __init__(self,
@@ -498,6 +549,7 @@ class WanVAE_(nn.Module):
         self.attn_scales = attn_scales
         self.temperal_downsample = temperal_downsample
         self.temperal_upsample = temperal_downsample[::-1]
+        self.spatial_scale = 2**(len(dim_mult) - 1)
 
         # modules
         self.encoder = Encoder3d(dim, z_dim * 2, dim_mult, num_res_blocks,
@@ -506,6 +558,9 @@ class WanVAE_(nn.Module):
         self.conv2 = CausalConv3d(z_dim, z_dim, 1)
         self.decoder = Decoder3d(dim, z_dim, dim_mult, num_res_blocks,
                                  attn_scales, self.temperal_upsample, dropout)
+        self._conv_num = index_causal_layers(self.decoder)
+        self._enc_conv_num = index_causal_layers(self.encoder)
+        self.clear_cache()
 
     def forward(self, x):
         mu, log_var = self.encode(x)
@@ -513,25 +568,19 @@ class WanVAE_(nn.Module):
         x_recon = self.decode(z)
         return x_recon, mu, log_var
 
-    def encode(self, x, scale):
+    def encode(self, x, scale, tile_size=None, tile_overlap=64, chunk_size=1):
+        r"""
+        Encodes x of shape [b, 3, t, h, w]. With `tile_size`, the frames are
+        split into tiles of `tile_size + tile_overlap` pixels, each encoded over
+        the whole clip with its own causal cache, and the seams are blended.
+        After the first frame, the encoder runs on `chunk_size` chunks of 4
+        frames at once, which gives the same result through the causal cache.
+        """
         self.clear_cache()
-        ## cache
-        t = x.shape[2]
-        iter_ = 1 + (t - 1) // 4
-        ## 对encode输入的x，按时间拆分为1、4、4、4....
-        for i in range(iter_):
-            self._enc_conv_idx = [0]
-            if i == 0:
-                out = self.encoder(
-                    x[:, :, :1, :, :],
-                    feat_cache=self._enc_feat_map,
-                    feat_idx=self._enc_conv_idx)
-            else:
-                out_ = self.encoder(
-                    x[:, :, 1 + 4 * (i - 1):1 + 4 * i, :, :],
-                    feat_cache=self._enc_feat_map,
-                    feat_idx=self._enc_conv_idx)
-                out = torch.cat([out, out_], 2)
+        if tile_size is None:
+            out = self._encode(x, self._enc_feat_map, chunk_size)
+        else:
+            out = self._encode_tiled(x, tile_size, tile_overlap, chunk_size)
         mu, log_var = self.conv1(out).chunk(2, dim=1)
         if isinstance(scale[0], torch.Tensor):
             mu = (mu - scale[0].view(1, self.z_dim, 1, 1, 1)) * scale[1].view(
@@ -541,32 +590,140 @@ class WanVAE_(nn.Module):
         self.clear_cache()
         return mu
 
-    def decode(self, z, scale):
-        self.clear_cache()
+    def _encode(self, x, cache, chunk_size=1):
+        ## 对encode输入的x，按时间拆分为1、4、4、4....
+        ## the chunks of 4 frames are grouped by chunk_size
+        t = 1 + 4 * ((x.shape[2] - 1) // 4)
+        step = 4 * chunk_size
+        # a single image needs no causal cache
+        out = [self.encoder(x[:, :, :1, :, :], cache if t > 1 else None)]
+        for i in range(1, t, step):
+            out.append(self.encoder(x[:, :, i:min(i + step, t), :, :], cache))
+        return torch.cat(out, 2)
+
+    def _encode_tiled(self, x, tile_size, tile_overlap, chunk_size=1):
+        s = self.spatial_scale
+        h, w = x.shape[3] // s, x.shape[4] // s
+        out = weight = None
+        for rows, cols, tile_weight in _tiles(
+                h, w, (tile_size + tile_overlap) // s, tile_size // s,
+                tile_overlap // s, x.device):
+            out_ = self._encode(
+                x[:, :, :, rows.start * s:rows.stop * s,
+                  cols.start * s:cols.stop * s],
+                CausalCache(self._enc_conv_num), chunk_size)
+            if out is None:
+                out = out_.new_zeros(*out_.shape[:3], h, w)
+                weight = tile_weight.new_zeros(h, w)
+            out[:, :, :, rows, cols] += out_ * tile_weight
+            weight[rows, cols] += tile_weight
+        return out / weight
+
+    def _unscale(self, z, scale):
         # z: [b,c,t,h,w]
         if isinstance(scale[0], torch.Tensor):
-            z = z / scale[1].view(1, self.z_dim, 1, 1, 1) + scale[0].view(
+            return z / scale[1].view(1, self.z_dim, 1, 1, 1) + scale[0].view(
                 1, self.z_dim, 1, 1, 1)
-        else:
-            z = z / scale[1] + scale[0]
-        iter_ = z.shape[2]
-        x = self.conv2(z)
-        for i in range(iter_):
-            self._conv_idx = [0]
-            if i == 0:
-                out = self.decoder(
-                    x[:, :, i:i + 1, :, :],
-                    feat_cache=self._feat_map,
-                    feat_idx=self._conv_idx)
-            else:
-                out_ = self.decoder(
-                    x[:, :, i:i + 1, :, :],
-                    feat_cache=self._feat_map,
-                    feat_idx=self._conv_idx)
-                out = torch.cat([out, out_], 2)
+        return z / scale[1] + scale[0]
+
+    def _decode_frames(self, x, cache, chunk_size=1):
+        # decodes the first latent frame alone, which is not upsampled in
+        # time, then chunk_size latent frames at a time through the cache
+        # a single image needs no causal cache
+        yield self.decoder(x[:, :, :1, :, :],
+                           cache if x.shape[2] > 1 else None)
+        for i in range(1, x.shape[2], chunk_size):
+            yield self.decoder(x[:, :, i:i + chunk_size, :, :], cache)
+
+    def decode_stream(self,
+                      z,
+                      scale,
+                      tile_size=None,
+                      tile_overlap=64,
+                      chunk_size=1):
+        r"""
+        Decodes z chunk by chunk and yields the decoded frames of every chunk as
+        soon as they are ready: 1 frame for the first latent frame, then 4 per
+        latent frame for chunks of `chunk_size` latent frames. With `tile_size`,
+        the tiles are decoded one after the other over the whole clip, so only
+        the causal cache of one tile is alive, and the chunks are yielded from
+        the blended video once the last tile is done.
+        """
+        if tile_size is not None:
+            frames = 1 + (z.shape[2] - 1) * 2**sum(self.temperal_upsample)
+            out = self._decode_tiled(z, scale, frames, tile_size,
+                                     tile_overlap, chunk_size)
+            yield out[:, :, :1]
+            step = chunk_size * 2**sum(self.temperal_upsample)
+            for i in range(1, frames, step):
+                yield out[:, :, i:i + step]
+            return
+
         self.clear_cache()
+        x = self.conv2(self._unscale(z, scale))
+        try:
+            yield from self._decode_frames(x, self._feat_map, chunk_size)
+        finally:
+            self.clear_cache()
+
+    def decode(self, z, scale, tile_size=None, tile_overlap=64, chunk_size=1):
+        r"""
+        Decodes z of shape [b, c, t, h, w]. With `tile_size`, the latent is
+        split into tiles of `tile_size + tile_overlap` output pixels, each
+        decoded over the whole clip with its own causal cache, and the seams
+        are blended. After the first latent frame, the decoder runs on
+        `chunk_size` latent frames at once.
+        """
+        frames = 1 + (z.shape[2] - 1) * 2**sum(self.temperal_upsample)
+        if tile_size is not None:
+            return self._decode_tiled(z, scale, frames, tile_size,
+                                      tile_overlap, chunk_size)
+
+        # write the chunks into a preallocated video instead of growing it
+        out, t = None, 0
+        for out_ in self.decode_stream(z, scale, chunk_size=chunk_size):
+            if out is None:
+                out = out_.new_empty(*out_.shape[:2], frames,
+                                     *out_.shape[3:])
+            out[:, :, t:t + out_.shape[2]] = out_
+            t += out_.shape[2]
         return out
 
+    def _latent_tiles(self, x, tile_size, tile_overlap):
+        # tiles of the latent with blend weights in output pixels
+        s = self.spatial_scale
+        return _tiles(x.shape[3], x.shape[4], (tile_size + tile_overlap) // s,
+                      tile_size // s, tile_overlap, x.device, s)
+
+    def _decode_tiled(self,
+                      z,
+                      scale,
+                      frames,
+                      tile_size,
+                      tile_overlap,
+                      chunk_size=1):
+        self.clear_cache()
+        x = self.conv2(self._unscale(z, scale))
+        s = self.spatial_scale
+        out = weight = None
+        for rows, cols, tile_weight in self._latent_tiles(
+                x, tile_size, tile_overlap):
+            t = 0
+            for out_ in self._decode_frames(x[:, :, :, rows, cols],
+                                            CausalCache(self._conv_num),
+                                            chunk_size):
+                if out is None:
+                    out = out_.new_zeros(*out_.shape[:2], frames,
+                                         x.shape[3] * s, x.shape[4] * s)
+                    weight = tile_weight.new_zeros(out.shape[3:])
+                out[:, :, t:t + out_.shape[2],
+                    _scale_slice(rows, s),
+                    _scale_slice(cols, s)] += out_ * tile_weight
+                t += out_.shape[2]
+            weight[_scale_slice(rows, s), _scale_slice(cols, s)] += tile_weight
+        self.clear_cache()
+        return out.div_(weight)
+
     def reparameterize(self, mu, log_var):
         std = torch.exp(0.5 * log_var)
         eps = torch.randn_like(std)
@@ -580,13 +737,9 @@ class WanVAE_(nn.Module):
         return mu + std * torch.randn_like(std)
 
     def clear_cache(self):
-        self._conv_num = count_conv3d(self.decoder)
-        self._conv_idx = [0]
-        self._feat_map = [None] * self._conv_num
+        self._feat_map = CausalCache(self._conv_num)
         #cache encode
-        self._enc_conv_num = count_conv3d(self.encoder)
-        self._enc_conv_idx = [0]
-        self._enc_feat_map = [None] * self._enc_conv_num
+        self._enc_feat_map = CausalCache(self._enc_conv_num)
 
 
 def _video_vae(pretrained_path=None, z_dim=None, device='cpu', **kwargs):
@@ -622,9 +775,35 @@ class WanVAE:
                  z_dim=16,
                  vae_pth='cache/vae_step_411000.pth',
                  dtype=torch.float,
-                 device="cuda"):
+                 device="cuda",
+                 tile_size=None,
+                 tile_overlap=64,
+                 chunk_size=1,
+                 cpu_mode=False):
+        r"""
+        Video VAE of Wan with normalized latents.
+
+        Args:
+            cpu_mode (`bool`, *optional*, defaults to False):
+                Optimizes CPU inference: the conv weights and activations use the
+                channels-last layouts, the VAE runs under bf16 autocast and the
+                SiLU after every norm is fused into it. Requires a CPU device
+            tile_size, tile_overlap:
+                See `set_tiling`
+            chunk_size:
+                See `set_chunk_size`
+        """
+        assert not cpu_mode or torch.device(device).type == 'cpu', \
+            "cpu_mode requires a CPU device."
         self.dtype = dtype
         self.device = device
+        self.cpu_mode = cpu_mode
+        self.set_tiling(tile_size, tile_overlap)
+        self.set_chunk_size(chunk_size)
+        # latents of black videos, on the CPU, for the few most recent
+        # resolutions, see `encode_first_frames`
+        self.zero_tails = OrderedDict()
+        self.zero_tails_size = 4
 
         mean = [
             -0.7571, -0.7089, -0.9113, 0.1075, -0.1745, 0.9653, -0.1517, 1.5508,
@@ -643,21 +822,158 @@ class WanVAE:
             pretrained_path=vae_pth,
             z_dim=z_dim,
         ).eval().requires_grad_(False).to(device)
+        if cpu_mode:
+            fuse_norm_silu(self.model)
+            to_channels_last(self.model)
+
+    def set_tiling(self, tile_size=None, tile_overlap=64):
+        r"""
+        Enables spatially tiled encoding and decoding, which bounds the memory
+        of the conv activations and causal caches by the tile size.
+
+        Args:
+            tile_size (`int`, *optional*, defaults to None):
+                Distance in pixels between neighbouring tiles, a multiple of 8.
+                None disables tiling
+            tile_overlap (`int`, *optional*, defaults to 64):
+                Pixels shared by neighbouring tiles and blended linearly, a
+                multiple of 8
+        """
+        if tile_size is not None:
+            assert tile_size % 8 == 0 and tile_overlap % 8 == 0, \
+                "VAE tile size and overlap must be multiples of 8."
+            assert 0 <= tile_overlap <= tile_size
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+
+    def set_chunk_size(self, chunk_size=1):
+        r"""
+        Sets the number of latent frames the decoder processes at once, and of
+        chunks of 4 frames for the encoder. Larger chunks run the 3D convs on
+        longer clips at the cost of activation memory, the result is the same.
+        """
+        assert chunk_size >= 1
+        self.chunk_size = chunk_size
+
+    def _autocast(self):
+        if self.cpu_mode:
+            return torch.autocast('cpu', dtype=torch.bfloat16)
+        return amp.autocast(dtype=self.dtype)
+
+    def _layout(self, x):
+        # x: [b,c,t,h,w]
+        if self.cpu_mode:
+            return x.contiguous(memory_format=torch.channels_last_3d)
+        return x
+
+    def _batched(self, fn, inputs):
+        # one batched pass per group of same-shaped inputs, in input order
+        groups = {}
+        for i, u in enumerate(inputs):
+            groups.setdefault((u.shape, u.dtype, u.device), []).append(i)
+        outputs = [None] * len(inputs)
+        for indices in groups.values():
+            out = fn(torch.stack([inputs[i] for i in indices]))
+            for i, u in zip(indices, out.unbind(0)):
+                outputs[i] = u
+        return outputs
 
     def encode(self, videos):
         """
-        videos: A list of videos each with shape [C, T, H, W].
+        videos: A list of videos each with shape [C, T, H, W]. Videos of the
+        same shape are encoded as one batch.
         """
-        with amp.autocast(dtype=self.dtype):
-            return [
-                self.model.encode(u.unsqueeze(0), self.scale).float().squeeze(0)
-                for u in videos
-            ]
+
+        def encode(u):
+            return self.model.encode(
+                self._layout(u), self.scale, self.tile_size, self.tile_overlap,
+                self.chunk_size).float().contiguous()
+
+        with self._autocast():
+            return self._batched(encode, videos)
+
+    def encode_first_frames(self, images, frame_num, warmup_chunks=1):
+        r"""
+        Encodes videos made of an image followed by `frame_num - 1` black
+        frames, the conditioning of image-to-video.
+
+        Only the image and the first `warmup_chunks` chunks of 4 black frames
+        are encoded; being a causal prefix, their latents are exact. The latents
+        of the remaining black frames are taken from a video of black frames,
+        encoded once per resolution and kept on the CPU for the 4 most recent
+        resolutions. They only depend on the image through the causal cache,
+        whose influence fades over the following chunks, so more warmup chunks
+        trade speed for fidelity.
+
+        Args:
+            images (`list[torch.Tensor]`):
+                Images of shape [C, H, W] in [-1, 1]
+            frame_num (`int`):
+                Number of frames, 4n+1
+            warmup_chunks (`int`, *optional*, defaults to 1):
+                Number of black chunks encoded after each image. With
+                `(frame_num - 1) // 4` chunks, the videos are encoded entirely
+
+        Returns:
+            list[torch.Tensor]: Latents of shape [16, (frame_num - 1) // 4 + 1,
+            H / 8, W / 8], as `encode` would return them for the full videos.
+        """
+        head = min(1 + 4 * warmup_chunks, frame_num)
+        latents = self.encode([
+            torch.cat([u[:, None],
+                       u[:, None].new_zeros(u.shape[0], head - 1,
+                                            *u.shape[1:])],
+                      dim=1) for u in images
+        ])
+        if head == frame_num:
+            return latents
+        for i, u in enumerate(images):
+            c, h, w = u.shape
+            key = (h, w, frame_num, self.tile_size, self.tile_overlap)
+            if key in self.zero_tails:
+                self.zero_tails.move_to_end(key)
+            else:
+                self.zero_tails[key] = self.encode(
+                    [u.new_zeros(c, frame_num, h, w)])[0].cpu()
+                while len(self.zero_tails) > self.zero_tails_size:
+                    self.zero_tails.popitem(last=False)
+            tail = self.zero_tails[key][:, latents[i].shape[1]:]
+            latents[i] = torch.cat(
+                [latents[i], tail.to(latents[i].device)], dim=1)
+        return latents
 
     def decode(self, zs):
-        with amp.autocast(dtype=self.dtype):
-            return [
-                self.model.decode(u.unsqueeze(0),
-                                  self.scale).float().clamp_(-1, 1).squeeze(0)
-                for u in zs
-            ]
+        """
+        zs: A list of latents each with shape [C, T, H, W]. Latents of the same
+        shape are decoded as one batch.
+        """
+
+        def decode(u):
+            return self.model.decode(
+                self._layout(u), self.scale, self.tile_size, self.tile_overlap,
+                self.chunk_size).float().clamp_(-1, 1).contiguous()
+
+        with self._autocast():
+            return self._batched(decode, zs)
+
+    def decode_stream(self, z):
+        r"""
+        Decodes a single latent of shape [C, T, H, W] chunk by chunk.
+
+        Yields:
+            Tensors of shape [3, t, H * 8, W * 8] in [-1, 1], 1 frame first and
+            4 frames per latent frame of every chunk after that. Only the chunk
+            being decoded and the causal cache are kept in memory. With tiling,
+            the decoded video is kept as well and the chunks follow the last
+            tile.
+        """
+        chunks = self.model.decode_stream(
+            self._layout(z.unsqueeze(0)), self.scale, self.tile_size,
+            self.tile_overlap, self.chunk_size)
+        while True:
+            # enter autocast per chunk, the consumer runs between chunks
+            with self._autocast(), torch.no_grad():
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            yield chunk.float().clamp_(-1, 1).squeeze(0).contiguous()
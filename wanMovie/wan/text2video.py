@@ -21,6 +21,10 @@ from .modules.vae import WanVAE
 from .utils.fm_solvers import (FlowDPMSolverMultistepScheduler,
                                get_sampling_sigmas, retrieve_timesteps)
 from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .utils.offload import BlockOffloader
+from .utils.registry import default_registry
+from .utils.text_server import TextEncoderClient
+from .utils.utils import load_in_parallel
 
 
 class WanT2V:
@@ -35,6 +39,11 @@ class WanT2V:
         dit_fsdp=False,
         use_usp=False,
         t5_cpu=False,
+        offload_blocks=None,
+        registry=None,
+        t5_cache_dir=None,
+        t5_quant=None,
+        t5_socket=None,
     ):
         r"""
         Initializes the Wan text-to-video generation model components.
@@ -56,56 +65,405 @@ class WanT2V:
                 Enable distribution strategy of USP.
             t5_cpu (`bool`, *optional*, defaults to False):
                 Whether to place T5 model on CPU. Only works without t5_fsdp.
+            offload_blocks (`int`, *optional*, defaults to None):
+                Stream the DiT blocks from CPU, keeping only this many blocks resident on
+                the GPU while the next ones are prefetched. Only works without dit_fsdp.
+            registry (`ComponentRegistry`, *optional*, defaults to None):
+                Registry the components are acquired from. Defaults to the process-wide
+                registry, so pipelines built from the same checkpoints share them.
+            t5_cache_dir (`str`, *optional*, defaults to None):
+                Directory persisting the prompt embeddings across processes. Ignored
+                with t5_fsdp, whose ranks must encode in lockstep.
+            t5_quant (`str`, *optional*, defaults to None):
+                Quantize the T5 model, only 'int8' is supported. Only works with t5_cpu.
+            t5_socket (`str`, *optional*, defaults to None):
+                Unix socket of a text encoder server (wan/utils/text_server.py). If
+                given, prompts are encoded by the server instead of a local T5 model.
         """
         self.device = torch.device(f"cuda:{device_id}")
         self.config = config
         self.rank = rank
-        self.t5_cpu = t5_cpu
+        # embeddings of a text encoder server arrive on the CPU
+        self.t5_cpu = t5_cpu or t5_socket is not None
 
         self.num_train_timesteps = config.num_train_timesteps
         self.param_dtype = config.param_dtype
 
         shard_fn = partial(shard_model, device_id=device_id)
-        self.text_encoder = T5EncoderModel(
-            text_len=config.text_len,
-            dtype=config.t5_dtype,
-            device=torch.device('cpu'),
-            checkpoint_path=os.path.join(checkpoint_dir, config.t5_checkpoint),
-            tokenizer_path=os.path.join(checkpoint_dir, config.t5_tokenizer),
-            shard_fn=shard_fn if t5_fsdp else None)
-
         self.vae_stride = config.vae_stride
         self.patch_size = config.patch_size
-        self.vae = WanVAE(
-            vae_pth=os.path.join(checkpoint_dir, config.vae_checkpoint),
-            device=self.device)
-
-        logging.info(f"Creating WanModel from {checkpoint_dir}")
-        self.model = WanModel.from_pretrained(checkpoint_dir)
-        self.model.eval().requires_grad_(False)
 
         if use_usp:
             from xfuser.core.distributed import \
                 get_sequence_parallel_world_size
-
-            from .distributed.xdit_context_parallel import (usp_attn_forward,
-                                                            usp_dit_forward)
-            for block in self.model.blocks:
-                block.self_attn.forward = types.MethodType(
-                    usp_attn_forward, block.self_attn)
-            self.model.forward = types.MethodType(usp_dit_forward, self.model)
             self.sp_size = get_sequence_parallel_world_size()
         else:
             self.sp_size = 1
+        if dit_fsdp:
+            assert offload_blocks is None, "offload_blocks does not work with dit_fsdp."
+        assert t5_quant is None or t5_cpu, "t5_quant only works with t5_cpu."
+
+        # components are shared with every pipeline built from the same
+        # checkpoints, dtypes and placements
+        self.registry = default_registry if registry is None else registry
+        self.t5_key = ('t5',
+                       os.path.abspath(
+                           os.path.join(checkpoint_dir, config.t5_checkpoint)),
+                       os.path.abspath(
+                           os.path.join(checkpoint_dir, config.t5_tokenizer)),
+                       config.text_len, config.t5_dtype, t5_fsdp, t5_quant,
+                       torch.device('cpu') if t5_cpu else self.device,
+                       None if t5_cache_dir is None else
+                       os.path.abspath(t5_cache_dir))
+        self.vae_key = ('vae',
+                        os.path.abspath(
+                            os.path.join(checkpoint_dir,
+                                         config.vae_checkpoint)), self.device)
+        self.model_key = ('dit', os.path.abspath(checkpoint_dir),
+                          config.param_dtype, dit_fsdp, use_usp,
+                          offload_blocks, self.device)
+
+        acquired = []
+
+        def acquire(key, factory):
+            component = self.registry.acquire(key, factory)
+            acquired.append(key)
+            return component
+
+        # independent components are loaded concurrently
+        logging.info(f"Creating WanModel from {checkpoint_dir}")
+        loaders = {
+            'text_encoder':
+                partial(
+                    acquire, self.t5_key,
+                    partial(
+                        T5EncoderModel,
+                        text_len=config.text_len,
+                        dtype=config.t5_dtype,
+                        device=torch.device('cpu'),
+                        checkpoint_path=os.path.join(checkpoint_dir,
+                                                     config.t5_checkpoint),
+                        tokenizer_path=os.path.join(checkpoint_dir,
+                                                    config.t5_tokenizer),
+                        cache_dir=None if t5_fsdp else t5_cache_dir,
+                        quantization=t5_quant)),
+            'vae':
+                partial(
+                    acquire, self.vae_key,
+                    partial(
+                        WanVAE,
+                        vae_pth=os.path.join(checkpoint_dir,
+                                             config.vae_checkpoint),
+                        device=self.device)),
+            'model':
+                partial(acquire, self.model_key,
+                        partial(WanModel.from_pretrained, checkpoint_dir)),
+        }
+        if t5_socket is not None:
+            loaders['text_encoder'] = partial(TextEncoderClient, t5_socket)
+        # sharding and placement run once per shared component, and
+        # collectives stay on the main thread
+        def prepare_text_encoder(text_encoder):
+            if t5_fsdp:
+                text_encoder.model = shard_fn(
+                    text_encoder.model, sync_module_states=False)
+            return text_encoder
+
+        def prepare_model(model):
+            model.eval().requires_grad_(False)
+            if use_usp:
+                from .distributed.xdit_context_parallel import (
+                    usp_attn_forward, usp_dit_forward)
+                for block in model.blocks:
+                    block.self_attn.forward = types.MethodType(
+                        usp_attn_forward, block.self_attn)
+                model.forward = types.MethodType(usp_dit_forward, model)
+
+            if dist.is_initialized():
+                dist.barrier()
+            if dit_fsdp:
+                model = shard_fn(model)
+            elif offload_blocks is not None:
+                model.block_offloader = BlockOffloader(
+                    model, self.device, window=offload_blocks)
+            else:
+                model.to(self.device)
+            return model
+
+        try:
+            components, self.load_timings = load_in_parallel(loaders)
+            if t5_socket is not None:
+                self.text_encoder = components['text_encoder']
+                self.t5_key = None
+            else:
+                self.text_encoder = self.registry.prepare(self.t5_key,
+                                                          prepare_text_encoder)
+            self.vae = components['vae']
+            self.model = self.registry.prepare(self.model_key, prepare_model)
+            self.block_offloader = getattr(self.model, 'block_offloader', None)
+
+            self.sample_neg_prompt = config.sample_neg_prompt
+
+            # the default negative prompt is served from the embedding cache, T5
+            # only visits the GPU when it is missing
+            if self.t5_cpu:
+                self.text_encoder([self.sample_neg_prompt], torch.device('cpu'))
+            elif not self.text_encoder.cached([self.sample_neg_prompt]):
+                self.text_encoder.model.to(self.device)
+                self.text_encoder([self.sample_neg_prompt], self.device)
+                self.text_encoder.model.cpu()
+        except BaseException:
+            # return the shared components acquired so far, a daemon
+            # would keep them loaded otherwise
+            for key in acquired:
+                self.registry.release(key)
+            raise
+
+    def release(self, evict=False):
+        r"""
+        Releases the shared components acquired by this pipeline, which must not be
+        used afterwards.
+
+        Args:
+            evict (`bool`, *optional*, defaults to False):
+                Free components that no other pipeline references. Otherwise they stay
+                cached in the registry for the next pipeline.
+        """
+        for key in (self.t5_key, self.vae_key, self.model_key):
+            if key is not None:
+                self.registry.release(key, evict=evict)
+        if self.t5_key is None:
+            self.text_encoder.close()
+        for name in ('text_encoder', 'vae', 'model'):
+            setattr(self, name, None)
+        self.block_offloader = None
+
+    def encode_prompts(self, input_prompt, n_prompt="", offload_model=True):
+        r"""
+        Encodes a prompt and its negative prompt in one T5 call. Safe to run on
+        another thread than `generate` with t5_cpu.
+
+        Args:
+            input_prompt (`str`):
+                Text prompt for content generation
+            n_prompt (`str`, *optional*, defaults to ""):
+                Negative prompt for content exclusion. If not given, use `config.sample_neg_prompt`
+            offload_model (`bool`, *optional*, defaults to True):
+                If True, moves T5 back to CPU afterwards
+
+        Returns:
+            tuple[list[torch.Tensor], list[torch.Tensor]]:
+                Contexts of the prompt and the negative prompt. They stay on the CPU
+                with t5_cpu, `generate` moves them to the GPU.
+        """
+        if n_prompt == "":
+            n_prompt = self.sample_neg_prompt
+        context, context_null = self._encode_texts([input_prompt, n_prompt],
+                                                   offload_model)
+        return [context], [context_null]
+
+    def _encode_texts(self, texts, offload_model=True):
+        # one T5 call, the embeddings stay on the CPU with t5_cpu
+        with torch.no_grad():
+            if self.t5_cpu:
+                return self.text_encoder(texts, torch.device('cpu'))
+            self.text_encoder.model.to(self.device)
+            context = self.text_encoder(texts, self.device)
+            if offload_model:
+                self.text_encoder.model.cpu()
+        return context
+
+    def _latent_shape(self, size, frame_num):
+        target_shape = (self.vae.model.z_dim,
+                        (frame_num - 1) // self.vae_stride[0] + 1,
+                        size[1] // self.vae_stride[1],
+                        size[0] // self.vae_stride[2])
+        seq_len = math.ceil((target_shape[2] * target_shape[3]) /
+                            (self.patch_size[1] * self.patch_size[2]) *
+                            target_shape[1] / self.sp_size) * self.sp_size
+        return target_shape, seq_len
+
+    def _noise(self, target_shape, seed):
+        seed = seed if seed >= 0 else random.randint(0, sys.maxsize)
+        seed_g = torch.Generator(device=self.device)
+        seed_g.manual_seed(seed)
+        noise = torch.randn(
+            *target_shape,
+            dtype=torch.float32,
+            device=self.device,
+            generator=seed_g)
+        return noise, seed_g
+
+    def _denoise(self,
+                 noise,
+                 context,
+                 context_null,
+                 seq_len,
+                 sample_solver,
+                 sampling_steps,
+                 shift,
+                 guide_scale,
+                 step_callback=None,
+                 generator=None,
+                 batch_guidance=False):
+        r"""
+        Runs the sampling loop on noise of shape [B, C, T, H, W], with one
+        context and negative context per sample, and returns the list of
+        denoised latents. With `batch_guidance`, the conditional and
+        unconditional predictions run as one DiT forward of 2B samples, else
+        as two forwards of B samples.
+        """
+        sample_scheduler, timesteps = self._sample_scheduler(
+            sample_solver, sampling_steps, shift)
+        latents = noise
+        for i, t in enumerate(tqdm(timesteps)):
+            x = list(latents.unbind(0))
+
+            if self.block_offloader is None:
+                self.model.to(self.device)
+            if batch_guidance:
+                noise_pred = torch.stack(
+                    self.model(
+                        x * 2,
+                        t=t.expand(2 * len(x)),
+                        context=context + context_null,
+                        seq_len=seq_len))
+                noise_pred_cond, noise_pred_uncond = noise_pred.chunk(2)
+            else:
+                timestep = t.expand(len(x))
+                noise_pred_cond = torch.stack(
+                    self.model(
+                        x, t=timestep, context=context, seq_len=seq_len))
+                noise_pred_uncond = torch.stack(
+                    self.model(
+                        x, t=timestep, context=context_null,
+                        seq_len=seq_len))
+
+            noise_pred = noise_pred_uncond + guide_scale * (
+                noise_pred_cond - noise_pred_uncond)
+            if step_callback is not None and self.rank == 0:
+                denoised = latents - t / self.num_train_timesteps * noise_pred
+                step_callback(i, len(timesteps), list(denoised.unbind(0)))
+
+            latents = sample_scheduler.step(
+                noise_pred, t, latents, return_dict=False,
+                generator=generator)[0]
+        return list(latents.unbind(0))
+
+    def _sample_scheduler(self, sample_solver, sampling_steps, shift):
+        if sample_solver == 'unipc':
+            sample_scheduler = FlowUniPCMultistepScheduler(
+                num_train_timesteps=self.num_train_timesteps,
+                shift=1,
+                use_dynamic_shifting=False)
+            sample_scheduler.set_timesteps(
+                sampling_steps, device=self.device, shift=shift)
+            timesteps = sample_scheduler.timesteps
+        elif sample_solver == 'dpm++':
+            sample_scheduler = FlowDPMSolverMultistepScheduler(
+                num_train_timesteps=self.num_train_timesteps,
+                shift=1,
+                use_dynamic_shifting=False)
+            sampling_sigmas = get_sampling_sigmas(sampling_steps, shift)
+            timesteps, _ = retrieve_timesteps(
+                sample_scheduler, device=self.device, sigmas=sampling_sigmas)
+        else:
+            raise NotImplementedError("Unsupported solver.")
+        return sample_scheduler, timesteps
+
+    def generate_images(self,
+                        input_prompts,
+                        size=(1280, 720),
+                        shift=5.0,
+                        sample_solver='unipc',
+                        sampling_steps=50,
+                        guide_scale=5.0,
+                        n_prompt="",
+                        seed=-1,
+                        offload_model=True,
+                        decode=True,
+                        step_callback=None):
+        r"""
+        Generates one image per text prompt, sampling all of them and their
+        negative prompts in a single DiT forward per step.
+
+        Args:
+            input_prompts (`list[str]`):
+                Text prompts, one per image
+            size (tupele[`int`], *optional*, defaults to (1280,720)):
+                Controls image resolution, (width,height).
+            shift, sample_solver, sampling_steps, guide_scale, n_prompt, offload_model:
+                As in `generate`, shared by all images
+            seed (`int` or `list[int]`, *optional*, defaults to -1):
+                Random seed of every image, or of the first image in which case the
+                i-th image uses seed + i. An image matches `generate` with
+                `frame_num=1` and its seed. If -1, use random seed.
+            decode (`bool`, *optional*, defaults to True):
+                If False, returns the latents (C, 1, H / 8, W / 8) instead of the
+                images
+            step_callback (`callable`, *optional*, defaults to None):
+                As in `generate`, with the denoised latents of all images
+
+        Returns:
+            list[torch.Tensor]:
+                Generated images of shape (C, H, W) in [-1, 1] on rank 0, None on
+                the other ranks
+        """
+        # preprocess
+        target_shape, seq_len = self._latent_shape(size, 1)
+        num_images = len(input_prompts)
+
+        if isinstance(seed, int):
+            seed = seed if seed >= 0 else random.randint(
+                0, sys.maxsize - num_images)
+            seed = [seed + i for i in range(num_images)]
+        noise = torch.stack([self._noise(target_shape, u)[0] for u in seed])
+
+        # one T5 call for all prompts and the shared negative prompt
+        if n_prompt == "":
+            n_prompt = self.sample_neg_prompt
+        texts = self._encode_texts(
+            list(input_prompts) + [n_prompt], offload_model)
+        context = [u.to(self.device) for u in texts[:-1]]
+        context_null = [texts[-1].to(self.device)] * num_images
+
+        @contextmanager
+        def noop_no_sync():
+            yield
+
+        no_sync = getattr(self.model, 'no_sync', noop_no_sync)
 
+        # evaluation mode
+        with amp.autocast(dtype=self.param_dtype), torch.no_grad(), no_sync():
+            # conditional and unconditional predictions of all images in one
+            # batch, the scheduler steps all images at once
+            x0 = self._denoise(
+                noise,
+                context,
+                context_null,
+                seq_len,
+                sample_solver,
+                sampling_steps,
+                shift,
+                guide_scale,
+                step_callback=step_callback,
+                batch_guidance=True)
+
+            if offload_model and self.block_offloader is None:
+                self.model.cpu()
+                torch.cuda.empty_cache()
+            if self.rank == 0:
+                images = [u.squeeze(1) for u in self.vae.decode(x0)
+                         ] if decode else x0
+
+        del noise
+        if offload_model:
+            gc.collect()
+            torch.cuda.synchronize()
         if dist.is_initialized():
             dist.barrier()
-        if dit_fsdp:
-            self.model = shard_fn(self.model)
-        else:
-            self.model.to(self.device)
 
-        self.sample_neg_prompt = config.sample_neg_prompt
+        return images if self.rank == 0 else None
 
     def generate(self,
                  input_prompt,
@@ -117,7 +475,10 @@ class WanT2V:
                  guide_scale=5.0,
                  n_prompt="",
                  seed=-1,
-                 offload_model=True):
+                 offload_model=True,
+                 context=None,
+                 decode=True,
+                 step_callback=None):
         r"""
         Generates video frames from text prompt using diffusion process.
 
@@ -141,7 +502,18 @@ class WanT2V:
             seed (`int`, *optional*, defaults to -1):
                 Random seed for noise generation. If -1, use random seed.
             offload_model (`bool`, *optional*, defaults to True):
-                If True, offloads models to CPU during generation to save VRAM
+                If True, offloads models to CPU during generation to save VRAM. The DiT is
+                left in place when block offloading is enabled
+            context (`tuple`, *optional*, defaults to None):
+                Output of `encode_prompts` for `input_prompt` and `n_prompt`, e.g. from a
+                separate text-encoding stage. Skips text encoding if given
+            decode (`bool`, *optional*, defaults to True):
+                If False, returns the latents (C, T, H / 8, W / 8) instead of the
+                decoded frames, e.g. to decode them with `WanVAE.decode_stream`
+            step_callback (`callable`, *optional*, defaults to None):
+                Called on rank 0 as `step_callback(step, num_steps, x0)` before every
+                scheduler step, with `x0` the list of denoised latents predicted at
+                that step, e.g. a `PreviewWriter`
 
         Returns:
             torch.Tensor:
@@ -152,43 +524,13 @@ class WanT2V:
                 - W: Frame width from size)
         """
         # preprocess
-        F = frame_num
-        target_shape = (self.vae.model.z_dim, (F - 1) // self.vae_stride[0] + 1,
-                        size[1] // self.vae_stride[1],
-                        size[0] // self.vae_stride[2])
+        target_shape, seq_len = self._latent_shape(size, frame_num)
+        noise, seed_g = self._noise(target_shape, seed)
 
-        seq_len = math.ceil((target_shape[2] * target_shape[3]) /
-                            (self.patch_size[1] * self.patch_size[2]) *
-                            target_shape[1] / self.sp_size) * self.sp_size
-
-        if n_prompt == "":
-            n_prompt = self.sample_neg_prompt
-        seed = seed if seed >= 0 else random.randint(0, sys.maxsize)
-        seed_g = torch.Generator(device=self.device)
-        seed_g.manual_seed(seed)
-
-        if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
-            if offload_model:
-                self.text_encoder.model.cpu()
-        else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
-            context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
-
-        noise = [
-            torch.randn(
-                target_shape[0],
-                target_shape[1],
-                target_shape[2],
-                target_shape[3],
-                dtype=torch.float32,
-                device=self.device,
-                generator=seed_g)
-        ]
+        if context is None:
+            context = self.encode_prompts(input_prompt, n_prompt, offload_model)
+        context, context_null = [[t.to(self.device) for t in u]
+                                 for u in context]
 
         @contextmanager
         def noop_no_sync():
@@ -198,66 +540,26 @@ class WanT2V:
 
         # evaluation mode
         with amp.autocast(dtype=self.param_dtype), torch.no_grad(), no_sync():
-
-            if sample_solver == 'unipc':
-                sample_scheduler = FlowUniPCMultistepScheduler(
-                    num_train_timesteps=self.num_train_timesteps,
-                    shift=1,
-                    use_dynamic_shifting=False)
-                sample_scheduler.set_timesteps(
-                    sampling_steps, device=self.device, shift=shift)
-                timesteps = sample_scheduler.timesteps
-            elif sample_solver == 'dpm++':
-                sample_scheduler = FlowDPMSolverMultistepScheduler(
-                    num_train_timesteps=self.num_train_timesteps,
-                    shift=1,
-                    use_dynamic_shifting=False)
-                sampling_sigmas = get_sampling_sigmas(sampling_steps, shift)
-                timesteps, _ = retrieve_timesteps(
-                    sample_scheduler,
-                    device=self.device,
-                    sigmas=sampling_sigmas)
-            else:
-                raise NotImplementedError("Unsupported solver.")
-
             # sample videos
-            latents = noise
-
-            arg_c = {'context': context, 'seq_len': seq_len}
-            arg_null = {'context': context_null, 'seq_len': seq_len}
-
-            for _, t in enumerate(tqdm(timesteps)):
-                latent_model_input = latents
-                timestep = [t]
-
-                timestep = torch.stack(timestep)
+            x0 = self._denoise(
+                noise[None],
+                context,
+                context_null,
+                seq_len,
+                sample_solver,
+                sampling_steps,
+                shift,
+                guide_scale,
+                step_callback=step_callback,
+                generator=seed_g)
 
-                self.model.to(self.device)
-                noise_pred_cond = self.model(
-                    latent_model_input, t=timestep, **arg_c)[0]
-                noise_pred_uncond = self.model(
-                    latent_model_input, t=timestep, **arg_null)[0]
-
-                noise_pred = noise_pred_uncond + guide_scale * (
-                    noise_pred_cond - noise_pred_uncond)
-
-                temp_x0 = sample_scheduler.step(
-                    noise_pred.unsqueeze(0),
-                    t,
-                    latents[0].unsqueeze(0),
-                    return_dict=False,
-                    generator=seed_g)[0]
-                latents = [temp_x0.squeeze(0)]
-
-            x0 = latents
-            if offload_model:
+            if offload_model and self.block_offloader is None:
                 self.model.cpu()
                 torch.cuda.empty_cache()
             if self.rank == 0:
-                videos = self.vae.decode(x0)
+                videos = self.vae.decode(x0) if decode else x0
 
-        del noise, latents
-        del sample_scheduler
+        del noise
         if offload_model:
             gc.collect()
             torch.cuda.synchronize()
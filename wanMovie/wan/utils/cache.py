@@ -0,0 +1,104 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+__all__ = ['TensorCache', 'cache_key']
+
+
+def cache_key(*parts):
+    r"""
+    Returns a stable hex digest of JSON serializable parts.
+    """
+    data = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class TensorCache:
+
+    def __init__(self, max_items=256, cache_dir=None):
+        r"""
+        Thread-safe LRU cache of named tensors with an optional on-disk store.
+
+        Entries are dicts of tensors kept on the CPU. With `cache_dir`, every entry
+        is also written to `<cache_dir>/<key>.safetensors` and entries evicted from
+        memory (or written by another process) are read back from there.
+
+        Args:
+            max_items (`int`, *optional*, defaults to 256):
+                Number of entries kept in memory. 0 disables the in-memory cache
+            cache_dir (`str`, *optional*, defaults to None):
+                Directory of the on-disk store. None disables it
+        """
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.safetensors')
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            from safetensors.torch import load_file
+            try:
+                tensors = load_file(self._path(key))
+            except Exception as e:
+                logging.warning(f'Ignoring unreadable cache entry {key}: {e}')
+            else:
+                self._remember(key, tensors)
+                with self.lock:
+                    self.hits += 1
+                return tensors
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, tensors):
+        tensors = {
+            k: v.detach().to('cpu').contiguous() for k, v in tensors.items()
+        }
+        self._remember(key, tensors)
+        if self.cache_dir is not None:
+            from safetensors.torch import save_file
+
+            # write atomically so that concurrent readers never see partial files
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            os.close(fd)
+            try:
+                save_file(tensors, tmp)
+                os.replace(tmp, self._path(key))
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        return tensors
+
+    def _remember(self, key, tensors):
+        if self.max_items <= 0:
+            return
+        with self.lock:
+            self.entries[key] = tensors
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
@@ -0,0 +1,247 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import collections
+import itertools
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+__all__ = ['GenerationDaemon']
+
+
+class _Job:
+
+    def __init__(self, job_id, request, prepared=None):
+        self.job_id = job_id
+        self.request = request
+        self.prepared = prepared
+        self.events = queue.Queue()
+
+    def emit(self, status, **kwargs):
+        self.events.put(dict(job_id=self.job_id, status=status, **kwargs))
+
+
+class GenerationDaemon:
+
+    def __init__(self,
+                 run_fn,
+                 queue_size=8,
+                 prepare_fn=None,
+                 batch_fn=None,
+                 batch_key_fn=None,
+                 max_batch=1):
+        r"""
+        Runs generation jobs one at a time, or in batches of compatible jobs, on a
+        worker thread that keeps the models resident, and serves them over a local
+        HTTP or Unix-socket API.
+
+        `POST /generate` takes a JSON job and streams newline-delimited JSON events
+        back: `queued`, `running`, then `done` with the output path or `error`.
+        `GET /health` reports the queue state. Jobs are rejected with status 503
+        while `queue_size` jobs are waiting.
+
+        Args:
+            run_fn (`callable`):
+                Called as `run_fn(request, emit, prepared)` on the worker thread for
+                every job. Returns a dict of results, e.g. the output path, added to
+                the `done` event. `emit(status, **kwargs)` sends intermediate events
+            queue_size (`int`, *optional*, defaults to 8):
+                Maximum number of waiting jobs
+            prepare_fn (`callable`, *optional*, defaults to None):
+                Called as `prepare_fn(request)` when a job is queued, to start work
+                that overlaps with the running job. Its result is passed to `run_fn`
+                as `prepared` and cancelled if it is a future of a rejected job
+            batch_fn (`callable`, *optional*, defaults to None):
+                Called as `batch_fn(requests, emits, prepared)` instead of `run_fn` for
+                consecutive queued jobs with the same batch key, returns one result
+                dict per job
+            batch_key_fn (`callable`, *optional*, defaults to None):
+                Called as `batch_key_fn(request)`, returns a hashable key of the jobs
+                that can run together or None if the job runs alone
+            max_batch (`int`, *optional*, defaults to 1):
+                Maximum number of jobs passed to `batch_fn`
+        """
+        self.run_fn = run_fn
+        self.prepare_fn = prepare_fn
+        self.batch_fn = batch_fn
+        self.batch_key_fn = batch_key_fn
+        self.max_batch = max_batch
+        self.jobs = queue.Queue(maxsize=queue_size)
+        # a job taken from the queue that did not fit the previous batch
+        self.deferred = collections.deque()
+        self.ids = itertools.count()
+        self.running = None
+        self.worker = threading.Thread(
+            target=self._work, name='wan_daemon_worker', daemon=True)
+        self.worker.start()
+
+    def submit(self, request):
+        r"""
+        Queues a job and returns it, or None if the queue is full.
+        """
+        job = _Job(next(self.ids), request)
+        if self.prepare_fn is not None:
+            try:
+                job.prepared = self.prepare_fn(request)
+            except Exception:
+                logging.warning(f'Could not prepare job {job.job_id}:\n' +
+                                traceback.format_exc())
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            if hasattr(job.prepared, 'cancel'):
+                job.prepared.cancel()
+            return None
+        job.emit('queued', position=self.jobs.qsize())
+        return job
+
+    def _batch_key(self, job):
+        if self.batch_fn is None or self.max_batch <= 1:
+            return None
+        try:
+            return self.batch_key_fn(job.request)
+        except Exception:
+            return None
+
+    def _next_jobs(self):
+        # jobs are taken in order, a batch ends at the first job that differs
+        job = self.deferred.popleft() if self.deferred else self.jobs.get()
+        jobs, key = [job], self._batch_key(job)
+        while key is not None and len(jobs) < self.max_batch:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if self._batch_key(job) != key:
+                self.deferred.append(job)
+                break
+            jobs.append(job)
+        return jobs
+
+    def _work(self):
+        while True:
+            jobs = self._next_jobs()
+            self.running = jobs[0].job_id
+            for job in jobs:
+                job.emit('running', batch_size=len(jobs))
+            start = time.perf_counter()
+            try:
+                if len(jobs) > 1:
+                    results = self.batch_fn([job.request for job in jobs],
+                                            [job.emit for job in jobs],
+                                            [job.prepared for job in jobs])
+                else:
+                    results = [
+                        self.run_fn(jobs[0].request, jobs[0].emit,
+                                    jobs[0].prepared)
+                    ]
+                for job, result in zip(jobs, results):
+                    job.emit(
+                        'done',
+                        elapsed=time.perf_counter() - start,
+                        **(result or {}))
+            except (Exception, SystemExit) as e:
+                # a failing job must not stop the worker, jobs queued after it
+                # would never run
+                logging.error(f'Job {jobs[0].job_id} failed:\n' +
+                              traceback.format_exc())
+                for job in jobs:
+                    job.emit('error', message=f'{type(e).__name__}: {e}')
+            finally:
+                self.running = None
+                for job in jobs:
+                    job.events.put(None)
+
+    def _handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def address_string(self):
+                # Unix sockets have no peer address
+                return str(self.client_address or 'unix')
+
+            def log_message(self, format, *args):
+                logging.info(f'{self.address_string()} {format % args}')
+
+            def _send(self, code, body):
+                data = (json.dumps(body) + '\n').encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path != '/health':
+                    return self._send(404, dict(status='not_found'))
+                self._send(
+                    200,
+                    dict(
+                        status='ok',
+                        queued=daemon.jobs.qsize() + len(daemon.deferred),
+                        running=daemon.running))
+
+            def do_POST(self):
+                if self.path != '/generate':
+                    return self._send(404, dict(status='not_found'))
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    request = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError as e:
+                    return self._send(
+                        400, dict(status='error', message=str(e)))
+                job = daemon.submit(request)
+                if job is None:
+                    return self._send(
+                        503, dict(status='rejected', message='queue is full'))
+
+                # stream the events until the job finishes, the connection
+                # is closed afterwards
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                while (event := job.events.get()) is not None:
+                    try:
+                        self.wfile.write((json.dumps(event) + '\n').encode())
+                        self.wfile.flush()
+                    except OSError:
+                        # the client left, the job still runs to completion
+                        logging.info(
+                            f'Client of job {job.job_id} disconnected.')
+                        break
+
+        return Handler
+
+    def serve_http(self, host='127.0.0.1', port=8088):
+        server = ThreadingHTTPServer((host, port), self._handler())
+        logging.info(f'Serving generation jobs on http://{host}:{port}')
+        self._serve(server)
+
+    def serve_unix(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        server = _ThreadingUnixHTTPServer(path, self._handler())
+        logging.info(f'Serving generation jobs on unix socket {path}')
+        try:
+            self._serve(server)
+        finally:
+            os.remove(path)
+
+    def _serve(self, server):
+        with server:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                logging.info('Shutting down.')
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
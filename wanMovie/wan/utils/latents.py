@@ -0,0 +1,64 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import json
+import os
+
+import torch
+
+__all__ = ['save_latents', 'load_latents', 'LATENT_DTYPES']
+
+LATENT_DTYPES = {'fp16': torch.float16, 'bf16': torch.bfloat16}
+
+# marks the safetensors files written by save_latents
+_FORMAT = 'wan-latents'
+
+
+def save_latents(path, latent, metadata=None, dtype=torch.float16):
+    r"""
+    Writes a latent of shape [C, T, H, W] to a safetensors file, together with
+    JSON serializable metadata describing how to decode it.
+
+    The file is written atomically, a worker polling the directory never reads a
+    partial file. The temporary file does not end in `.safetensors`.
+
+    Args:
+        path (`str`):
+            Output path
+        latent (`torch.Tensor`):
+            Normalized latent as returned by the pipelines with `decode=False`
+        metadata (`dict`, *optional*, defaults to None):
+            E.g. the task, frame rate and output path of the decoded video
+        dtype (`torch.dtype`, *optional*, defaults to torch.float16):
+            Storage dtype. The normalized latents have unit scale, fp16 keeps
+            more precision than bf16 for the same size
+    """
+    from safetensors.torch import save_file
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        save_file(
+            {'latent': latent.detach().to('cpu', dtype).contiguous()},
+            tmp,
+            metadata={
+                'format': _FORMAT,
+                'metadata': json.dumps(metadata or {}, ensure_ascii=False)
+            })
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+
+def load_latents(path, device='cpu'):
+    r"""
+    Reads a file written by `save_latents`.
+
+    Returns:
+        tuple[torch.Tensor, dict]: The float32 latent and its metadata.
+    """
+    from safetensors import safe_open
+    with safe_open(path, framework='pt', device=str(device)) as f:
+        header = f.metadata() or {}
+        assert header.get('format') == _FORMAT, \
+            f'{path} was not written by save_latents.'
+        latent = f.get_tensor('latent').float()
+    return latent, json.loads(header['metadata'])
@@ -0,0 +1,142 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+__all__ = ['BlockOffloader']
+
+
+class BlockOffloader:
+
+    def __init__(self, model, device, window=2, pin_memory=True):
+        r"""
+        Streams the transformer blocks of a model between host and device memory.
+
+        Only `window` blocks are resident on the device at any time. While block
+        `i` computes, the weights of blocks `i + 1 ... i + window - 1` are copied
+        to the device on a side stream by a background thread, and block `i` is
+        released as soon as its forward returns. All modules outside of
+        `model.blocks` (embeddings, head, ...) stay resident.
+
+        Args:
+            model (`nn.Module`):
+                Model exposing its transformer blocks as `model.blocks`
+            device (`torch.device`):
+                Target device of the computation
+            window (`int`, *optional*, defaults to 2):
+                Number of blocks kept resident on the device. 1 disables prefetching
+            pin_memory (`bool`, *optional*, defaults to True):
+                Keep the host copies in pinned memory so that copies overlap compute
+        """
+        assert window >= 1
+        self.device = torch.device(device)
+        self.blocks = list(model.blocks)
+        self.window = min(window, len(self.blocks))
+        self.pin_memory = pin_memory and self.device.type == 'cuda'
+
+        # non-block modules stay on device
+        for name, child in model.named_children():
+            if name != 'blocks':
+                child.to(self.device)
+        for name, buf in model.named_buffers(recurse=False):
+            setattr(model, name, buf.to(self.device))
+
+        # the whole window fits, no streaming needed
+        if self.window == len(self.blocks):
+            model.blocks.to(self.device)
+            self.tensors = None
+            return
+
+        # host copies
+        self.tensors = []
+        for block in self.blocks:
+            tensors = list(block.parameters()) + list(block.buffers())
+            for t in tensors:
+                t.data = t.data.cpu()
+                if self.pin_memory:
+                    t.data = t.data.pin_memory()
+            self.tensors.append([(t, t.data) for t in tensors])
+
+        self.stream = torch.cuda.Stream(
+            device=self.device) if self.device.type == 'cuda' else None
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='wan_block_offload')
+        self.pending = {}
+        self.resident = set()
+
+        self.handles = []
+        for i, block in enumerate(self.blocks):
+            self.handles.append(
+                block.register_forward_pre_hook(
+                    lambda module, args, i=i: self._pre_forward(i)))
+            self.handles.append(
+                block.register_forward_hook(
+                    lambda module, args, output, i=i: self._post_forward(i)))
+        logging.info(
+            f'Streaming {len(self.blocks)} blocks with {self.window} resident on {self.device}.'
+        )
+
+    def _load(self, i):
+        if self.stream is None:
+            for t, host in self.tensors[i]:
+                t.data = host.to(self.device)
+            return None
+        with torch.cuda.stream(self.stream):
+            for t, host in self.tensors[i]:
+                t.data = host.to(self.device, non_blocking=True)
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        return event
+
+    def _prefetch(self, i):
+        if i in self.resident or i in self.pending:
+            return
+        self.pending[i] = self.executor.submit(self._load, i)
+
+    def _pre_forward(self, i):
+        if i not in self.resident:
+            self._prefetch(i)
+            event = self.pending.pop(i).result()
+            if event is not None:
+                stream = torch.cuda.current_stream(self.device)
+                stream.wait_event(event)
+                # memory was allocated on the side stream
+                for t, _ in self.tensors[i]:
+                    t.data.record_stream(stream)
+            self.resident.add(i)
+
+        # prefetch the next blocks, wrapping around to the next forward pass
+        for j in range(1, self.window):
+            self._prefetch((i + j) % len(self.blocks))
+
+    def _post_forward(self, i):
+        for t, host in self.tensors[i]:
+            t.data = host
+        self.resident.discard(i)
+
+    def evict(self):
+        r"""
+        Waits for in-flight copies and points every block back at its host
+        tensors. Call it before changing the weights in place, e.g. to merge a
+        LoRA adapter, the next forward then copies the changed weights again.
+        """
+        if self.tensors is None:
+            return
+        for i, future in list(self.pending.items()):
+            future.result()
+            self._post_forward(i)
+        self.pending.clear()
+        for i in list(self.resident):
+            self._post_forward(i)
+
+    def remove(self):
+        r"""
+        Removes the hooks and waits for in-flight copies. Blocks are left on the host.
+        """
+        if self.tensors is None:
+            return
+        self.evict()
+        for handle in self.handles:
+            handle.remove()
+        self.executor.shutdown()
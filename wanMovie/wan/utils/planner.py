@@ -0,0 +1,327 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import itertools
+import math
+
+from easydict import EasyDict
+
+__all__ = ['estimate_plan', 'plan_execution', 'format_plan']
+
+GB = 1024**3
+
+# text encoders, see `umt5_xxl` and `clip_xlm_roberta_vit_h_14`
+T5_CONFIGS = {
+    'umt5_xxl': dict(vocab_size=256384, dim=4096, dim_ffn=10240, num_layers=24)
+}
+CLIP_CONFIG = dict(vision_dim=1280, vision_layers=32, mlp_ratio=4)
+
+# Wan2.1 VAE, see `_video_vae`
+VAE_PARAMS = 127e6
+# (input channels, spatial scale, temporal scale) of every cached causal conv
+# in the decoder, the encoder mirrors it
+VAE_CONV_LAYERS = [(16, 1, 1)] + [(384, 1, 1)] * 11 + [(192, 2, 2)] + \
+    [(384, 2, 2)] * 6 + [(192, 4, 4)] * 6 + [(96, 8, 4)] * 7
+
+# candidates explored by the planner
+BLOCK_WINDOWS = (8, 4, 2)
+CHUNK_SIZES = (None, 16384, 8192, 4096)
+VAE_TILE_SIZES = (None, 512, 384, 256)
+VAE_TILE_OVERLAP = 64
+
+
+def _t5_params(name):
+    cfg = T5_CONFIGS[name]
+    block = 4 * cfg['dim']**2 + 3 * cfg['dim'] * cfg['dim_ffn']
+    return cfg['vocab_size'] * cfg['dim'] + cfg['num_layers'] * block
+
+
+def _clip_params():
+    # I2V loads the vision tower without its last block
+    c = CLIP_CONFIG
+    return (c['vision_layers'] - 1) * (4 + 2 * c['mlp_ratio']) * c['vision_dim']**2
+
+
+def _dit_params(config, i2v):
+    d, f = config.dim, config.ffn_dim
+    patch = math.prod(config.patch_size)
+    attn = 4 * (d * d + d) + 2 * d
+    block = 2 * attn + 2 * d + 2 * d * f + f + d + 6 * d
+    if i2v:
+        block += 2 * (d * d + d) + d
+    non_block = (36 if i2v else 16) * patch * d + 4096 * d + d * d + \
+        config.freq_dim * d + d * d + 6 * d * d + 16 * patch * d
+    if i2v:
+        non_block += 1280 * 1280 + 1280 * d
+    return block, non_block
+
+
+def _vae_memory(h, w, frames, tile_size, chunk_size=1):
+    r"""
+    Peak bytes of the causal VAE for a latent of [frames, h, w] in float32,
+    processed `chunk_size` latent frames at a time.
+    """
+    if tile_size is not None:
+        tile = (tile_size + VAE_TILE_OVERLAP) // 8
+        h, w = min(h, tile), min(w, tile)
+    cache = sum(c * 2 * h * w * s * s * 4 for c, s, _ in VAE_CONV_LAYERS)
+    chunk = max(c * t * chunk_size * h * w * s * s * 4 * 4
+                for c, s, t in VAE_CONV_LAYERS)
+    return VAE_PARAMS * 4 + cache + chunk
+
+
+def _vae_flops(h, w, frames, tile_size):
+    flops = sum(2 * 27 * c * c * h * w * s * s * (t * (frames - 1) + 1)
+                for c, s, t in VAE_CONV_LAYERS)
+    if tile_size is not None:
+        flops *= (1 + VAE_TILE_OVERLAP / tile_size)**2
+    return flops
+
+
+def estimate_plan(config,
+                  size,
+                  frame_num,
+                  offload_model=False,
+                  offload_blocks=None,
+                  t5_cpu=False,
+                  attn_chunk_size=None,
+                  ffn_chunk_size=None,
+                  vae_tile_size=None,
+                  vae_chunk_size=1,
+                  dit_shards=1,
+                  t5_shards=1,
+                  sp_size=1,
+                  sampling_steps=50,
+                  tflops=300.,
+                  cpu_tflops=2.,
+                  mfu=0.4,
+                  h2d_bandwidth=20.):
+    r"""
+    Estimates the peak memory and run time of every stage of a generation.
+
+    Args:
+        config (EasyDict):
+            Model config from `wan.configs.WAN_CONFIGS`
+        size (tupele[`int`]):
+            Output resolution, (width, height)
+        frame_num (`int`):
+            Number of frames, 4n+1
+        offload_model (`bool`, *optional*, defaults to False):
+            Whether the text encoders and the DiT are moved to CPU between stages
+        offload_blocks (`int`, *optional*, defaults to None):
+            Number of resident DiT blocks when streaming the DiT from CPU
+        t5_cpu (`bool`, *optional*, defaults to False):
+            Whether T5 runs on CPU
+        attn_chunk_size (`int`, *optional*, defaults to None):
+            Query chunk size of the DiT attention layers
+        ffn_chunk_size (`int`, *optional*, defaults to None):
+            Token chunk size of the DiT feed-forward layers
+        vae_tile_size (`int`, *optional*, defaults to None):
+            Spatial tile size in pixels of the VAE
+        vae_chunk_size (`int`, *optional*, defaults to 1):
+            Number of latent frames per VAE decoder call
+        dit_shards (`int`, *optional*, defaults to 1):
+            Number of ranks the DiT is sharded across with FSDP, which excludes
+            offload_blocks
+        t5_shards (`int`, *optional*, defaults to 1):
+            Number of ranks T5 is sharded across with FSDP, which excludes t5_cpu
+        sp_size (`int`, *optional*, defaults to 1):
+            Sequence parallel degree, each rank holds 1 / sp_size of the tokens
+        sampling_steps (`int`, *optional*, defaults to 50):
+            Number of diffusion sampling steps
+        tflops (`float`, *optional*, defaults to 300.):
+            Peak dense bf16 throughput of the GPU
+        cpu_tflops (`float`, *optional*, defaults to 2.):
+            Throughput of the CPU for T5 inference
+        mfu (`float`, *optional*, defaults to 0.4):
+            Fraction of the peak throughput achieved in practice
+        h2d_bandwidth (`float`, *optional*, defaults to 20.):
+            Host to device copy bandwidth in GB/s
+
+    Returns:
+        EasyDict:
+            The plan, with `memory` and `time` holding the per-stage estimates in
+            bytes and seconds of one rank, and `peak_memory` / `total_time` their
+            aggregates.
+    """
+    assert dit_shards == 1 or offload_blocks is None, \
+        'offload_blocks does not work with a sharded DiT.'
+    assert t5_shards == 1 or not t5_cpu, 't5_cpu does not work with a sharded T5.'
+    i2v = 'clip_model' in config
+    bytes_per_param = 2
+    w, h = size[0] // config.vae_stride[2], size[1] // config.vae_stride[1]
+    t = (frame_num - 1) // config.vae_stride[0] + 1
+    seq_len = t * h * w // (config.patch_size[1] * config.patch_size[2])
+    context_len = config.text_len + (257 if i2v else 0)
+
+    # weights
+    block, non_block = _dit_params(config, i2v)
+    dit_bytes = (block * config.num_layers + non_block) * bytes_per_param
+    if dit_shards > 1:
+        # FSDP gathers one block at a time
+        dit_bytes = dit_bytes / dit_shards + block * bytes_per_param
+    if offload_blocks is not None:
+        dit_resident = (block * min(offload_blocks, config.num_layers) +
+                        non_block) * bytes_per_param
+    else:
+        dit_resident = dit_bytes
+    t5_params = _t5_params(config.t5_model)
+    t5_bytes = t5_params * bytes_per_param
+    if t5_shards > 1:
+        t5_cfg = T5_CONFIGS[config.t5_model]
+        t5_bytes = t5_bytes / t5_shards + (
+            4 * t5_cfg['dim']**2 +
+            3 * t5_cfg['dim'] * t5_cfg['dim_ffn']) * bytes_per_param
+    t5_gpu = 0 if t5_cpu else t5_bytes
+    clip_bytes = _clip_params() * 2 if i2v else 0
+    vae_bytes = VAE_PARAMS * 4
+
+    # activations, of the tokens held by one rank
+    d, f = config.dim, config.ffn_dim
+    tokens = math.ceil(seq_len / sp_size)
+    attn_chunk = min(attn_chunk_size or tokens, tokens)
+    ffn_chunk = min(ffn_chunk_size or tokens, tokens)
+    residual = 3 * tokens * d * 4
+    attn_act = 3 * tokens * d * 2 + 2 * tokens * d * 4 + 3 * attn_chunk * d * 8
+    ffn_act = 2 * ffn_chunk * f * 2 + tokens * d * 4
+    dit_act = residual + max(attn_act, ffn_act) + context_len * d * 4 * 4
+    t5_act = 0 if t5_cpu else 2 * config.text_len * 4096 * 4 * 8
+    vae_act = _vae_memory(h, w, t, vae_tile_size, vae_chunk_size) - vae_bytes
+    video = 3 * frame_num * size[0] * size[1] * 4
+    cond_video = 3 * 81 * size[0] * size[1] * 4
+
+    # the DiT is created on CPU for I2V and moved before sampling
+    dit_early = 0 if i2v and offload_blocks is None else dit_resident
+    dit_late = dit_resident if (not offload_model or
+                                offload_blocks is not None) else 0
+    encoders = 0 if offload_model else t5_gpu + clip_bytes
+
+    memory = EasyDict()
+    memory.text = dit_early + vae_bytes + clip_bytes + t5_gpu + t5_act
+    if i2v:
+        memory.encode = dit_early + vae_bytes + encoders + vae_act + cond_video
+    memory.denoise = dit_resident + vae_bytes + encoders + dit_act
+    memory.decode = dit_late + vae_bytes + encoders + vae_act + video
+
+    # time
+    gpu = tflops * 1e12 * mfu
+    t5_cfg = T5_CONFIGS[config.t5_model]
+    t5_flops = 2 * 2 * config.text_len * (
+        t5_params - t5_cfg['vocab_size'] * t5_cfg['dim'])
+    dit_flops = (2 * seq_len * block * config.num_layers + config.num_layers *
+                 (4 * seq_len * seq_len * d +
+                  4 * seq_len * context_len * d)) / sp_size
+    chunk_penalty = 1 + 0.02 * (attn_chunk < tokens) + 0.02 * (
+        ffn_chunk < tokens)
+    forward = dit_flops / gpu * chunk_penalty
+    if offload_blocks is not None:
+        transfer = block * config.num_layers * bytes_per_param / (
+            h2d_bandwidth * GB)
+        forward = max(forward, transfer) if offload_blocks > 1 else \
+            forward + transfer
+
+    time = EasyDict()
+    time.text = t5_flops / (cpu_tflops * 1e12 * mfu if t5_cpu else gpu)
+    if offload_model:
+        time.text += 2 * (t5_gpu + clip_bytes) / (h2d_bandwidth * GB)
+    if i2v:
+        time.encode = _vae_flops(h, w, 21, vae_tile_size) / (gpu / 2)
+    time.denoise = 2 * sampling_steps * forward
+    if offload_model and offload_blocks is None:
+        time.denoise += 2 * dit_bytes / (h2d_bandwidth * GB)
+    time.decode = _vae_flops(h, w, t, vae_tile_size) / (gpu / 2)
+
+    return EasyDict(
+        offload_model=offload_model,
+        offload_blocks=offload_blocks,
+        t5_cpu=t5_cpu,
+        attn_chunk_size=attn_chunk_size,
+        ffn_chunk_size=ffn_chunk_size,
+        vae_tile_size=vae_tile_size,
+        vae_chunk_size=vae_chunk_size,
+        seq_len=seq_len,
+        memory=memory,
+        time=time,
+        peak_memory=max(memory.values()),
+        total_time=sum(time.values()))
+
+
+def plan_execution(config,
+                   size,
+                   frame_num,
+                   memory_budget,
+                   t5_cpu=None,
+                   **kwargs):
+    r"""
+    Picks the fastest execution plan whose estimated peak memory fits the budget.
+
+    Args:
+        config (EasyDict):
+            Model config from `wan.configs.WAN_CONFIGS`
+        size (tupele[`int`]):
+            Output resolution, (width, height)
+        frame_num (`int`):
+            Number of frames, 4n+1
+        memory_budget (`float`):
+            Device memory budget in GB
+        t5_cpu (`bool`, *optional*, defaults to None):
+            Fixes where T5 runs, e.g. for a quantized or remote T5. None lets the
+            planner choose
+        kwargs:
+            Hardware and sampling arguments forwarded to `estimate_plan`
+
+    Returns:
+        EasyDict:
+            The selected plan. `fits` is False if no candidate fits the budget, in
+            which case the plan with the lowest peak memory is returned.
+    """
+    # candidates compatible with the sharding of the models
+    offloads = [(False, None), (True, None)]
+    if kwargs.get('dit_shards', 1) == 1:
+        offloads += [(True, w) for w in BLOCK_WINDOWS if w < config.num_layers]
+    if t5_cpu is None:
+        t5_cpus = (False,) if kwargs.get('t5_shards', 1) > 1 else (False, True)
+    else:
+        t5_cpus = (t5_cpu,)
+    plans = [
+        estimate_plan(
+            config,
+            size,
+            frame_num,
+            offload_model=offload_model,
+            offload_blocks=offload_blocks,
+            t5_cpu=t5_cpu,
+            attn_chunk_size=attn_chunk_size,
+            ffn_chunk_size=ffn_chunk_size,
+            vae_tile_size=vae_tile_size,
+            **kwargs) for (offload_model, offload_blocks), t5_cpu,
+        attn_chunk_size, ffn_chunk_size, vae_tile_size in itertools.product(
+            offloads, t5_cpus, CHUNK_SIZES, CHUNK_SIZES, VAE_TILE_SIZES)
+    ]
+    fitting = [p for p in plans if p.peak_memory <= memory_budget * GB]
+    if fitting:
+        plan = min(fitting, key=lambda p: p.total_time)
+    else:
+        plan = min(plans, key=lambda p: p.peak_memory)
+    plan.fits = bool(fitting)
+    plan.memory_budget = memory_budget
+    return plan
+
+
+def format_plan(plan):
+    r"""
+    Renders a plan as a human readable multi-line string.
+    """
+    lines = [
+        f'offload_model={plan.offload_model}, offload_blocks={plan.offload_blocks}, t5_cpu={plan.t5_cpu}',
+        f'attn_chunk_size={plan.attn_chunk_size}, ffn_chunk_size={plan.ffn_chunk_size}, vae_tile_size={plan.vae_tile_size}',
+        f'sequence length: {plan.seq_len}'
+    ]
+    for stage in plan.memory:
+        lines.append(
+            f'{stage:>8}: {plan.memory[stage] / GB:7.2f} GB {plan.time[stage]:9.1f} s'
+        )
+    lines.append(
+        f'{"peak":>8}: {plan.peak_memory / GB:7.2f} GB {plan.total_time:9.1f} s')
+    if 'fits' in plan:
+        lines.append(
+            f'fits the {plan.memory_budget:.1f} GB budget: {plan.fits}')
+    return '\n'.join(lines)
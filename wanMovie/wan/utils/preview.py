@@ -0,0 +1,221 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+import os
+import queue
+import threading
+
+import imageio
+import torch
+import torch.nn.functional as F
+
+__all__ = [
+    'LatentPreviewer', 'PreviewWriter', 'preview_projection_path',
+    'stream_previews'
+]
+
+
+def preview_projection_path(vae_checkpoint_path):
+    return f'{os.path.splitext(vae_checkpoint_path)[0]}-preview.pth'
+
+
+def _smooth_images(num_images, size, generator):
+    # random colour fields with structure at several scales, the statistics
+    # of natural images matter less than covering the colour space
+    images = 0
+    for cells in (2, 4, 8, 16):
+        noise = torch.randn(
+            num_images, 3, cells, cells, generator=generator) / cells**0.5
+        images = images + F.interpolate(
+            noise, size=(size, size), mode='bicubic', align_corners=False)
+    return torch.tanh(1.5 * images)
+
+
+class LatentPreviewer:
+
+    def __init__(self, weight, bias, scale=2):
+        r"""
+        Renders latents as low resolution RGB frames through a linear projection
+        of the latent channels, a cheap approximation of `WanVAE.decode` for
+        progress previews.
+
+        Args:
+            weight (`torch.Tensor`):
+                Projection of shape [3, z_dim]
+            bias (`torch.Tensor`):
+                Offset of shape [3]
+            scale (`int`, *optional*, defaults to 2):
+                Upsampling factor applied to the latent resolution, the VAE itself
+                upsamples by 8
+        """
+        self.weight = weight.float()
+        self.bias = bias.float()
+        self.scale = scale
+
+    @classmethod
+    def fit(cls, vae, num_images=64, size=128, seed=0, scale=2):
+        r"""
+        Fits the projection by least squares on random smooth images encoded by
+        `vae`, against the images average pooled to the latent resolution.
+        Each image is encoded as a still clip of 5 frames, so both the first
+        latent frame and the following ones are covered.
+        """
+        generator = torch.Generator(device='cpu').manual_seed(seed)
+        images = _smooth_images(num_images, size, generator).to(vae.device)
+        with torch.no_grad():
+            latents = vae.encode(
+                [u[:, None].expand(-1, 5, -1, -1) for u in images])
+        latents = torch.stack(latents).float()
+        stride = size // latents.shape[-1]
+        targets = F.avg_pool2d(images.float(), stride)
+        targets = targets[:, :, None].expand(-1, -1, latents.shape[2], -1, -1)
+
+        # rows are latent pixels, a column of ones fits the bias
+        x = latents.transpose(0, 1).flatten(1).t()
+        x = torch.cat([x, x.new_ones(x.shape[0], 1)], dim=1)
+        y = targets.transpose(0, 1).flatten(1).t()
+        solution = torch.linalg.lstsq(x.cpu(), y.cpu()).solution
+        residual = (x.cpu() @ solution - y.cpu()).abs().mean().item()
+        logging.info(f'Fitted the latent preview projection, mean abs error '
+                     f'{residual:.3f} on {num_images} images.')
+        return cls(solution[:-1].t(), solution[-1], scale)
+
+    @classmethod
+    def from_vae(cls, vae, path=None, scale=2):
+        r"""
+        Loads the projection from `path`, fitting it on `vae` and caching it
+        there on first use.
+        """
+        if path is not None and os.path.exists(path):
+            state = torch.load(path, map_location='cpu')
+            return cls(state['weight'], state['bias'], scale)
+        previewer = cls.fit(vae, scale=scale)
+        if path is not None:
+            try:
+                # write atomically, other processes may load it concurrently
+                tmp = f'{path}.{os.getpid()}.tmp'
+                torch.save(
+                    dict(weight=previewer.weight, bias=previewer.bias), tmp)
+                os.replace(tmp, path)
+            except OSError as e:
+                logging.warning(
+                    f'Could not cache the preview projection at {path}: {e}')
+        return previewer
+
+    def __call__(self, latent):
+        r"""
+        Renders a latent of shape [C, T, H, W] as uint8 frames of shape
+        [T, H * scale, W * scale, 3] on the CPU.
+        """
+        weight = self.weight.to(latent.device)
+        bias = self.bias.to(latent.device)
+        with torch.no_grad():
+            rgb = torch.einsum('ct,tfhw->fchw', weight, latent.float())
+            rgb = rgb + bias.view(1, 3, 1, 1)
+            if self.scale > 1:
+                rgb = F.interpolate(
+                    rgb, scale_factor=self.scale, mode='bilinear')
+            rgb = rgb.clamp_(-1, 1).add_(1).mul_(127.5)
+            return rgb.to(torch.uint8).permute(0, 2, 3, 1).cpu()
+
+    def strip(self, latent, max_frames=4):
+        r"""
+        Renders up to `max_frames` evenly spaced frames of a latent of shape
+        [C, T, H, W] side by side, as a uint8 image [H', W' * n, 3].
+        """
+        t = latent.shape[1]
+        index = torch.linspace(0, t - 1, min(t, max_frames)).round().long()
+        frames = self(latent[:, index.to(latent.device)])
+        return torch.cat(frames.unbind(0), dim=1)
+
+
+class PreviewWriter:
+
+    def __init__(self, previewer, save_file, every=5, fps=8):
+        r"""
+        Step callback of the pipelines that writes a preview of the denoised
+        estimate every `every` steps. Projection runs on the sampling device,
+        encoding and writing on a background thread; a preview that is still
+        being written when the next one is ready is dropped.
+
+        Args:
+            previewer (`LatentPreviewer`):
+                Renders the latents
+            save_file (`str`):
+                Output path, overwritten by every preview. A GIF for videos, an
+                image for single frames
+            every (`int`, *optional*, defaults to 5):
+                Number of sampling steps between previews
+            fps (`int`, *optional*, defaults to 8):
+                Frame rate of the GIF, one frame per latent frame
+        """
+        self.previewer = previewer
+        self.save_file = save_file
+        self.every = every
+        self.fps = fps
+        self.pending = queue.Queue(maxsize=1)
+        self.worker = threading.Thread(
+            target=self._work, name='wan_preview_writer', daemon=True)
+        self.worker.start()
+
+    def __call__(self, step, num_steps, x0):
+        if (step + 1) % self.every != 0 and step + 1 != num_steps:
+            return
+        frames = self.previewer(x0[0])
+        try:
+            self.pending.put_nowait(frames)
+        except queue.Full:
+            pass
+
+    def _work(self):
+        while True:
+            frames = self.pending.get()
+            if frames is None:
+                return
+            try:
+                tmp = f'{self.save_file}.tmp{os.path.splitext(self.save_file)[1]}'
+                if frames.shape[0] == 1:
+                    imageio.imwrite(tmp, frames[0].numpy())
+                else:
+                    imageio.mimwrite(
+                        tmp, list(frames.numpy()), duration=1000 / self.fps,
+                        loop=0)
+                os.replace(tmp, self.save_file)
+            except Exception as e:
+                logging.warning(f'Could not write preview {self.save_file}: {e}')
+
+    def close(self):
+        r"""
+        Waits for the last preview to be written.
+        """
+        self.pending.put(None)
+        self.worker.join()
+
+
+def stream_previews(generate_fn, previewer, every=5, max_frames=4):
+    r"""
+    Runs `generate_fn(step_callback)` on a worker thread and yields
+    `(preview, None)` every `every` sampling steps, with `preview` a frame strip
+    of the denoised estimate as a numpy array, then `(None, result)`. Meant for
+    generator callbacks of the Gradio apps.
+    """
+    events = queue.Queue()
+
+    def step_callback(step, num_steps, x0):
+        if (step + 1) % every == 0:
+            events.put((previewer.strip(x0[0], max_frames).numpy(), None))
+
+    def work():
+        try:
+            events.put((None, generate_fn(step_callback)))
+        except BaseException as e:
+            events.put((e, None))
+
+    threading.Thread(target=work, name='wan_preview_generation',
+                     daemon=True).start()
+    while True:
+        preview, result = events.get()
+        if isinstance(preview, BaseException):
+            raise preview
+        yield preview, result
+        if preview is None:
+            return
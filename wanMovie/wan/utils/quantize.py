@@ -0,0 +1,140 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Converts the T5 encoder of a checkpoint directory to int8 and reports the
+parity of its embeddings with the bf16 encoder:
+
+    python -m wan.utils.quantize --ckpt_dir ./Wan2.1-T2V-1.3B
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+import torch
+import torch.nn.functional as F
+from easydict import EasyDict
+
+__all__ = ['embedding_parity', 'format_parity']
+
+PARITY_PROMPTS = [
+    "Two anthropomorphic cats in comfy boxing gear and bright gloves fight intensely on a spotlighted stage.",
+    "Summer beach vacation style, a white cat wearing sunglasses sits on a surfboard.",
+    "A drone shot over a misty pine forest at sunrise, slow forward motion.",
+    "一个朴素端庄的美人",
+    "色调艳丽，过曝，静态，细节模糊不清，字幕，风格，作品，画作，画面，静止，整体发灰，最差质量，低质量",
+]
+
+
+def embedding_parity(reference, candidate):
+    r"""
+    Compares two lists of per-text embeddings of shape [L, C].
+
+    Returns:
+        EasyDict with the mean and worst per-token cosine similarity and the
+        mean and worst relative L2 error of every text.
+    """
+    cosine, rel_l2 = [], []
+    for r, c in zip(reference, candidate):
+        r, c = r.float(), c.float()
+        cosine.append(F.cosine_similarity(r, c, dim=-1))
+        rel_l2.append(((c - r).norm() / r.norm()).view(1))
+    cosine, rel_l2 = torch.cat(cosine), torch.cat(rel_l2)
+    return EasyDict(
+        cosine_mean=cosine.mean().item(),
+        cosine_min=cosine.min().item(),
+        rel_l2_mean=rel_l2.mean().item(),
+        rel_l2_max=rel_l2.max().item())
+
+
+def format_parity(parity):
+    return (f"cosine similarity: mean {parity.cosine_mean:.5f}, "
+            f"min {parity.cosine_min:.5f}; relative L2 error: "
+            f"mean {parity.rel_l2_mean:.5f}, max {parity.rel_l2_max:.5f}")
+
+
+def _parse_args():
+    from ..configs import WAN_CONFIGS
+    parser = argparse.ArgumentParser(
+        description="Quantize the Wan T5 encoder to int8 for --t5_cpu")
+    parser.add_argument(
+        "--ckpt_dir",
+        type=str,
+        required=True,
+        help="The path to the checkpoint directory.")
+    parser.add_argument(
+        "--task",
+        type=str,
+        default="t2v-14B",
+        choices=list(WAN_CONFIGS.keys()),
+        help="The task whose config names the T5 checkpoint.")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="The quantized checkpoint. Defaults to the path generate.py looks up next to the T5 checkpoint."
+    )
+    parser.add_argument(
+        "--prompts",
+        type=str,
+        default=None,
+        help="A text file with one prompt per line used for the parity report.")
+    parser.add_argument(
+        "--skip_report",
+        action="store_true",
+        default=False,
+        help="Only convert, without comparing against the bf16 encoder.")
+    return parser.parse_args()
+
+
+def main():
+    from ..configs import WAN_CONFIGS
+    from ..modules.t5 import T5EncoderModel, quantized_t5_path
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+    args = _parse_args()
+    cfg = WAN_CONFIGS[args.task]
+    checkpoint_path = os.path.join(args.ckpt_dir, cfg.t5_checkpoint)
+    output = args.output or quantized_t5_path(checkpoint_path)
+    if os.path.exists(output):
+        logging.info(f"Reusing existing {output}")
+
+    kwargs = dict(
+        text_len=cfg.text_len,
+        dtype=cfg.t5_dtype,
+        device=torch.device('cpu'),
+        checkpoint_path=checkpoint_path,
+        tokenizer_path=os.path.join(args.ckpt_dir, cfg.t5_tokenizer),
+        cache_size=0)
+    quantized = T5EncoderModel(
+        quantization='int8', quantized_checkpoint_path=output, **kwargs)
+    if args.skip_report:
+        return
+
+    prompts = PARITY_PROMPTS
+    if args.prompts is not None:
+        with open(args.prompts, encoding='utf-8') as f:
+            prompts = [u.strip() for u in f if u.strip()]
+
+    timings = {}
+    with torch.no_grad():
+        start = time.perf_counter()
+        candidate = quantized(prompts, torch.device('cpu'))
+        timings['int8'] = time.perf_counter() - start
+        del quantized
+        reference_model = T5EncoderModel(**kwargs)
+        start = time.perf_counter()
+        reference = reference_model(prompts, torch.device('cpu'))
+        timings['bf16'] = time.perf_counter() - start
+
+    logging.info(f"Parity of {len(prompts)} prompts against the bf16 encoder: "
+                 f"{format_parity(embedding_parity(reference, candidate))}")
+    logging.info(f"CPU encoding time: bf16 {timings['bf16']:.2f}s, "
+                 f"int8 {timings['int8']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import gc
+import logging
+import threading
+
+import torch
+
+__all__ = ['ComponentRegistry', 'default_registry']
+
+
+class _Entry:
+
+    def __init__(self):
+        self.component = None
+        self.refs = 0
+        self.prepared = False
+        self.lock = threading.Lock()
+
+
+class ComponentRegistry:
+    r"""
+    Process-wide, reference counted store of loaded model components.
+
+    Components are keyed by a hashable tuple, typically the kind of component,
+    its checkpoint path, its dtype and its placement. Pipelines acquire their
+    components through the registry so that pipeline objects built from the
+    same checkpoints share one resident copy. Released components stay cached
+    until they are evicted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def acquire(self, key, factory):
+        r"""
+        Returns the component stored under `key`, creating it with `factory` on
+        first use, and increments its reference count. Thread-safe: concurrent
+        acquisitions of the same key load the component once.
+        """
+        with self._lock:
+            entry = self._entries.setdefault(key, _Entry())
+            entry.refs += 1
+        with entry.lock:
+            if entry.component is None:
+                try:
+                    entry.component = factory()
+                except BaseException:
+                    self.release(key)
+                    raise
+            else:
+                logging.info(f'Reusing shared component {key}')
+            return entry.component
+
+    def prepare(self, key, fn):
+        r"""
+        Replaces the component stored under `key` by `fn(component)` exactly once,
+        e.g. to shard or place it. Later calls return the prepared component.
+        """
+        entry = self._entries[key]
+        with entry.lock:
+            if not entry.prepared:
+                entry.component = fn(entry.component)
+                entry.prepared = True
+            return entry.component
+
+    def release(self, key, evict=False):
+        r"""
+        Decrements the reference count of `key`. Unreferenced components are
+        dropped right away if `evict` is True, otherwise they stay cached.
+        """
+        with self._lock:
+            entry = self._entries[key]
+            entry.refs -= 1
+            assert entry.refs >= 0, f'{key} released more often than acquired'
+            if entry.refs == 0 and (evict or entry.component is None):
+                del self._entries[key]
+                evicted = True
+            else:
+                evicted = False
+        if evicted:
+            self._collect()
+
+    def evict(self, key=None):
+        r"""
+        Drops unreferenced components, all of them if `key` is None.
+
+        Returns:
+            List of evicted keys.
+        """
+        with self._lock:
+            keys = [
+                k for k, entry in self._entries.items()
+                if entry.refs == 0 and (key is None or k == key)
+            ]
+            for k in keys:
+                del self._entries[k]
+        if keys:
+            self._collect()
+        return keys
+
+    def refs(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return 0 if entry is None else entry.refs
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _collect(self):
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+# shared by all pipelines unless they are given their own registry
+default_registry = ComponentRegistry()
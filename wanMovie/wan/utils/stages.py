@@ -0,0 +1,66 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+__all__ = ['TextEncodingStage']
+
+
+class TextEncodingStage:
+
+    def __init__(self, encode_fn, max_pending=4):
+        r"""
+        Runs text encoding on a worker thread so that the prompts of the next jobs
+        are encoded while the current job is sampling.
+
+        The embeddings are handed over as the tensors `encode_fn` returns, without
+        copies or serialization. Meant for T5 on the CPU, whose kernels release
+        the GIL while the DiT runs on the GPU.
+
+        Args:
+            encode_fn (`callable`):
+                Called as `encode_fn(input_prompt, n_prompt)`, e.g. the
+                `encode_prompts` method of a pipeline created with t5_cpu
+            max_pending (`int`, *optional*, defaults to 4):
+                Maximum number of prompts waiting for encoding. `submit` blocks while
+                the queue is full
+        """
+        self.encode_fn = encode_fn
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.worker = threading.Thread(
+            target=self._work, name='wan_text_encoder', daemon=True)
+        self.worker.start()
+
+    def submit(self, input_prompt, n_prompt=""):
+        r"""
+        Queues a prompt and returns a `Future` of the `encode_fn` result.
+        """
+        future = Future()
+        self.pending.put((future, input_prompt, n_prompt))
+        return future
+
+    def _work(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            future, input_prompt, n_prompt = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            try:
+                future.set_result(self.encode_fn(input_prompt, n_prompt))
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                logging.info(
+                    f'Encoded prompt in {time.perf_counter() - start:.2f}s.')
+
+    def close(self):
+        r"""
+        Stops the worker after the queued prompts are encoded.
+        """
+        self.pending.put(None)
+        self.worker.join()
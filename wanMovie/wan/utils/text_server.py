@@ -0,0 +1,274 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+r"""
+Hosts one T5 encoder for any number of pipeline processes on the same host:
+
+    python -m wan.utils.text_server --ckpt_dir ./Wan2.1-T2V-14B --socket /tmp/wan_t5.sock
+
+Pipelines created with `t5_socket` (`generate.py --t5_socket`) then send their
+prompts to the server instead of loading T5 themselves. Requests and replies
+are small pickled frames on a Unix socket, the embeddings are written by the
+server into a shared memory buffer owned by each client.
+"""
+import argparse
+import logging
+import os
+import pickle
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import torch
+
+__all__ = ['TextEncoderServer', 'TextEncoderClient']
+
+_HEADER = struct.Struct('>Q')
+
+
+def _send(sock, obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 1 << 20))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return bytes(data)
+
+
+def _recv(sock):
+    size, = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return pickle.loads(_recv_exactly(sock, size))
+
+
+def _attach(name):
+    # the client owns the buffer, it must not be unlinked when we exit
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class TextEncoderServer:
+
+    def __init__(self, text_encoder, path, device=torch.device('cpu')):
+        r"""
+        Serves a `T5EncoderModel` on a Unix socket.
+
+        Args:
+            text_encoder (`T5EncoderModel`):
+                Encoder shared by all clients. Requests are encoded one at a time
+            path (`str`):
+                Path of the Unix socket
+            device (`torch.device`, *optional*, defaults to CPU):
+                Device the encoder runs on
+        """
+        self.text_encoder = text_encoder
+        self.path = path
+        self.device = device
+        self.lock = threading.Lock()
+
+    def encode(self, texts):
+        with self.lock, torch.no_grad():
+            return [u.cpu() for u in self.text_encoder(texts, self.device)]
+
+    def _handler(self):
+        server = self
+
+        class Handler(socketserver.BaseRequestHandler):
+
+            def handle(self):
+                buffers = {}
+                try:
+                    while True:
+                        try:
+                            request = _recv(self.request)
+                        except ConnectionError:
+                            return
+                        try:
+                            reply = self._encode(request, buffers)
+                        except Exception as e:
+                            logging.exception('Text encoding failed.')
+                            reply = dict(error=f'{type(e).__name__}: {e}')
+                        _send(self.request, reply)
+                finally:
+                    for shm in buffers.values():
+                        shm.close()
+
+            def _encode(self, request, buffers):
+                context = server.encode(request['texts'])
+                nbytes = sum(u.numel() * u.element_size() for u in context)
+                if nbytes > request['nbytes']:
+                    return dict(resize=nbytes)
+
+                # write the embeddings back to back into the client buffer
+                name = request['shm']
+                if name not in buffers:
+                    for shm in buffers.values():
+                        shm.close()
+                    buffers.clear()
+                    buffers[name] = _attach(name)
+                buf = torch.frombuffer(
+                    buffers[name].buf, dtype=torch.uint8, count=nbytes)
+                tensors, offset = [], 0
+                for u in context:
+                    u = u.contiguous()
+                    size = u.numel() * u.element_size()
+                    buf[offset:offset + size].copy_(
+                        u.view(torch.uint8).flatten())
+                    tensors.append((offset, tuple(u.shape), u.dtype))
+                    offset += size
+                del buf
+                return dict(tensors=tensors)
+
+        return Handler
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        with socketserver.ThreadingUnixStreamServer(self.path,
+                                                    self._handler()) as server:
+            server.daemon_threads = True
+            logging.info(f'Serving T5 on unix socket {self.path}')
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                logging.info('Shutting down.')
+            finally:
+                os.remove(self.path)
+
+
+class TextEncoderClient:
+
+    def __init__(self, path, nbytes=2 * 512 * 4096 * 2):
+        r"""
+        Drop-in replacement of `T5EncoderModel` that encodes on a
+        `TextEncoderServer`.
+
+        Args:
+            path (`str`):
+                Path of the server's Unix socket
+            nbytes (`int`, *optional*, defaults to two 512 token bf16 contexts):
+                Initial size of the shared memory buffer, grown on demand
+        """
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.lock = threading.Lock()
+        self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+
+    def __call__(self, texts, device):
+        with self.lock:
+            while True:
+                _send(self.sock,
+                      dict(texts=list(texts), shm=self.shm.name,
+                           nbytes=self.shm.size))
+                reply = _recv(self.sock)
+                if 'error' in reply:
+                    raise RuntimeError(
+                        f'text encoder server: {reply["error"]}')
+                if 'resize' not in reply:
+                    break
+                self._release()
+                self.shm = shared_memory.SharedMemory(
+                    create=True, size=reply['resize'])
+
+            # one copy out of the shared buffer, which the next call reuses
+            buf = torch.frombuffer(self.shm.buf, dtype=torch.uint8)
+            context = []
+            for offset, shape, dtype in reply['tensors']:
+                size = dtype.itemsize * torch.Size(shape).numel()
+                context.append(buf[offset:offset + size].view(dtype).view(
+                    shape).to(device, copy=True))
+            del buf
+            return context
+
+    def _release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.sock.close()
+        self._release()
+        self.shm = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _parse_args():
+    from ..configs import WAN_CONFIGS
+    parser = argparse.ArgumentParser(
+        description="Serve the Wan T5 encoder to pipeline processes")
+    parser.add_argument(
+        "--ckpt_dir",
+        type=str,
+        required=True,
+        help="The path to the checkpoint directory.")
+    parser.add_argument(
+        "--task",
+        type=str,
+        default="t2v-14B",
+        choices=list(WAN_CONFIGS.keys()),
+        help="The task whose config names the T5 checkpoint.")
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default="/tmp/wan_t5.sock",
+        help="The Unix socket to listen on.")
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cpu",
+        help="The device to run T5 on, e.g. cpu or cuda:0.")
+    parser.add_argument(
+        "--t5_quant",
+        type=str,
+        default=None,
+        choices=["int8"],
+        help="Run the T5 model quantized, only works on CPU.")
+    parser.add_argument(
+        "--t5_cache_dir",
+        type=str,
+        default=None,
+        help="The directory persisting prompt embeddings.")
+    return parser.parse_args()
+
+
+def main():
+    from ..configs import WAN_CONFIGS
+    from ..modules.t5 import T5EncoderModel
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s: %(message)s",
+        handlers=[logging.StreamHandler(stream=sys.stdout)])
+    args = _parse_args()
+    cfg = WAN_CONFIGS[args.task]
+    device = torch.device(args.device)
+    text_encoder = T5EncoderModel(
+        text_len=cfg.text_len,
+        dtype=cfg.t5_dtype,
+        device=device,
+        checkpoint_path=os.path.join(args.ckpt_dir, cfg.t5_checkpoint),
+        tokenizer_path=os.path.join(args.ckpt_dir, cfg.t5_tokenizer),
+        cache_dir=args.t5_cache_dir,
+        quantization=args.t5_quant)
+    TextEncoderServer(text_encoder, args.socket, device).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,20 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
 import argparse
 import binascii
+import logging
 import os
 import os.path as osp
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import imageio
 import torch
 import torchvision
 
-__all__ = ['cache_video', 'cache_image', 'str2bool']
+__all__ = [
+    'cache_video', 'cache_video_stream', 'cache_image', 'str2bool',
+    'load_in_parallel'
+]
 
 
 def rand_name(length=8, suffix=''):
@@ -61,6 +67,33 @@ def cache_video(tensor,
         return None
 
 
+def cache_video_stream(chunks,
+                       save_file=None,
+                       fps=30,
+                       suffix='.mp4',
+                       value_range=(-1, 1)):
+    r"""
+    Writes a video from an iterable of [C, T, H, W] chunks, e.g.
+    `WanVAE.decode_stream`, converting each chunk to uint8 frames as it
+    arrives. Unlike `cache_video`, a failed write cannot be retried since the
+    chunks are consumed.
+    """
+    cache_file = osp.join('/tmp', rand_name(
+        suffix=suffix)) if save_file is None else save_file
+    low, high = min(value_range), max(value_range)
+
+    writer = imageio.get_writer(cache_file, fps=fps, codec='libx264', quality=8)
+    try:
+        for chunk in chunks:
+            chunk = chunk.clamp(low, high).sub_(low).div_(max(high - low, 1e-5))
+            chunk = chunk.mul_(255).type(torch.uint8).permute(1, 2, 3, 0).cpu()
+            for frame in chunk.numpy():
+                writer.append_data(frame)
+    finally:
+        writer.close()
+    return cache_file
+
+
 def cache_image(tensor,
                 save_file,
                 nrow=8,
@@ -116,3 +149,45 @@ def str2bool(v):
         return False
     else:
         raise argparse.ArgumentTypeError('Boolean value expected (True/False)')
+
+
+def load_in_parallel(loaders, max_workers=None):
+    r"""
+    Runs independent component loaders concurrently on a thread pool.
+
+    Loading is dominated by disk reads and deserialization, which release the
+    GIL, so the wall time is bounded by the slowest loader instead of the sum.
+
+    Args:
+        loaders (`dict`):
+            Maps a component name to a callable without arguments
+        max_workers (`int`, *optional*, defaults to None):
+            Size of the thread pool. If None, use one thread per loader
+
+    Returns:
+        tuple[dict, dict]:
+            The loaded components and their load times in seconds, both keyed
+            by component name.
+    """
+    timings = {}
+
+    def timed(name, loader):
+        start = time.perf_counter()
+        component = loader()
+        timings[name] = time.perf_counter() - start
+        logging.info(f'Loaded {name} in {timings[name]:.2f}s')
+        return component
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(
+            max_workers=max_workers or len(loaders),
+            thread_name_prefix='wan_loader') as executor:
+        futures = {
+            name: executor.submit(timed, name, loader)
+            for name, loader in loaders.items()
+        }
+        components = {name: future.result() for name, future in futures.items()}
+    logging.info(
+        f'Loaded {", ".join(loaders)} in {time.perf_counter() - start:.2f}s '
+        f'(sequential: {sum(timings.values()):.2f}s)')
+    return components, timings